@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+"""
+Persisted results of a character network run.
+
+A run is stored as a folder of uncompressed .npy arrays plus a small metadata.json, so the matrices can
+be memory-mapped with np.load(..., mmap_mode='r') instead of being recomputed in the notebook.
+"""
+import json
+import os
+
+import numpy as np
+
+ARRAYS = ('name_frequency', 'cooccurrence_matrix', 'sentiment_matrix')
+
+
+def save_run(path, name_list, name_frequency, cooccurrence_matrix, sentiment_matrix, align_rate, **metadata):
+    '''
+    Function to persist the results of top_names and calculate_matrix.
+    :param path: the folder to write the run to (created if missing).
+    :param name_list: the list of top names, as returned by top_names.
+    :param name_frequency: the list of top names' frequency, as returned by top_names.
+    :param cooccurrence_matrix: the co-occurrence matrix returned by calculate_matrix.
+    :param sentiment_matrix: the sentiment matrix returned by calculate_matrix.
+    :param align_rate: the align rate returned by calculate_align_rate.
+    :param metadata: any other JSON-serialisable information (novel name, threshold_rate, ...).
+    :return: the path of the run.
+    '''
+    os.makedirs(path, exist_ok=True)
+    arrays = {'name_frequency': np.asarray(name_frequency, dtype=np.int64),
+              'cooccurrence_matrix': np.asarray(cooccurrence_matrix),
+              'sentiment_matrix': np.asarray(sentiment_matrix)}
+    for key, array in arrays.items():
+        _atomic_save(os.path.join(path, key + '.npy'), array)
+    metadata = dict(metadata, name_list=list(name_list), align_rate=float(align_rate),
+                    shape=list(arrays['cooccurrence_matrix'].shape))
+    tmp_path = os.path.join(path, 'metadata.json.tmp')
+    with open(tmp_path, 'w') as f:
+        json.dump(metadata, f)
+    os.replace(tmp_path, os.path.join(path, 'metadata.json'))
+    return path
+
+
+def _atomic_save(file_path, array):
+    tmp_path = file_path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        np.save(f, array)
+    os.replace(tmp_path, file_path)
+
+
+def load_run(path, mmap_mode='r'):
+    '''
+    Function to load a run written by save_run.
+    :param path: the folder of the run.
+    :param mmap_mode: passed to np.load; 'r' memory-maps the arrays, None reads them into memory.
+    :return: a dictionary with name_list, align_rate, the arrays in ARRAYS and the other metadata.
+    '''
+    with open(os.path.join(path, 'metadata.json')) as f:
+        run = json.load(f)
+    for key in ARRAYS:
+        run[key] = np.load(os.path.join(path, key + '.npy'), mmap_mode=mmap_mode)
+    return run
+
+
+def load_runs(folder, mmap_mode='r'):
+    '''
+    Function to load every run stored under a folder, e.g. one run per book.
+    :param folder: the folder holding one sub-folder per run.
+    :param mmap_mode: see load_run.
+    :return: a dictionary of {run name: run}.
+    '''
+    runs = {}
+    for name in sorted(os.listdir(folder)):
+        if os.path.isfile(os.path.join(folder, name, 'metadata.json')):
+            runs[name] = load_run(os.path.join(folder, name), mmap_mode)
+    return runs
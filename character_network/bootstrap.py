@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+"""
+Bootstrapped character gazetteer.
+
+After the first book most of the cast is known, yet iterative_NER runs the statistical NER on every
+sentence of the later, longer books. The bootstrap mode compiles the names accepted by iterative_NER's
+threshold (plus the alias lists of character_network_iterative.py) into an EntityRuler on a
+tokenizer-only pipeline, which tags the known names. The statistical model only runs on the sentences
+that still have a capitalised token the gazetteer does not explain, and on a small random sample, so new
+characters are still discovered; with learn=True they are added to the gazetteer for the next books.
+
+    ruler_nlp = build_character_ruler(iterative_NER(nlp_func, book1_sentences))
+    names = iterative_NER_bootstrap(ruler_nlp, nlp_func, book2_sentences, learn=True)
+"""
+import random
+from collections import Counter
+
+import spacy
+from spacy.language import Language
+from spacy.util import filter_spans
+
+from character_network_iterative import compile_stop_words, flatten, iterative_NER, name_entity_recognition
+from instrumentation import count, instrumented
+from prefilter import ALIASES, CandidateFilter
+
+RULER_NAME = 'character_ruler'
+
+
+@Language.component('capitalised_names')
+def capitalised_names(doc):
+    '''
+    Pipeline stage dropping the gazetteer matches that do not start with an uppercase letter, so the
+    common words among the names ('fluffy', 'fang', 'sprout') are only names when written as one.
+    '''
+    doc.ents = filter_spans([ent for ent in doc.ents if ent.text[:1].isupper()])
+    return doc
+
+
+@instrumented
+def build_character_ruler(name_list, aliases=ALIASES, language='en'):
+    '''
+    Function to compile known names into a tokenizer-only pipeline tagging them as PERSON entities. The
+    names match in any case ('McGonagall', 'MCGONAGALL') but only from an uppercase first letter.
+    :param name_list: the known names, e.g. the output of iterative_NER on the first book.
+    :param aliases: extra known names and multi-word aliases ('harry potter', 'professor snape', ...).
+    :param language: the language of the blank pipeline.
+    :return: the spaCy Language, usable as the nlp_func of name_entity_recognition.
+    '''
+    nlp = spacy.blank(language)
+    nlp.add_pipe('entity_ruler', name=RULER_NAME, config={'phrase_matcher_attr': 'LOWER'})
+    nlp.add_pipe('capitalised_names')
+    add_known_names(nlp, list(name_list) + list(aliases))
+    return nlp
+
+
+def add_known_names(ruler_nlp, name_list):
+    '''
+    :param ruler_nlp: a pipeline returned by build_character_ruler.
+    :param name_list: names to add to its gazetteer (names already in it are skipped).
+    '''
+    ruler = ruler_nlp.get_pipe(RULER_NAME)
+    known = set(p['pattern'] for p in ruler.patterns)
+    new = sorted(set(name.lower() for name in name_list) - known)
+    ruler.add_patterns([{'label': 'PERSON', 'pattern': name} for name in new])
+    count('gazetteer names', len(new))
+
+
+def _unexplained(doc, candidate_filter):
+    # blank out the known names, then look for a capitalised token the gazetteer does not explain
+    text = doc.text
+    for ent in reversed(doc.ents):
+        text = text[:ent.start_char] + ' ' * len(ent.text) + text[ent.end_char:]
+    return candidate_filter(text)
+
+
+@instrumented
+def iterative_NER_bootstrap(ruler_nlp, nlp_func, sentence_list, threshold_rate=0.0005, sample_rate=0.02,
+                            learn=False, seed=0):
+    '''
+    A version of iterative_NER where the known names come from the gazetteer of ruler_nlp and the
+    statistical NER of nlp_func only runs on the sentences with unexplained capitalised tokens, and on a
+    random sample of sample_rate of the other sentences.
+    :param ruler_nlp: the pipeline returned by build_character_ruler.
+    :param nlp_func: the spaCy Language used for the statistical NER.
+    :param sentence_list: the list of sentences from the novel
+    :param threshold_rate: the per sentence frequency threshold, as in iterative_NER.
+    :param sample_rate: the share of fully explained sentences that still go through the statistical NER.
+    :param learn: whether the names passing the threshold are added to the gazetteer of ruler_nlp.
+    :param seed: the seed of the sampling.
+    :return: a non-duplicate list of names in the novel.
+    '''
+    rng = random.Random(seed)
+    # the alias trie is not needed here: the known names are already blanked out
+    candidate_filter = CandidateFilter(aliases=())
+    stop_words = compile_stop_words()
+    output = []
+    for i, doc in zip(sentence_list, ruler_nlp.pipe(sentence_list, batch_size=1000)):
+        if _unexplained(doc, candidate_filter) or rng.random() < sample_rate:
+            count('sentences sent to statistical NER')
+            name_list = name_entity_recognition(nlp_func, i, other_stop_words=stop_words)
+        else:
+            count('sentences tagged by gazetteer')
+            name_list = name_entity_recognition(lambda sentence: doc, i, other_stop_words=stop_words)
+        if name_list != []:
+            output.append(name_list)
+    output = Counter(flatten(output))
+    output = [x for x in output if output[x] >= threshold_rate * len(sentence_list)]
+    count('names above threshold', len(output))
+    if learn:
+        add_known_names(ruler_nlp, output)
+    return output
+
+
+@instrumented
+def bootstrap_series(nlp_func, sentence_lists, threshold_rate=0.0005, sample_rate=0.02, aliases=ALIASES):
+    '''
+    Function to extract the names of a series: the first book goes through iterative_NER, its names seed
+    the gazetteer, and every later book goes through iterative_NER_bootstrap, adding its new names to the
+    gazetteer.
+    :param nlp_func: the spaCy Language used for the statistical NER.
+    :param sentence_lists: the lists of sentences of the books, in order.
+    :param threshold_rate: the per sentence frequency threshold, as in iterative_NER.
+    :param sample_rate: see iterative_NER_bootstrap.
+    :param aliases: the aliases added to the gazetteer.
+    :return: the list of names of each book.
+    '''
+    if not sentence_lists:
+        return []
+    name_lists = [iterative_NER(nlp_func, sentence_lists[0], threshold_rate)]
+    ruler_nlp = build_character_ruler(name_lists[0], aliases)
+    for sentence_list in sentence_lists[1:]:
+        name_lists.append(iterative_NER_bootstrap(ruler_nlp, nlp_func, sentence_list, threshold_rate, sample_rate,
+                                                  learn=True))
+    return name_lists
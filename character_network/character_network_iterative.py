@@ -4,15 +4,19 @@ Created on Tues Oct 16 23:33:04 2018
 @author: Ken Huang
 """
 
+import re
 import spacy
 import pandas as pd
 import numpy as np
 import networkx as nx
 import matplotlib.pyplot as plt
-from afinn import Afinn
 from nltk.tokenize import sent_tokenize
 from sklearn.feature_extraction.text import CountVectorizer
 
+from instrumentation import instrumented, count
+from name_normaliser import name_normaliser
+from sentiment import default_scorer
+
 common_words = {"an", "alcohol", "storm", "colleague", "ethics", "cheese", "blame", "regulatory", "parental", "doubt",
                 "among", "interaction", "asset", "rapidly", "sail", "mobile", "builder", "desperate", "top", "dramatic",
                 "extension", "fold", "cow", "government", "pat", "turkey", "conclude", "presidential", "cell",
@@ -509,6 +513,7 @@ def flatten(input_list):
 #     return set(common_words)
 
 
+@instrumented
 def read_text(novel_folder, novel_name):
     '''
     This function reads the text into python from a text file.
@@ -516,54 +521,102 @@ def read_text(novel_folder, novel_name):
     to your file.
     '''
     with open(f"{novel_folder}/{novel_name}", 'r') as f:
-        book = f.read().replace('\r', ' ').replace('\n', ' ').replace("\'", "'")
+        book = clean_text(f.read())
     return book
 
 
-def name_entity_recognition(nlp_func, sentence, labels=None, other_stop_words=None):
+@instrumented
+def clean_text(text):
+    '''
+    This function joins the lines of a raw text into one block, as read_text does.
+    '''
+    return name_normaliser.normalise_text(text)
+
+
+class StopWords(frozenset):
+    '''
+    The precompiled set of words filtered out of name entities (see compile_stop_words).
+    '''
+
+
+def compile_stop_words(other_stop_words=None):
+    '''
+    A function to precompile the stop-word filter used by name_entity_recognition. The 4000 common
+    words and the extra stop words (e.g. a list of names when extracting places) are merged once into
+    a single frozenset, so every membership check is a hash lookup whatever the size of the inputs.
+    :param other_stop_words: extra words to filter out, in any iterable.
+    :return: the StopWords set of words to filter out.
+    '''
+    if isinstance(other_stop_words, StopWords):
+        return other_stop_words
+    if not other_stop_words:
+        return _default_stop_words
+    return StopWords(common_words.union(other_stop_words))
+
+
+_default_stop_words = StopWords(common_words)
+
+
+def name_entity_recognition(nlp_func, sentence, labels=None, other_stop_words=None, normaliser=None):
     '''
     A function to retrieve name entities in a sentence.
     :param sentence: the sentence to retrieve names from.
+    :param other_stop_words: extra words to filter out, preferably precompiled by compile_stop_words.
+    :param normaliser: the NameNormaliser applied to each entity, name_normaliser by default.
     :return: a name entity list of the sentence.
     '''
+    if normaliser is None:
+        normaliser = name_normaliser
     flag = False
     if labels is None:
         flag = True
         labels = ['PERSON', 'ORG']
+    other_stop_words = compile_stop_words(other_stop_words)
     doc = nlp_func(sentence)
-    # retrieve person and organization's name from the sentence
-    name_entity = [x for x in doc.ents if x.label_ in labels]
-    # convert all names to lowercase and remove 's in names
-    name_entity = [str(x).lower().replace("'s", "") for x in name_entity]
-    # split names into single words ('Harry Potter' -> ['Harry', 'Potter'])
-    if flag:
-        name_entity = [x.split(' ') for x in name_entity]
-        # flatten the name list
-        name_entity = flatten(name_entity)
-
-    # remove name words that are less than 3 letters to raise recognition accuracy
-    name_entity = [x for x in name_entity if len(x) >= 3]
-    # remove name words that are in the set of 4000 common words
-    name_entity = [x for x in name_entity if x not in common_words]
-    a = len(name_entity)
-    if other_stop_words:
-        name_entity = [x for x in name_entity if x not in other_stop_words]
-    b = len(name_entity)
+    name_entity = []
+    dropped_short = dropped_common = 0
+    # retrieve person and organization's name from the sentence and filter them in one pass
+    for x in doc.ents:
+        if x.label_ not in labels:
+            continue
+        # convert all names to lowercase and remove 's in names (memoised per span text)
+        name = normaliser(x.text)
+        # split names into single words ('Harry Potter' -> ['Harry', 'Potter'])
+        words = name.split(' ') if flag else [name]
+        for w in words:
+            # remove name words that are less than 3 letters to raise recognition accuracy
+            if len(w) < 3:
+                dropped_short += 1
+            # remove name words that are in the set of 4000 common words or in the other stop words
+            elif w in other_stop_words:
+                dropped_common += 1
+            else:
+                name_entity.append(w)
+    count('sentences processed')
+    count('entities kept', len(name_entity))
+    count('entities dropped (short)', dropped_short)
+    count('entities dropped (common words)', dropped_common)
     return name_entity
 
 
-def iterative_NER(nlp_func, sentence_list, threshold_rate=0.0005):
+@instrumented
+def iterative_NER(nlp_func, sentence_list, threshold_rate=0.0005, prefilter=None):
     '''
     A function to execute the name entity recognition function iteratively. The purpose of this
     function is to recognise all the important names while reducing recognition errors.
     :param sentence_list: the list of sentences from the novel
     :param threshold_rate: the per sentence frequency threshold, if a word's frequency is lower than this
     threshold, it would be removed from the list because there might be recognition errors.
+    :param prefilter: optional function (e.g. prefilter.CandidateFilter()) returning False for sentences
+    that cannot contain a name; those sentences skip NER but still count in the threshold.
     :return: a non-duplicate list of names in the novel.
     '''
 
     output = []
     for i in sentence_list:
+        if prefilter is not None and not prefilter(i):
+            count('sentences skipped by prefilter')
+            continue
         name_list = name_entity_recognition(nlp_func, i)
         if name_list != []:
             output.append(name_list)
@@ -571,23 +624,31 @@ def iterative_NER(nlp_func, sentence_list, threshold_rate=0.0005):
     from collections import Counter
     output = Counter(output)
     output = [x for x in output if output[x] >= threshold_rate * len(sentence_list)]
+    count('names above threshold', len(output))
 
     return output
 
 
-def iterative_NER_v2(nlp_func, sentence_list, threshold_rate=0.0005, extract_places=False, other_stop_words=None):
+@instrumented
+def iterative_NER_v2(nlp_func, sentence_list, threshold_rate=0.0005, extract_places=False, other_stop_words=None,
+                     prefilter=None):
     '''
     A function to execute the name entity recognition function iteratively. The purpose of this
     function is to recognise all the important names while reducing recognition errors.
     :param sentence_list: the list of sentences from the novel
     :param threshold_rate: the per sentence frequency threshold, if a word's frequency is lower than this
     threshold, it would be removed from the list because there might be recognition errors.
+    :param prefilter: optional function returning False for sentences that skip NER, see iterative_NER.
     :return: a non-duplicate list of names in the novel.
     '''
     output = []
+    stop_words = compile_stop_words(other_stop_words)
     for i in sentence_list:
+        if prefilter is not None and not prefilter(i):
+            count('sentences skipped by prefilter')
+            continue
         if extract_places:
-            name_list = name_entity_recognition(nlp_func, i, ["GPE", "LOC", "FAC"], other_stop_words)
+            name_list = name_entity_recognition(nlp_func, i, ["GPE", "LOC", "FAC"], stop_words)
         else:
             name_list = name_entity_recognition(nlp_func, i)
         if name_list != []:
@@ -596,10 +657,74 @@ def iterative_NER_v2(nlp_func, sentence_list, threshold_rate=0.0005, extract_pla
     from collections import Counter
     output = Counter(output)
     output = [x for x in output if output[x] >= threshold_rate * len(sentence_list)]
-    print(f"output len:{len(output)}")
+    count('names above threshold', len(output))
     return output
 
 
+@instrumented
+def iterative_NER_bounded(nlp_func, sentence_list, threshold_rate=0.0005, extract_places=False,
+                          other_stop_words=None, width=2 ** 16, depth=4, max_candidates=10000):
+    '''
+    A memory-bounded version of iterative_NER_v2 for huge corpora. Instead of an exact Counter of every
+    entity string (including one-off misrecognitions), the first pass counts into a count-min sketch and
+    only remembers the strings whose estimate reaches the threshold, at most max_candidates of them (those
+    with the highest estimates). Estimates never undercount, so no name that passes the threshold is lost
+    unless more than max_candidates do. The threshold is at least one mention: on short texts or with small
+    rates every recognised string passes it, and then the cap is what bounds the memory. A second pass
+    recounts the candidates exactly, running NER again on the sentences that contain one of them; keeping
+    the entities of the first pass instead would take memory in proportion to the whole text, so this
+    trades up to one more NER run over those sentences for the bound.
+    :param sentence_list: the list of sentences from the novel
+    :param threshold_rate: the per sentence frequency threshold, as in iterative_NER.
+    :param width: the width of the count-min sketch.
+    :param depth: the depth of the count-min sketch.
+    :param max_candidates: the maximal number of strings remembered after the first pass.
+    :return: a non-duplicate list of names in the novel.
+    '''
+    import heapq
+    from collections import Counter
+    from sketch import CountMinSketch
+
+    labels = ["GPE", "LOC", "FAC"] if extract_places else None
+    stop_words = compile_stop_words(other_stop_words)
+    threshold = max(1, threshold_rate * len(sentence_list))
+    sketch = CountMinSketch(width, depth)
+    # candidates maps each string to its latest estimate; the heap holds (estimate, string) entries, the
+    # outdated ones being skipped when the lowest candidate is evicted
+    candidates, heap = {}, []
+    for i in sentence_list:
+        for name in name_entity_recognition(nlp_func, i, labels, stop_words):
+            estimate = sketch.add(name)
+            if estimate < threshold:
+                continue
+            candidates[name] = estimate
+            heapq.heappush(heap, (estimate, name))
+            if len(candidates) > max_candidates:
+                while True:
+                    estimate, lowest = heapq.heappop(heap)
+                    if candidates.get(lowest) == estimate:
+                        del candidates[lowest]
+                        count('candidates evicted')
+                        break
+            if len(heap) > 2 * max_candidates:
+                heap = [(estimate, name) for name, estimate in candidates.items()]
+                heapq.heapify(heap)
+    if not candidates:
+        return []
+
+    # exact recount, restricted to the sentences mentioning a candidate
+    candidate_pattern = re.compile('|'.join(re.escape(x) for x in sorted(candidates, key=len, reverse=True)))
+    output = Counter()
+    for i in sentence_list:
+        if not candidate_pattern.search(i.lower().replace("'s", "")):
+            continue
+        output.update(x for x in name_entity_recognition(nlp_func, i, labels, stop_words) if x in candidates)
+    output = [x for x in output if output[x] >= threshold]
+    count('names above threshold', len(output))
+    return output
+
+
+@instrumented
 def top_names(name_list, novel, top_num=20):
     '''
     A function to return the top names in a novel and their frequencies.
@@ -621,36 +746,88 @@ def top_names(name_list, novel, top_num=20):
     return name_frequency, names
 
 
-def calculate_align_rate(sentence_list):
+@instrumented
+def sentiment_scores(sentence_list, scorer=None, workers=1, processes=False):
+    '''
+    Function to score the sentiment of every sentence in the novel.
+    :param sentence_list: the list of sentences in the novel.
+    :param scorer: the sentiment.SentimentScorer, the shared memoised Afinn scorer by default.
+    :param workers: the number of threads or processes scoring the sentences.
+    :param processes: whether the scorer uses a process pool instead of a thread pool.
+    :return: the float32 array of scores, one per sentence.
+    '''
+    scorer = scorer or default_scorer()
+    return scorer(sentence_list, workers=workers, processes=processes)
+
+
+@instrumented
+def occurrence_matrix(name_list, sentence_list):
+    '''
+    Function to find which of the names occur in each sentence.
+    :param name_list: the list of names of the top characters in the novel.
+    :param sentence_list: the list of sentences in the novel.
+    :return: a sparse binary (sentences x names) matrix.
+    '''
+    name_vect = CountVectorizer(vocabulary=name_list, binary=True)
+    return name_vect.fit_transform(sentence_list)
+
+
+@instrumented
+def calculate_align_rate(sentence_list, scorer=None, workers=1, processes=False):
     '''
     Function to calculate the align_rate of the whole novel
     :param sentence_list: the list of sentence of the whole novel.
+    :param scorer: the sentiment scorer, workers and processes, as in sentiment_scores.
     :return: the align rate of the novel.
     '''
-    afinn = Afinn()
-    sentiment_score = [afinn.score(x) for x in sentence_list]
-    align_rate = np.sum(sentiment_score) / len(np.nonzero(sentiment_score)[0]) * -2
+    sentiment_score = sentiment_scores(sentence_list, scorer, workers, processes)
+    align_rate = np.sum(sentiment_score, dtype=np.float64) / len(np.nonzero(sentiment_score)[0]) * -2
 
     return align_rate
 
 
-def calculate_matrix(name_list, sentence_list, align_rate):
+@instrumented
+def calculate_matrix(name_list, sentence_list, align_rate, packed=False, chunk_size=None, scorer=None, workers=1,
+                     processes=False):
     '''
     Function to calculate the co-occurrence matrix and sentiment matrix among all the top characters
     :param name_list: the list of names of the top characters in the novel.
     :param sentence_list: the list of sentences in the novel.
     :param align_rate: the sentiment alignment rate to align the sentiment score between characters due to the writing style of
     the author. Every co-occurrence will lead to an increase or decrease of one unit of align_rate.
+    :param packed: if True, the matrices are returned as PackedTriangle (int32 counts, float32 sentiment),
+    computed from sparse products without any dense square or (sentences x names) array.
+    :param chunk_size: if given, the dense (sentences x names) occurrence array is built for chunk_size
+    sentences at a time, so the memory used no longer grows with the length of the novel.
+    :param scorer: the sentiment scorer, workers and processes, as in sentiment_scores.
     :return: the co-occurrence matrix and sentiment matrix.
     '''
     # calculate a sentiment score for each sentence in the novel
-    afinn = Afinn()
-    sentiment_score = [afinn.score(x) for x in sentence_list]
+    sentiment_score = np.asarray(sentiment_scores(sentence_list, scorer, workers, processes), dtype=np.float64)
+    if packed:
+        from packed_matrix import PackedTriangle
+        occurrence = occurrence_matrix(name_list, sentence_list).tocsc()
+        cooccurrence = occurrence.T @ occurrence
+        sentiment = occurrence.T @ occurrence.multiply(np.asarray(sentiment_score, dtype=np.float64)[:, None]).tocsc()
+        cooccurrence_matrix = PackedTriangle.from_sparse(cooccurrence, np.int32)
+        sentiment_matrix = PackedTriangle.from_sparse(sentiment, np.float32)
+        sentiment_matrix.data += np.float32(align_rate) * cooccurrence_matrix.data
+        return cooccurrence_matrix, sentiment_matrix
     # calculate occurrence matrix and sentiment matrix among the top characters
-    name_vect = CountVectorizer(vocabulary=name_list, binary=True)
-    occurrence_each_sentence = name_vect.fit_transform(sentence_list).toarray()
-    cooccurrence_matrix = np.dot(occurrence_each_sentence.T, occurrence_each_sentence)
-    sentiment_matrix = np.dot(occurrence_each_sentence.T, (occurrence_each_sentence.T * sentiment_score).T)
+    if chunk_size is not None:
+        occurrence = occurrence_matrix(name_list, sentence_list).tocsr()
+        sentiment_score = np.asarray(sentiment_score, dtype=np.float64)
+        cooccurrence_matrix = np.zeros((len(name_list), len(name_list)), dtype=np.int64)
+        sentiment_matrix = np.zeros((len(name_list), len(name_list)))
+        for start in range(0, occurrence.shape[0], chunk_size):
+            occurrence_each_sentence = occurrence[start:start + chunk_size].toarray()
+            cooccurrence_matrix += np.dot(occurrence_each_sentence.T, occurrence_each_sentence)
+            sentiment_matrix += np.dot(occurrence_each_sentence.T,
+                                       (occurrence_each_sentence.T * sentiment_score[start:start + chunk_size]).T)
+    else:
+        occurrence_each_sentence = occurrence_matrix(name_list, sentence_list).toarray()
+        cooccurrence_matrix = np.dot(occurrence_each_sentence.T, occurrence_each_sentence)
+        sentiment_matrix = np.dot(occurrence_each_sentence.T, (occurrence_each_sentence.T * sentiment_score).T)
     sentiment_matrix += align_rate * cooccurrence_matrix
     cooccurrence_matrix = np.tril(cooccurrence_matrix)
     sentiment_matrix = np.tril(sentiment_matrix)
@@ -662,6 +839,30 @@ def calculate_matrix(name_list, sentence_list, align_rate):
     return cooccurrence_matrix, sentiment_matrix
 
 
+@instrumented
+def calculate_bipartite_matrix(name_list, place_list, sentence_list, align_rate, scorer=None, workers=1,
+                               processes=False):
+    '''
+    Function to calculate the character-to-place co-occurrence and sentiment matrices directly, instead of
+    calling calculate_matrix on name_list + place_list and masking out the name-name and place-place blocks.
+    :param name_list: the list of names of the top characters in the novel.
+    :param place_list: the list of the top places in the novel.
+    :param sentence_list: the list of sentences in the novel.
+    :param align_rate: the sentiment alignment rate, as in calculate_matrix.
+    :param scorer: the sentiment scorer, workers and processes, as in sentiment_scores.
+    :return: the (names x places) co-occurrence matrix and sentiment matrix.
+    '''
+    sentiment_score = np.asarray(sentiment_scores(sentence_list, scorer, workers, processes), dtype=np.float64)
+    name_occurrence = occurrence_matrix(name_list, sentence_list)
+    place_occurrence = occurrence_matrix(place_list, sentence_list)
+    cooccurrence_matrix = (name_occurrence.T @ place_occurrence).toarray()
+    sentiment_matrix = np.asarray((name_occurrence.T @ place_occurrence.multiply(sentiment_score[:, None])).todense())
+    sentiment_matrix += align_rate * cooccurrence_matrix
+
+    return cooccurrence_matrix, sentiment_matrix
+
+
+@instrumented
 def matrix_to_edge_list(matrix, mode, name_list):
     '''
     Function to convert matrix (co-occurrence/sentiment) to edge list of the network graph. It determines the
@@ -671,6 +872,11 @@ def matrix_to_edge_list(matrix, mode, name_list):
     :param name_list: the list of names of the top characters in the novel.
     :return: the edge list with weight and color param.
     '''
+    if hasattr(matrix, 'edge_list'):
+        # PackedTriangle computes weights and colors on its packed vector
+        edge_list = matrix.edge_list(mode, name_list)
+        count('edges emitted', len(edge_list))
+        return edge_list
     edge_list = []
     shape = matrix.shape[0]
     lower_tri_loc = list(zip(*np.where(np.triu(np.ones([shape, shape])) == 0)))
@@ -683,10 +889,12 @@ def matrix_to_edge_list(matrix, mode, name_list):
         color = 2000 * normalized_matrix
     for i in lower_tri_loc:
         edge_list.append((name_list[i[0]], name_list[i[1]], {'weight': weight[i], 'color': color[i]}))
+    count('edges emitted', len(edge_list))
 
     return edge_list
 
 
+@instrumented
 def matrix_to_edge_list_v2(matrix, mode, name_list, place_list):
     '''
     Function to convert matrix (co-occurrence/sentiment) to edge list of the network graph. It determines the
@@ -716,26 +924,59 @@ def matrix_to_edge_list_v2(matrix, mode, name_list, place_list):
     for i in lower_tri_loc:
         if weight[i] != 0.0:
             edge_list.append((combined_list[i[0]], combined_list[i[1]], {'weight': weight[i], 'color': color[i]}))
+    count('edges emitted', len(edge_list))
 
     return edge_list
 
-def plot_graph(name_list, name_frequency, matrix, plt_name, mode, path=''):
+@instrumented
+def bipartite_matrix_to_edge_list(matrix, mode, name_list, place_list):
     '''
-    Function to plot the network graph (co-occurrence network or sentiment network).
+    Function to convert a bipartite matrix from calculate_bipartite_matrix to the character-place edge list
+    of the network graph, with the weight and color param of matrix_to_edge_list_v2. The matrix is
+    normalised by its own maximum, and pairs that never co-occur get no edge.
+    :param matrix: (names x places) co-occurrence matrix or sentiment matrix.
+    :param mode: 'co-occurrence' or 'sentiment'
+    :param name_list: the list of names of the top characters in the novel.
+    :param place_list: the list of the top places in the novel.
+    :return: the edge list with weight and color param.
+    '''
+    normalized_matrix = matrix / np.max(np.abs(matrix))
+    if mode == 'co-occurrence':
+        weight = np.log(2000 * normalized_matrix + 1) * 0.7
+        color = np.log(2000 * normalized_matrix + 1)
+    else: # mode == 'sentiment'
+        weight = np.log(np.abs(1000 * normalized_matrix) + 1) * 0.7
+        color = 2000 * normalized_matrix
+    edge_list = [(name_list[i], place_list[j], {'weight': weight[i, j], 'color': color[i, j]})
+                 for i, j in zip(*np.nonzero(weight))]
+    count('edges emitted', len(edge_list))
+
+    return edge_list
+
+
+def _place_edge_list(matrix, mode, name_list, place_list):
+    # plot_graph_v2/v3 accept the square combined matrix or the bipartite one
+    if matrix.shape == (len(name_list), len(place_list)):
+        return bipartite_matrix_to_edge_list(matrix, mode, name_list, place_list)
+    return matrix_to_edge_list_v2(matrix, mode, name_list, place_list)
+
+
+@instrumented
+def draw_graph(name_list, name_frequency, matrix, mode):
+    '''
+    Function to draw the network graph (co-occurrence network or sentiment network) on a new figure.
     :param name_list: the list of top character names in the novel.
     :param name_frequency: the list containing the frequencies of the top names.
     :param matrix: co-occurrence matrix or sentiment matrix.
-    :param plt_name: the name of the plot (PNG file) to output.
     :param mode: 'co-occurrence' or 'sentiment'
-    :param path: the path to output the PNG file.
-    :return: a PNG file of the network graph.
+    :return: the matplotlib figure.
     '''
 
     label = {i: i for i in name_list}
     edge_list = matrix_to_edge_list(matrix, mode, name_list)
     normalized_frequency = np.array(name_frequency) / np.max(name_frequency)
 
-    plt.figure(figsize=(20, 20))
+    figure = plt.figure(figsize=(20, 20))
     G = nx.Graph()
     G.add_nodes_from(name_list)
     G.add_edges_from(edge_list)
@@ -743,7 +984,6 @@ def plot_graph(name_list, name_frequency, matrix, plt_name, mode, path=''):
     edges = G.edges()
     weights = [G[u][v]['weight'] for u, v in edges]
     colors = [G[u][v]['color'] for u, v in edges]
-    print(f"edge_list: {edge_list}")
     if mode == 'co-occurrence':
         nx.draw(G, pos, node_color='#A0CBE2', node_size=np.sqrt(normalized_frequency) * 4000, edge_cmap=plt.cm.Blues,
                 linewidths=10, font_size=35, labels=label, edge_color=colors, with_labels=True, width=weights)
@@ -753,11 +993,11 @@ def plot_graph(name_list, name_frequency, matrix, plt_name, mode, path=''):
                 width=weights, edge_vmin=-1000, edge_vmax=1000)
     else:
         raise ValueError("mode should be either 'co-occurrence' or 'sentiment'")
-
-    plt.savefig("output/" + path + plt_name + '.png')
+    return figure
 
 
-def plot_graph_v2(name_list, name_frequency, place_list, place_frequency, matrix, plt_name, mode, path=''):
+@instrumented
+def plot_graph(name_list, name_frequency, matrix, plt_name, mode, path=''):
     '''
     Function to plot the network graph (co-occurrence network or sentiment network).
     :param name_list: the list of top character names in the novel.
@@ -769,49 +1009,37 @@ def plot_graph_v2(name_list, name_frequency, place_list, place_frequency, matrix
     :return: a PNG file of the network graph.
     '''
 
+    draw_graph(name_list, name_frequency, matrix, mode)
+    plt.savefig("output/" + path + plt_name + '.png')
+
+
+@instrumented
+def draw_graph_v2(name_list, name_frequency, place_list, place_frequency, matrix, mode):
+    '''
+    Function to draw the character-place network graph (co-occurrence network or sentiment network) on a new
+    figure.
+    :param name_list: the list of top character names in the novel.
+    :param name_frequency: the list containing the frequencies of the top names.
+    :param matrix: the combined co-occurrence or sentiment matrix of name_list + place_list, or the bipartite
+    one from calculate_bipartite_matrix.
+    :param mode: 'co-occurrence' or 'sentiment'
+    :return: the matplotlib figure.
+    '''
+
     label = {i: i for i in name_list + place_list}
-    edge_list = matrix_to_edge_list_v2(matrix, mode, name_list, place_list)
+    edge_list = _place_edge_list(matrix, mode, name_list, place_list)
     normalized_frequency = np.array(name_frequency + place_frequency) / np.max(name_frequency + place_frequency)
 
-    plt.figure(figsize=(20, 20))
+    figure = plt.figure(figsize=(20, 20))
     G = nx.Graph()
-    print(name_list)
-    print(place_list)
     name_list_with_attr = [(n, {"color": "red"}) for n in name_list]
-    print(name_list_with_attr)
-    G.add_nodes_from(name_list_with_attr)
-    # print("^^^^^^^^^^^^^^^^")
-    # print(sorted(G.nodes(data=True), key=str))
-    # # for v in G.nodes():
-    # #     print(G[v])
-    # print("^^^^^^^^^^^^^^^^")
     place_list_with_attr = [(p, {"color": 'blue'}) for p in place_list]
-    combined = name_list_with_attr + place_list_with_attr
-    G.add_nodes_from(combined)
-    # print("^^^^^^^^^^^^^^^^")
-    # for v in G.nodes():
-    #     print(G[v])
-    # print("^^^^^^^^^^^^^^^^")
+    G.add_nodes_from(name_list_with_attr + place_list_with_attr)
     G.add_edges_from(edge_list)
-    # print(f"edge_list: {edge_list}")
     pos = nx.circular_layout(G)
-    print(f"pos: {pos}")
     edges = G.edges()
-    nodes = G.nodes()
-    weights = [G[u][v]['weight'] for u, v in edges]
-    # print("$$$$$$$")
-    # print(G.nodes(data=True))
-    # print("------")
-    # for v in nodes:
-    #     print(G[v])
-    # print("------")
-    # for u, v in edges:
-    #     print(G[u][v])
-    # print("------")
-    # node_colors = [G[v]['color'] for v in nodes]
     edge_colors = [G[u][v]['color'] for u, v in edges]
 
-
     if mode == 'co-occurrence':
         nx.draw(G, pos, node_size=np.sqrt(normalized_frequency) * 4000, edge_cmap=plt.cm.Blues,
                 linewidths=10, font_size=35, labels=label, edge_color=edge_colors, with_labels=True)
@@ -821,10 +1049,28 @@ def plot_graph_v2(name_list, name_frequency, place_list, place_frequency, matrix
                 edge_vmin=-1000, edge_vmax=1000)
     else:
         raise ValueError("mode should be either 'co-occurrence' or 'sentiment'")
+    return figure
+
+
+@instrumented
+def plot_graph_v2(name_list, name_frequency, place_list, place_frequency, matrix, plt_name, mode, path=''):
+    '''
+    Function to plot the network graph (co-occurrence network or sentiment network).
+    :param name_list: the list of top character names in the novel.
+    :param name_frequency: the list containing the frequencies of the top names.
+    :param matrix: the combined co-occurrence or sentiment matrix of name_list + place_list, or the bipartite
+    one from calculate_bipartite_matrix.
+    :param plt_name: the name of the plot (PNG file) to output.
+    :param mode: 'co-occurrence' or 'sentiment'
+    :param path: the path to output the PNG file.
+    :return: a PNG file of the network graph.
+    '''
 
+    draw_graph_v2(name_list, name_frequency, place_list, place_frequency, matrix, mode)
     plt.savefig("output/" + path + plt_name + '.png')
     plt.show()
 
+@instrumented
 def plot_graph_v3(name_list, name_frequency, place_list, place_frequency, matrix, plt_name, mode, path=''):
     '''
     Function to plot the network graph (co-occurrence network or sentiment network).
@@ -837,7 +1083,7 @@ def plot_graph_v3(name_list, name_frequency, place_list, place_frequency, matrix
     :return: a PNG file of the network graph.
     '''
     label = {i: i for i in name_list + place_list}
-    edge_list = matrix_to_edge_list_v2(matrix, mode, name_list, place_list)
+    edge_list = _place_edge_list(matrix, mode, name_list, place_list)
     normalized_frequency = np.array(name_frequency + place_frequency) / np.max(name_frequency + place_frequency)
 
     plt.figure(figsize=(20, 20))
@@ -864,7 +1110,7 @@ def plot_graph_v3(name_list, name_frequency, place_list, place_frequency, matrix
     pos = nx.circular_layout(G)
 
     label = {i: i for i in name_list + place_list}
-    edge_list = matrix_to_edge_list_v2(matrix, mode, name_list, place_list)
+    edge_list = _place_edge_list(matrix, mode, name_list, place_list)
     normalized_frequency = np.array(name_frequency + place_frequency) / np.max(name_frequency + place_frequency)
 
     plt.figure(figsize=(20, 20))
@@ -0,0 +1,224 @@
+# -*- coding: utf-8 -*-
+"""
+Checkpointed, resumable corpus runs.
+
+run_corpus runs the per-book pipeline of the notebooks (read_text -> sentence split ->
+calculate_align_rate -> iterative_NER_v2 for names and places -> top_names -> calculate_matrix) and
+records its progress in <run_dir>/<book>/checkpoint.json: the result of every finished stage, and the
+running entity counts of the NER stages after every batch of sentences. Every write goes to a temporary
+file that is synced and renamed over the old one, so a run killed at any point leaves the last complete
+checkpoint behind. A finished book is saved with artefacts.save_run in <run_dir>/<book>/ and skipped by
+later runs; an interrupted book resumes from its last stage and NER batch. The checkpoint holds a
+fingerprint of the text and the settings (threshold_rate, top_num, the models, and the configuration of
+the segmenter, the name normaliser and the sentiment scorer), and a run with another text or other
+settings starts the book over instead of reusing stale stages. A finished book with the same fingerprint
+is loaded before its text is segmented.
+
+    runs = run_corpus(nlp_func, novel_folder, novel_list, 'output/runs', nlp_location_func=nlp_location_func)
+"""
+import hashlib
+import json
+import os
+from collections import Counter
+
+import artefacts
+from character_network_iterative import (calculate_align_rate, calculate_matrix, compile_stop_words,
+                                         name_entity_recognition, read_text, top_names)
+from instrumentation import count, stage
+from name_normaliser import name_normaliser
+from segmenter import default_segmenter
+from sentiment import default_scorer
+
+
+def _atomic_write_json(path, content):
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(content, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def model_key(nlp_func):
+    '''
+    :param nlp_func: a spaCy Language, or any NER callable.
+    :return: a string identifying the model and its pipeline, e.g. 'en_core_web_sm-3.8.0:tok2vec,ner'.
+    '''
+    if nlp_func is None:
+        return None
+    meta = getattr(nlp_func, 'meta', None)
+    if meta:
+        return f"{meta.get('lang')}_{meta.get('name')}-{meta.get('version')}:{','.join(nlp_func.pipe_names)}"
+    return f"{type(nlp_func).__module__}.{getattr(nlp_func, '__qualname__', type(nlp_func).__qualname__)}"
+
+
+def fingerprint(**settings):
+    '''
+    :param settings: JSON-serialisable settings the results depend on.
+    :return: the hex digest of the settings.
+    '''
+    return hashlib.sha1(json.dumps(settings, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+class BookCheckpoint(object):
+    '''
+    The checkpoint of one book of a run.
+    :param path: the folder of the book in the run.
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        self.file = os.path.join(path, 'checkpoint.json')
+        os.makedirs(path, exist_ok=True)
+        if os.path.exists(self.file):
+            with open(self.file) as f:
+                self.state = json.load(f)
+        else:
+            self.state = {'stages': {}, 'batches': {}}
+
+    @property
+    def done(self):
+        return os.path.exists(os.path.join(self.path, 'metadata.json'))
+
+    def save(self):
+        _atomic_write_json(self.file, self.state)
+
+    def check(self, key):
+        '''
+        Function to discard the checkpoint, and the saved run, when they were written with other settings.
+        :param key: the fingerprint of the settings of this run.
+        '''
+        if self.state.get('fingerprint') != key:
+            if self.state['stages'] or self.state['batches'] or self.done:
+                count('checkpoints reset')
+            if self.done:
+                os.remove(os.path.join(self.path, 'metadata.json'))
+            self.state = {'fingerprint': key, 'stages': {}, 'batches': {}}
+            self.save()
+
+    def run_stage(self, name, func, *args, **kwargs):
+        '''
+        Function to run a stage once: its JSON-serialisable result is checkpointed and returned again on
+        restart without calling func.
+        :param name: the name of the stage.
+        :param func: the function computing the stage.
+        :return: the result of the stage.
+        '''
+        if name not in self.state['stages']:
+            self.state['stages'][name] = func(*args, **kwargs)
+            self.save()
+        else:
+            count('stages resumed')
+        return self.state['stages'][name]
+
+    def run_batched_ner(self, name, nlp_func, sentence_list, batch_size, labels=None, other_stop_words=None,
+                        normaliser=None):
+        '''
+        Function to count the entities of every sentence, checkpointing the running counts after each batch
+        of batch_size sentences; a restarted stage continues after the last checkpointed batch.
+        :param name: the name of the stage.
+        :param nlp_func: the spaCy Language used for NER.
+        :param sentence_list: the list of sentences of the book.
+        :param batch_size: the number of sentences between two checkpoints.
+        :param labels: the entity labels, as in name_entity_recognition.
+        :param other_stop_words: extra words to filter out, as in name_entity_recognition.
+        :param normaliser: the name normaliser, as in name_entity_recognition.
+        :return: the Counter of entities.
+        '''
+        progress = self.state['batches'].setdefault(name, {'next': 0, 'counts': {}})
+        if progress['next']:
+            count('sentences resumed', progress['next'])
+        entities = Counter(progress['counts'])
+        stop_words = compile_stop_words(other_stop_words)
+        with stage(name):
+            for start in range(progress['next'], len(sentence_list), batch_size):
+                for i in sentence_list[start:start + batch_size]:
+                    entities.update(name_entity_recognition(nlp_func, i, labels, stop_words, normaliser))
+                progress['next'] = min(start + batch_size, len(sentence_list))
+                progress['counts'] = dict(entities)
+                self.save()
+        return entities
+
+
+def _threshold(entities, threshold_rate, n_sentences):
+    # the filter of iterative_NER_v2
+    return [x for x in entities if entities[x] >= threshold_rate * n_sentences]
+
+
+def _top_names(name_list, novel, top_num):
+    name_frequency, names = top_names(name_list, novel, top_num)
+    return [int(x) for x in name_frequency], names
+
+
+def run_book(nlp_func, novel_folder, novel_name, run_dir, nlp_location_func=None, threshold_rate=0.0005,
+             top_num=20, batch_size=500, segmenter=None, normaliser=None, scorer=None):
+    '''
+    Function to run the pipeline on one book with checkpoints, resuming a previous interrupted run.
+    :param nlp_func: the spaCy Language used for names.
+    :param novel_folder: the folder of the novels.
+    :param novel_name: the file name of the novel.
+    :param run_dir: the folder of the run.
+    :param nlp_location_func: the spaCy Language used for places; places are skipped if None.
+    :param threshold_rate: the per sentence frequency threshold, as in iterative_NER.
+    :param top_num: the number of names (and places) kept, as in top_names.
+    :param batch_size: the number of sentences between two NER checkpoints.
+    :param segmenter: the sentence segmenter, the shared Punkt segmenter by default.
+    :param normaliser: the name normaliser, the shared name_normaliser by default.
+    :param scorer: the sentiment scorer, the shared AfinnScorer by default.
+    :return: the run of the book, as artefacts.load_run returns it.
+    '''
+    segmenter = segmenter or default_segmenter()
+    normaliser = normaliser or name_normaliser
+    scorer = scorer or default_scorer()
+    checkpoint = BookCheckpoint(os.path.join(run_dir, os.path.splitext(novel_name)[0]))
+    novel = read_text(novel_folder, novel_name)
+    # the text and the configurations fix the sentences, so the NER batches still index the same sentences
+    checkpoint.check(fingerprint(text=hashlib.sha1(novel.encode('utf-8', 'surrogatepass')).hexdigest(),
+                                 threshold_rate=threshold_rate, top_num=top_num, model=model_key(nlp_func),
+                                 location_model=model_key(nlp_location_func), segmenter=segmenter.config(),
+                                 normaliser=normaliser.config(), scorer=scorer.config()))
+    if checkpoint.done:
+        count('books skipped')
+        return artefacts.load_run(checkpoint.path)
+    # the sentences are recomputed rather than checkpointed: segmenting is cheap next to NER
+    sentence_list = segmenter.sentences(novel)
+    align_rate = checkpoint.run_stage('align_rate', lambda: float(calculate_align_rate(sentence_list, scorer)))
+
+    names = checkpoint.run_batched_ner('names', nlp_func, sentence_list, batch_size, normaliser=normaliser)
+    preliminary_name_list = _threshold(names, threshold_rate, len(sentence_list))
+    name_frequency, name_list = checkpoint.run_stage('top_names', _top_names, preliminary_name_list, novel, top_num)
+    place_frequency, place_list = [], []
+    if nlp_location_func is not None:
+        places = checkpoint.run_batched_ner('places', nlp_location_func, sentence_list, batch_size,
+                                            ["GPE", "LOC", "FAC"], preliminary_name_list, normaliser)
+        preliminary_place_list = _threshold(places, threshold_rate, len(sentence_list))
+        place_frequency, place_list = checkpoint.run_stage('top_places', _top_names, preliminary_place_list, novel,
+                                                           top_num)
+
+    cooccurrence_matrix, sentiment_matrix = calculate_matrix(name_list + place_list, sentence_list, align_rate,
+                                                             scorer=scorer)
+    # metadata.json is written last by save_run, so its presence marks the book as done
+    artefacts.save_run(checkpoint.path, name_list + place_list, name_frequency + place_frequency,
+                       cooccurrence_matrix, sentiment_matrix, align_rate, novel_name=novel_name,
+                       names=len(name_list), places=len(place_list), threshold_rate=threshold_rate)
+    return artefacts.load_run(checkpoint.path)
+
+
+def run_corpus(nlp_func, novel_folder, novel_list, run_dir, nlp_location_func=None, threshold_rate=0.0005,
+               top_num=20, batch_size=500, segmenter=None, normaliser=None, scorer=None):
+    '''
+    Function to run the pipeline on every book with checkpoints. Books finished by an earlier run are
+    loaded instead of recomputed, and an interrupted book resumes where it stopped, so an interrupted run
+    loses at most one NER batch.
+    :param novel_list: the file names of the novels, in order.
+    :param run_dir: the folder of the run (created if missing).
+    :return: dictionary {book name: run}, as artefacts.load_runs returns it.
+    Other parameters as in run_book.
+    '''
+    os.makedirs(run_dir, exist_ok=True)
+    runs = {}
+    for novel_name in novel_list:
+        runs[os.path.splitext(novel_name)[0]] = run_book(nlp_func, novel_folder, novel_name, run_dir,
+                                                         nlp_location_func, threshold_rate, top_num, batch_size,
+                                                         segmenter, normaliser, scorer)
+    return runs
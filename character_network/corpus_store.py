@@ -0,0 +1,274 @@
+# -*- coding: utf-8 -*-
+"""
+Memory-mapped multi-book corpus store.
+
+pack_corpus cleans every book (as read_text does), splits it into sentences once and writes:
+    corpus-<generation>.bin     all books as one UTF-8 blob
+    sentences-<generation>.npy  int64 (n_sentences, 2) array of [start, end) byte offsets into the blob
+    index.json                  the generation and, per book: byte range, sentence range and the
+                                [number, first sentence] of every chapter
+index.json is replaced last and names the generation of the data files, so a store interrupted while
+being repacked still reads the previous, consistent generation.
+Chapters are numbered as printed in their headings ('CHAPTER ONE', 'Chapter 1: ...', 'CHAPTER TWENTY-ONE'),
+so chapter 1 is the first chapter of every book. The scan of Harry Potter 2 garbled or lost some of its
+headings: one found without a readable number gets the number after the previous heading. The text before
+the first heading belongs to no chapter, and a book without a usable sequence of headings is recorded with
+no chapters; check_chapters verifies that every book has chapters.
+CorpusStore memory-maps these files, so the NER, sentiment and co-occurrence stages, and any worker
+process that opens the same store, share one physical copy of the corpus. Sentences are served as
+zero-copy memoryview slices or decoded lazily into strings.
+"""
+import bisect
+import json
+import mmap
+import os
+import re
+import uuid
+from collections.abc import Sequence
+
+import numpy as np
+
+from character_network_iterative import clean_text
+from segmenter import default_segmenter
+
+_units = ['one', 'two', 'three', 'four', 'five', 'six', 'seven', 'eight', 'nine', 'ten', 'eleven', 'twelve',
+          'thirteen', 'fourteen', 'fifteen', 'sixteen', 'seventeen', 'eighteen', 'nineteen']
+_tens = ['twenty', 'thirty', 'forty', 'fifty', 'sixty', 'seventy', 'eighty', 'ninety']
+NUMBER_WORDS = dict([(word, i + 1) for i, word in enumerate(_units)] + [(word, 20 + 10 * i) for i, word in enumerate(_tens)])
+_number_words = r'(?:{tens})(?:[^a-z\r\n]{{1,3}}(?:{units}))?|(?:{units})'.format(
+    tens='|'.join(_tens), units='|'.join(sorted(_units, key=len, reverse=True)))
+# a line starting with 'Chapter' and its number: 'CHAPTER ONE', ' CHAPTER TWENTY-ONE OWL POST', 'Chapter 8 -- ...',
+# '======== Chapter 1 A Sunny Day'; a prose line starting with 'chapter' has no number after it. Harry Potter 2
+# spaces the letters out and its scan garbles them: 'C H A P T E O N E', 'C H-H A P T E RR F I v E',
+# 'H-H A P T E RR T 11-H RR E E', 'G F-I A P T E IR', so there the heading is found by its ' A P T' and the
+# number is read from the end of the line when it survived the scan
+chapter_heading = re.compile(r'^[ \t=]*(?:chapter[ \t]+(?P<number>\d+|{words})\b'
+                             r'|[a-z0-9\-]{{1,3}}(?:[ \t][a-z0-9\-]{{1,3}})?[ \t]a[ \t]p[ \t]t\b(?P<spaced>[^\r\n]*))'
+                             .format(words=_number_words), re.IGNORECASE | re.MULTILINE)
+_spaced_number = re.compile(r'(?:{})$'.format(_number_words.replace(r'[^a-z\r\n]{1,3}', '')))
+
+
+def _chapter_number(m, previous):
+    if m.group('number') is not None:
+        number = m.group('number')
+        if number.isdigit():
+            return int(number)
+        return sum(NUMBER_WORDS[word] for word in re.findall(r'[a-z]+', number.lower()))
+    # a letter-spaced heading follows the previous one, whatever is left of its number
+    number = _spaced_number.search(re.sub(r'[^a-z]', '', m.group('spaced').lower()))
+    if number is not None:
+        value = sum(NUMBER_WORDS[word] for word in re.findall('|'.join(sorted(NUMBER_WORDS, key=len, reverse=True)),
+                                                               number.group()))
+        if value > previous:
+            return value
+    return previous + 1
+
+
+def chapter_headings(raw_text):
+    '''
+    Function to find the chapter headings of a novel.
+    :param raw_text: the text of the novel.
+    :return: the list of (chapter number, character offset) of the headings, in order. Headings whose number
+    does not follow the previous one (tables of contents, repeated headings) are dropped, and fewer than two
+    headings are no chapters at all, so the list is empty. A letter-spaced heading whose number was lost in
+    the scan gets the number after the previous heading.
+    '''
+    headings = []
+    for m in chapter_heading.finditer(raw_text):
+        number = _chapter_number(m, headings[-1][0] if headings else 0)
+        if not headings or number > headings[-1][0]:
+            headings.append((number, m.start()))
+    return headings if len(headings) > 1 else []
+
+
+def check_chapters(novel_folder, novel_list):
+    '''
+    Function to check that the chapter headings of every novel are found, e.g. for the bundled books.
+    :param novel_folder: the folder of the novels.
+    :param novel_list: the file names of the novels.
+    :return: dictionary with the number of chapters found per novel.
+    '''
+    counts = {}
+    for novel_name in novel_list:
+        with open(f"{novel_folder}/{novel_name}", 'r') as f:
+            counts[novel_name] = len(chapter_headings(f.read()))
+    missing = [novel_name for novel_name, count in counts.items() if not count]
+    if missing:
+        raise ValueError(f"no chapter headings were found in {', '.join(missing)}")
+    return counts
+
+
+def _byte_offsets(text):
+    # byte offset of every character (and of the end of the text) in text.encode('utf-8')
+    code_points = np.frombuffer(text.encode('utf-32-le'), dtype=np.uint32)
+    width = 1 + (code_points >= 0x80) + (code_points >= 0x800) + (code_points >= 0x10000)
+    return np.concatenate([[0], np.cumsum(width, dtype=np.int64)])
+
+
+def pack_corpus(novel_folder, novel_list, store_path, segmenter=None):
+    '''
+    Function to pack books into a corpus store.
+    :param novel_folder: the folder of the novels.
+    :param novel_list: the file names of the novels to pack, in order.
+    :param store_path: the folder to write the store to (created if missing).
+    :param segmenter: a function returning the (start, end) character spans of the sentences of a text,
+    such as a segmenter.Segmenter; the shared Punkt segmenter by default.
+    :return: the path of the store.
+    '''
+    segmenter = segmenter or default_segmenter()
+    os.makedirs(store_path, exist_ok=True)
+    generation = uuid.uuid4().hex
+    corpus_file, sentences_file = f"corpus-{generation}.bin", f"sentences-{generation}.npy"
+    index, offsets, byte_position, sentence_position = [], [], 0, 0
+    with open(os.path.join(store_path, corpus_file), 'wb') as blob:
+        for novel_name in novel_list:
+            with open(f"{novel_folder}/{novel_name}", 'r') as f:
+                raw_text = f.read()
+            # clean_text keeps every character in place, so chapter offsets of the raw text stay valid
+            text = clean_text(raw_text)
+            byte_offset = _byte_offsets(text)
+            spans = np.array(list(segmenter(text)), dtype=np.int64).reshape(-1, 2)
+            headings = chapter_headings(raw_text) if len(spans) else []
+            # a chapter starts at the sentence holding its heading
+            first_sentences = np.searchsorted(spans[:, 1], [offset for _, offset in headings], side='right')
+            chapters = [[number, sentence_position + int(sentence)]
+                        for (number, _), sentence in zip(headings, first_sentences)]
+            encoded = text.encode('utf-8')
+            blob.write(encoded)
+            offsets.append(byte_offset[spans] + byte_position)
+            index.append({'name': novel_name, 'bytes': [byte_position, byte_position + len(encoded)],
+                          'sentences': [sentence_position, sentence_position + len(spans)],
+                          'chapters': chapters})
+            byte_position += len(encoded)
+            sentence_position += len(spans)
+    offsets = np.concatenate(offsets) if offsets else np.zeros((0, 2), dtype=np.int64)
+    np.save(os.path.join(store_path, sentences_file), offsets)
+    with open(os.path.join(store_path, 'index.json.tmp'), 'w') as f:
+        json.dump({'generation': generation, 'books': index}, f)
+    os.replace(os.path.join(store_path, 'index.json.tmp'), os.path.join(store_path, 'index.json'))
+    # the previous generations (stores still open keep their mapping)
+    for name in os.listdir(store_path):
+        current = name in (corpus_file, sentences_file)
+        if not current and re.fullmatch(r'(corpus(-\w+)?\.bin|sentences(-\w+)?\.npy)', name):
+            os.remove(os.path.join(store_path, name))
+    return store_path
+
+
+class CorpusStore(object):
+    '''
+    Read-only, memory-mapped view of a store written by pack_corpus. Instances pickle by path, so they
+    can be sent to worker processes, which map the same files.
+    :param store_path: the folder of the store.
+    '''
+
+    def __init__(self, store_path):
+        self.store_path = store_path
+        with open(os.path.join(store_path, 'index.json')) as f:
+            index = json.load(f)
+        self.books = {book['name']: book for book in index['books']}
+        self.offsets = np.load(os.path.join(store_path, f"sentences-{index['generation']}.npy"), mmap_mode='r')
+        with open(os.path.join(store_path, f"corpus-{index['generation']}.bin"), 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if size else b''
+        self.blob = memoryview(self._map)
+
+    def __reduce__(self):
+        return self.__class__, (self.store_path,)
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def sentence_bytes(self, i):
+        '''
+        :param i: the corpus-wide sentence number.
+        :return: a zero-copy memoryview of the UTF-8 bytes of the sentence.
+        '''
+        start, end = self.offsets[i]
+        return self.blob[start:end]
+
+    def sentence(self, i):
+        return str(self.sentence_bytes(i), 'utf-8')
+
+    def chapter_bounds(self, novel_name, chapters):
+        '''
+        :param novel_name: the book.
+        :param chapters: an inclusive (first, last) range of chapter numbers, as printed in the headings.
+        :return: the [start, end) range of corpus-wide sentence numbers of these chapters. A chapter whose
+        heading is missing from the text is part of the chapter before it, so on its own it is empty.
+        '''
+        book = self.books[novel_name]
+        if not book['chapters']:
+            raise ValueError(f"no chapter headings were found in {novel_name}")
+        numbers = [number for number, _ in book['chapters']]
+        bounds = [sentence for _, sentence in book['chapters']] + [book['sentences'][1]]
+        start = bounds[bisect.bisect_left(numbers, chapters[0])]
+        end = bounds[bisect.bisect_right(numbers, chapters[1])]
+        return start, max(start, end)
+
+    def chapter_starts(self, novel_name):
+        '''
+        :param novel_name: the book.
+        :return: the first sentence of every chapter, relative to the first sentence of the book.
+        '''
+        book = self.books[novel_name]
+        return [sentence - book['sentences'][0] for _, sentence in book['chapters']]
+
+    def sentences(self, novel_name=None, chapters=None):
+        '''
+        :param novel_name: the book to return the sentences of; the whole corpus if None.
+        :param chapters: optional inclusive (first, last) range of chapter numbers of the book, see
+        chapter_bounds.
+        :return: a lazy sequence of sentences, usable wherever a sentence_list is expected.
+        '''
+        if novel_name is None:
+            return LazySentences(self, 0, len(self))
+        if chapters is not None:
+            return LazySentences(self, *self.chapter_bounds(novel_name, chapters))
+        return LazySentences(self, *self.books[novel_name]['sentences'])
+
+    def text(self, novel_name):
+        '''
+        :param novel_name: the book.
+        :return: the cleaned text of the book, as read_text would return it.
+        '''
+        start, end = self.books[novel_name]['bytes']
+        return str(self.blob[start:end], 'utf-8')
+
+    def close(self):
+        self.blob.release()
+        if self._map:
+            self._map.close()
+
+
+class LazySentences(Sequence):
+    '''
+    A range of sentences of a CorpusStore, decoded only when accessed.
+    '''
+
+    def __init__(self, store, start, end):
+        self.store, self.start, self.end = store, start, end
+
+    def __len__(self):
+        return self.end - self.start
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            start, stop, step = i.indices(len(self))
+            if step != 1:
+                return [self[j] for j in range(start, stop, step)]
+            return LazySentences(self.store, self.start + start, self.start + stop)
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        return self.store.sentence(self.start + i)
+
+    def __iter__(self):
+        for i in range(self.start, self.end):
+            yield self.store.sentence(i)
+
+
+if __name__ == '__main__':
+    books = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'books')
+    for novel_name, count in check_chapters(books, sorted(os.listdir(books))).items():
+        print(f"{novel_name}: {count} chapters")
@@ -0,0 +1,217 @@
+# -*- coding: utf-8 -*-
+"""
+Throughput and quality comparison of the character extractors.
+
+Every configuration (the spaCy path of character_network_iterative.py with the small and large models,
+with and without the pre-filter, and the two NLTK paths of characters.py) is run on each book in a fresh
+process, so the peak resident memory of a run is not inflated by the runs before it. The top names of
+each run are scored against the checked-in gold character list of the book (gold/gold_characters.json):
+a name is correct when it is one of the aliases of a gold character, and a gold character is found when
+one of its aliases is among the top names.
+
+    python extractor_comparison.py --novel_folder ../books --top_num 20 --output output/extractors.json
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import resource
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+
+from name_normaliser import HONORIFICS, NameNormaliser
+
+gold_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'gold', 'gold_characters.json')
+
+# the names of both paths are compared after folding quotes, removing honorifics and a leading article
+_gold_normaliser = NameNormaliser(honorifics=HONORIFICS, fold_quotes=True)
+
+
+def _normalise(name):
+    name = _gold_normaliser(name.strip())
+    return name[4:] if name.startswith('the ') else name
+
+
+def _spacy_names(novel, sentence_list, top_num, threshold_rate, model, use_prefilter):
+    import spacy
+    from character_network_iterative import iterative_NER_v2, top_names
+    from prefilter import CandidateFilter
+
+    start = time.perf_counter()
+    nlp_func = spacy.load(model)
+    load_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    preliminary_name_list = iterative_NER_v2(nlp_func, sentence_list, threshold_rate,
+                                             prefilter=CandidateFilter() if use_prefilter else None)
+    _, name_list = top_names(preliminary_name_list, novel, top_num)
+    return name_list, load_seconds, time.perf_counter() - start
+
+
+def _nltk_pos_names(novel, sentence_list, top_num, threshold_rate):
+    from nlp_harry_potter import characters
+
+    characters.download_nltk_data()
+    start = time.perf_counter()
+    tagged = characters.tagging(characters.text_tokenize(novel))
+    counts = characters.summarize_text(characters.find_proper_nouns_v2(tagged), top_num)
+    name_list = [k for k, v in sorted(counts.items(), key=lambda item: item[1][0], reverse=True)][:top_num]
+    return name_list, 0.0, time.perf_counter() - start
+
+
+def _nltk_ne_chunk_names(novel, sentence_list, top_num, threshold_rate):
+    from nltk import chunk
+    from nlp_harry_potter import characters
+
+    characters.download_nltk_data()
+    start = time.perf_counter()
+    tagged = characters.tagging(characters.text_tokenize(novel))
+    persons = characters.get_person(chunk.ne_chunk(tagged))
+    name_list = [k for k, v in Counter(pn[0] for pn in persons).most_common(top_num)]
+    return name_list, 0.0, time.perf_counter() - start
+
+
+# name: (function, extra keyword arguments)
+CONFIGURATIONS = {
+    'spacy-sm': (_spacy_names, {'model': 'en_core_web_sm', 'use_prefilter': False}),
+    'spacy-sm+prefilter': (_spacy_names, {'model': 'en_core_web_sm', 'use_prefilter': True}),
+    'spacy-lg': (_spacy_names, {'model': 'en_core_web_lg', 'use_prefilter': False}),
+    'spacy-lg+prefilter': (_spacy_names, {'model': 'en_core_web_lg', 'use_prefilter': True}),
+    'nltk-pos': (_nltk_pos_names, {}),
+    'nltk-ne-chunk': (_nltk_ne_chunk_names, {}),
+}
+
+
+def load_gold(path=gold_path):
+    '''
+    :param path: the gold file, a JSON object {book file name: {character: [aliases]}}.
+    :return: dictionary {book file name: {character: set of normalised aliases}}.
+    '''
+    with open(path) as f:
+        gold = json.load(f)
+    return {book: {character: {_normalise(a) for a in aliases} for character, aliases in cast.items()}
+            for book, cast in gold.items()}
+
+
+def score_names(name_list, cast):
+    '''
+    Function to score a list of top names against the gold cast of a book. A one-word name that is the
+    surname of several characters ('weasley', 'dursley', 'lovegood') is ambiguous: it is left out of the
+    precision and finds no character.
+    :param name_list: the top names returned by an extractor.
+    :param cast: dictionary {character: set of normalised aliases}, as load_gold returns it.
+    :return: dictionary with the precision of the unambiguous names, the recall of the cast, the characters
+    missed and the ambiguous names.
+    '''
+    characters_of = {}
+    for character, aliases in cast.items():
+        for alias in aliases:
+            characters_of.setdefault(alias, set()).add(character)
+            if ' ' in alias:
+                characters_of.setdefault(alias.split()[-1], set()).add(character)
+    names = [_normalise(name) for name in name_list]
+    ambiguous = set(name for name in names if len(characters_of.get(name, ())) > 1)
+    scored = [name for name in names if name not in ambiguous]
+    matched = [next(iter(characters_of[name])) for name in scored if name in characters_of]
+    found = set(matched)
+    return {'precision': len(matched) / len(scored) if scored else 0.0,
+            'recall': len(found) / len(cast) if cast else 0.0,
+            'missed': sorted(set(cast) - found),
+            'ambiguous': sorted(ambiguous)}
+
+
+def run_configuration(configuration, novel_folder, novel_name, top_num=20, threshold_rate=0.0005):
+    '''
+    Function to run one extractor configuration on one book. Meant to be called in a fresh process:
+    the peak memory reported is the peak resident size of the calling process.
+    :param configuration: a key of CONFIGURATIONS.
+    :param novel_folder: the folder of the novels.
+    :param novel_name: the file name of the novel.
+    :param top_num: the number of top names kept.
+    :param threshold_rate: the per sentence frequency threshold of iterative_NER.
+    :return: dictionary with the names, the number of sentences, the model load and extraction times,
+    the throughput and the peak memory in MB.
+    '''
+    from character_network_iterative import read_text
+    from segmenter import default_segmenter
+
+    func, kwargs = CONFIGURATIONS[configuration]
+    novel = read_text(novel_folder, novel_name)
+    sentence_list = default_segmenter().sentences(novel)
+    name_list, load_seconds, seconds = func(novel, sentence_list, top_num, threshold_rate, **kwargs)
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    peak_mb = peak / 2 ** 20 if os.uname().sysname == 'Darwin' else peak / 2 ** 10
+    return {'names': list(name_list), 'sentences': len(sentence_list), 'load_seconds': load_seconds,
+            'seconds': seconds, 'sentences_per_second': len(sentence_list) / seconds if seconds else 0.0,
+            'peak_mb': peak_mb}
+
+
+def compare_extractors(novel_folder, novel_list=None, configurations=None, top_num=20, threshold_rate=0.0005,
+                       gold=None):
+    '''
+    Function to run every extractor configuration on every book, each run in its own process.
+    :param novel_folder: the folder of the novels.
+    :param novel_list: the file names of the novels, every book of the gold file by default.
+    :param configurations: the keys of CONFIGURATIONS to run, all of them by default.
+    :param top_num: the number of top names scored.
+    :param threshold_rate: the per sentence frequency threshold of iterative_NER.
+    :param gold: the gold cast of each book, load_gold() by default.
+    :return: a DataFrame with one row per book and configuration, and the top names of every run.
+    '''
+    gold = gold or load_gold()
+    novel_list = novel_list or list(gold)
+    configurations = configurations or list(CONFIGURATIONS)
+    context = multiprocessing.get_context('spawn')
+    rows, names = [], {}
+    for novel_name in novel_list:
+        for configuration in configurations:
+            # a single-use pool per run, so every run starts from a fresh interpreter
+            with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+                result = executor.submit(run_configuration, configuration, novel_folder, novel_name,
+                                         top_num, threshold_rate).result()
+            score = score_names(result['names'], gold.get(novel_name, {}))
+            names[(novel_name, configuration)] = result['names']
+            rows.append({'book': novel_name, 'configuration': configuration, 'sentences': result['sentences'],
+                         'load_seconds': result['load_seconds'], 'seconds': result['seconds'],
+                         'sentences_per_second': result['sentences_per_second'], 'peak_mb': result['peak_mb'],
+                         'precision': score['precision'], 'recall': score['recall'],
+                         'missed': ', '.join(score['missed'])})
+    return pd.DataFrame(rows), names
+
+
+def cheapest_configuration(results, min_precision=0.6, min_recall=0.6):
+    '''
+    Function to pick the fastest configuration meeting a quality bar on every book.
+    :param results: the DataFrame returned by compare_extractors.
+    :param min_precision: the minimal precision of the top names on every book.
+    :param min_recall: the minimal recall of the gold cast on every book.
+    :return: the name of the configuration, or None if none meets the bar.
+    '''
+    summary = results.groupby('configuration').agg(precision=('precision', 'min'), recall=('recall', 'min'),
+                                                   sentences_per_second=('sentences_per_second', 'mean'))
+    summary = summary[(summary.precision >= min_precision) & (summary.recall >= min_recall)]
+    if summary.empty:
+        return None
+    return summary.sentences_per_second.idxmax()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compare the throughput and quality of the character extractors.')
+    parser.add_argument('--novel_folder', default='../books')
+    parser.add_argument('--books', nargs='*', help='the file names of the books, every gold book by default')
+    parser.add_argument('--configurations', nargs='*', choices=list(CONFIGURATIONS))
+    parser.add_argument('--top_num', type=int, default=20)
+    parser.add_argument('--threshold_rate', type=float, default=0.0005)
+    parser.add_argument('--output', help='optional JSON file for the results')
+    args = parser.parse_args()
+
+    results, _ = compare_extractors(args.novel_folder, args.books, args.configurations, args.top_num,
+                                    args.threshold_rate)
+    with pd.option_context('display.width', 200, 'display.max_columns', None):
+        print(results.drop(columns='missed'))
+    print('cheapest configuration meeting the bar:', cheapest_configuration(results))
+    if args.output:
+        results.to_json(args.output, orient='records', indent=2)
@@ -0,0 +1,203 @@
+# -*- coding: utf-8 -*-
+"""
+Graph analytics on co-occurrence and sentiment matrices.
+
+plot_graph builds a networkx Graph only to draw it. The measures here (degree, weighted PageRank,
+eigenvector centrality and Louvain communities) are computed directly on scipy sparse matrices, and
+analyse_books stacks the matrices of several books into one block-diagonal matrix so every power
+iteration runs once for all books.
+"""
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+
+
+def to_adjacency(matrix):
+    '''
+    Function to turn a matrix returned by calculate_matrix into a symmetric sparse adjacency matrix.
+    Sentiment matrices are signed, so the absolute value of the sentiment is used as the edge weight.
+    :param matrix: a lower-triangle (or already symmetric) dense or sparse matrix.
+    :return: a symmetric CSR matrix with non-negative weights and a zero diagonal.
+    '''
+    if hasattr(matrix, 'tosparse'):
+        # PackedTriangle
+        matrix = matrix.tosparse()
+    matrix = abs(sp.csr_matrix(matrix, dtype=np.float64))
+    lower = sp.tril(matrix, -1)
+    upper = sp.triu(matrix, 1)
+    # calculate_matrix keeps the lower triangle only; a full symmetric matrix is used as is
+    if upper.nnz == 0:
+        upper = lower.T
+    elif lower.nnz == 0:
+        lower = upper.T
+    return sp.csr_matrix(lower + upper)
+
+
+def degree(adjacency):
+    '''
+    :param adjacency: a symmetric sparse adjacency matrix.
+    :return: the number of neighbours and the weighted degree (strength) of each node.
+    '''
+    adjacency = sp.csr_matrix(adjacency)
+    return np.diff(adjacency.indptr), np.asarray(adjacency.sum(axis=1)).ravel()
+
+
+def pagerank(adjacency, blocks=None, damping=0.85, tol=1e-10, max_iter=200):
+    '''
+    Function to compute the weighted PageRank of every node by power iteration.
+    :param adjacency: a symmetric sparse adjacency matrix.
+    :param blocks: the graph id of each node when several graphs are stacked block-diagonally; teleport
+    and dangling mass stay inside each graph, so every graph gets its own PageRank summing to 1.
+    :param damping: the damping factor.
+    :param tol: the L1 convergence tolerance.
+    :param max_iter: the maximal number of iterations.
+    :return: the PageRank vector.
+    '''
+    adjacency = sp.csr_matrix(adjacency)
+    n = adjacency.shape[0]
+    blocks = np.zeros(n, dtype=np.int64) if blocks is None else np.asarray(blocks)
+    block_size = np.bincount(blocks).astype(np.float64)
+    out_weight = np.asarray(adjacency.sum(axis=1)).ravel()
+    dangling = out_weight == 0
+    inverse_weight = np.divide(1.0, out_weight, out=np.zeros(n), where=~dangling)
+    # column-stochastic transition matrix
+    transition = (sp.diags(inverse_weight) @ adjacency).T.tocsr()
+    rank = 1.0 / block_size[blocks]
+    for _ in range(max_iter):
+        dangling_mass = np.bincount(blocks, weights=rank * dangling, minlength=len(block_size))
+        new_rank = damping * (transition @ rank)
+        new_rank += (damping * dangling_mass[blocks] + (1 - damping)) / block_size[blocks]
+        converged = np.abs(new_rank - rank).sum() < tol * len(block_size)
+        rank = new_rank
+        if converged:
+            break
+    return rank
+
+
+def eigenvector_centrality(adjacency, blocks=None, tol=1e-8, max_iter=500):
+    '''
+    Function to compute the eigenvector centrality of every node by power iteration on A + I (the
+    shift keeps the iteration from oscillating on bipartite components, as networkx does).
+    :param adjacency: a symmetric sparse adjacency matrix.
+    :param blocks: the graph id of each node when several graphs are stacked; each graph is normalised
+    on its own.
+    :param tol: the convergence tolerance.
+    :param max_iter: the maximal number of iterations.
+    :return: the eigenvector centrality vector, with unit L2 norm per graph.
+    '''
+    adjacency = sp.csr_matrix(adjacency)
+    n = adjacency.shape[0]
+    blocks = np.zeros(n, dtype=np.int64) if blocks is None else np.asarray(blocks)
+    centrality = np.ones(n)
+    for _ in range(max_iter):
+        new_centrality = adjacency @ centrality + centrality
+        norms = np.sqrt(np.bincount(blocks, weights=new_centrality ** 2))
+        norms[norms == 0] = 1
+        new_centrality /= norms[blocks]
+        converged = np.abs(new_centrality - centrality).sum() < n * tol
+        centrality = new_centrality
+        if converged:
+            break
+    return centrality
+
+
+def louvain_communities(adjacency, blocks=None, resolution=1.0, seed=0):
+    '''
+    Function to detect communities with the Louvain method (local moving followed by aggregation,
+    repeated until modularity stops improving). Nodes only move to neighbouring communities, so the
+    communities of stacked graphs never mix; modularity is measured with the total weight of each graph.
+    :param adjacency: a symmetric sparse adjacency matrix.
+    :param blocks: the graph id of each node when several graphs are stacked.
+    :param resolution: the modularity resolution; higher values give smaller communities.
+    :param seed: the seed of the node visiting order.
+    :return: the community id of every node (ids are numbered from 0 within each graph).
+    '''
+    adjacency = sp.csr_matrix(adjacency, dtype=np.float64)
+    n = adjacency.shape[0]
+    blocks = np.zeros(n, dtype=np.int64) if blocks is None else np.asarray(blocks)
+    total_weight = np.bincount(blocks, weights=np.asarray(adjacency.sum(axis=1)).ravel()) / 2
+    rng = np.random.default_rng(seed)
+
+    membership = np.arange(n)
+    level_adjacency, level_blocks = adjacency, blocks
+    while True:
+        community = _local_moving(level_adjacency, total_weight[level_blocks], resolution, rng)
+        n_communities = community.max() + 1 if len(community) else 0
+        if n_communities == level_adjacency.shape[0]:
+            break
+        membership = community[membership]
+        # aggregate: one node per community, internal weights become self loops
+        assign = sp.csr_matrix((np.ones(len(community)), (np.arange(len(community)), community)),
+                               shape=(len(community), n_communities))
+        level_adjacency = sp.csr_matrix(assign.T @ level_adjacency @ assign)
+        # members of a community always share a graph, so any member gives the community's graph
+        community_blocks = np.empty(n_communities, dtype=np.int64)
+        community_blocks[community] = level_blocks
+        level_blocks = community_blocks
+    # renumber communities from 0 within each graph
+    first_block = np.full(membership.max() + 1 if n else 0, -1, dtype=np.int64)
+    first_block[membership] = blocks
+    offsets = np.searchsorted(first_block[np.unique(membership)], np.arange(blocks.max() + 1 if n else 0))
+    return np.unique(membership, return_inverse=True)[1] - offsets[blocks]
+
+
+def _local_moving(adjacency, node_total_weight, resolution, rng):
+    n = adjacency.shape[0]
+    indptr, indices, data = adjacency.indptr, adjacency.indices, adjacency.data
+    strength = np.asarray(adjacency.sum(axis=1)).ravel()
+    community = np.arange(n)
+    community_strength = strength.copy()
+    improved = True
+    while improved:
+        improved = False
+        for i in rng.permutation(n):
+            neighbours = indices[indptr[i]:indptr[i + 1]]
+            weights = data[indptr[i]:indptr[i + 1]]
+            not_self = neighbours != i
+            if not not_self.any() or node_total_weight[i] == 0:
+                continue
+            current = community[i]
+            community_strength[current] -= strength[i]
+            candidates, inverse = np.unique(community[neighbours[not_self]], return_inverse=True)
+            weight_to = np.bincount(inverse, weights=weights[not_self])
+            scale = resolution * strength[i] / (2 * node_total_weight[i])
+            gains = weight_to - scale * community_strength[candidates]
+            stay = np.searchsorted(candidates, current)
+            stay_gain = gains[stay] if stay < len(candidates) and candidates[stay] == current \
+                else -scale * community_strength[current]
+            best = gains.argmax()
+            target = candidates[best] if gains[best] > stay_gain + 1e-12 else current
+            community_strength[target] += strength[i]
+            if target != current:
+                community[i] = target
+                improved = True
+    return np.unique(community, return_inverse=True)[1]
+
+
+def analyse_books(matrices, name_lists, resolution=1.0):
+    '''
+    Function to compute degree, weighted PageRank, eigenvector centrality and communities for several
+    books in one batched call. The books' adjacency matrices are stacked block-diagonally, so each
+    measure runs once over all books.
+    :param matrices: dictionary of {book name: co-occurrence or sentiment matrix from calculate_matrix}.
+    :param name_lists: dictionary of {book name: the name list of the matrix}.
+    :param resolution: the modularity resolution of the community detection.
+    :return: dictionary of {book name: DataFrame indexed by name with one column per measure}.
+    '''
+    books = list(matrices)
+    adjacencies = [to_adjacency(matrices[book]) for book in books]
+    blocks = np.repeat(np.arange(len(books)), [a.shape[0] for a in adjacencies])
+    stacked = sp.block_diag(adjacencies, format='csr')
+
+    neighbours, strength = degree(stacked)
+    measures = pd.DataFrame({'degree': neighbours,
+                             'strength': strength,
+                             'pagerank': pagerank(stacked, blocks),
+                             'eigenvector': eigenvector_centrality(stacked, blocks),
+                             'community': louvain_communities(stacked, blocks, resolution)})
+    results = {}
+    for i, book in enumerate(books):
+        result = measures[blocks == i].copy()
+        result.index = list(name_lists[book])
+        results[book] = result
+    return results
@@ -0,0 +1,227 @@
+# -*- coding: utf-8 -*-
+"""
+Incremental re-analysis of a novel.
+
+The novel is cut into content-defined chunks (chapters when chapter headings are found, otherwise
+runs of lines cut where a checksum of the text before a line break matches a pattern), and the sentence split, NER
+counts and sentiment scores of every chunk are cached under the hash of the chunk's text and of everything
+the results depend on: the cache format version, the model, the stop words, and the configuration of the
+segmenter, the name normaliser and the sentiment scorer. The novel-level results are merged from the chunk
+results, so correcting one chapter only reruns that chapter. Every novel records the cache files it uses in
+a manifest named after the hash of its resolved path; after a run, prune_cache deletes the files the
+novel's previous manifest had and the new one dropped, so the entries of other novels (even ones running at
+the same time without a manifest yet) are never touched.
+"""
+import hashlib
+import json
+import os
+import re
+import zlib
+from collections import Counter
+
+import numpy as np
+
+from character_network_iterative import (clean_text, compile_stop_words, name_entity_recognition,
+                                         occurrence_matrix, sentiment_scores, top_names)
+from corpus_store import chapter_heading
+from name_normaliser import name_normaliser
+from segmenter import default_segmenter
+from sentiment import default_scorer
+
+# bump when the content of the cached results changes, so older caches are not reused
+CACHE_VERSION = 2
+
+def split_chunks(raw_text, min_chunk_size=2000, boundary_mask=0x1F):
+    '''
+    Function to cut a raw novel (before clean_text) into content-defined chunks. Chunk boundaries only
+    depend on the text around them, so an edit only changes the chunk it falls in.
+    :param raw_text: the text of the novel as read from the file.
+    :param min_chunk_size: the minimal size (in characters) of a chunk cut by checksum.
+    :param boundary_mask: when no chapter headings are found, a line ends a chunk when the low bits of the
+    crc32 of its last 64 characters are all zero, i.e. on average every boundary_mask + 1 lines.
+    :return: the list of chunks; their concatenation is raw_text.
+    '''
+    starts = [m.start() for m in chapter_heading.finditer(raw_text)]
+    if len(starts) > 1:
+        starts = sorted(set([0] + starts))
+        return [raw_text[a:b] for a, b in zip(starts, starts[1:] + [len(raw_text)])]
+
+    chunks, start = [], 0
+    for m in re.finditer(r'\n\s*', raw_text):
+        if m.end() - start < min_chunk_size:
+            continue
+        # cut after a line break when the checksum of the text just before it matches the mask
+        window = raw_text[max(start, m.start() - 64):m.start()]
+        if zlib.crc32(window.encode('utf-8')) & boundary_mask == 0:
+            chunks.append(raw_text[start:m.end()])
+            start = m.end()
+    chunks.append(raw_text[start:])
+    return chunks
+
+
+def _hash(*parts):
+    digest = hashlib.sha1()
+    for part in parts:
+        digest.update(part.encode('utf-8'))
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+
+def _atomic_write_json(path, content):
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(content, f)
+    os.replace(tmp_path, path)
+
+
+def _settings_key(model_key, stop_words, segmenter, normaliser, scorer):
+    # everything besides the text of a chunk that its cached result depends on
+    return _hash(str(CACHE_VERSION), model_key, ' '.join(sorted(stop_words)),
+                 json.dumps([segmenter.config(), normaliser.config(), scorer.config()], sort_keys=True))
+
+
+def analyse_chunk(nlp_func, chunk, cache_dir, model_key, other_stop_words=None, segmenter=None, normaliser=None,
+                  scorer=None):
+    '''
+    Function to split, NER and score one chunk, or load the cached result of a previous run.
+    :param nlp_func: the spaCy Language used for NER.
+    :param chunk: the raw text of the chunk.
+    :param cache_dir: the folder of the chunk cache.
+    :param model_key: a name for nlp_func (e.g. 'en_core_web_sm'); part of the cache key, so results
+    of different models are not mixed.
+    :param other_stop_words: passed to name_entity_recognition.
+    :param segmenter: the segmenter.Segmenter, the shared one by default.
+    :param normaliser: the NameNormaliser of name_entity_recognition, name_normaliser by default.
+    :param scorer: the sentiment.SentimentScorer, the shared Afinn scorer by default.
+    :return: (cache key, dictionary with the chunk's sentences, entity counts and sentiment scores, whether it was cached)
+    '''
+    segmenter = segmenter or default_segmenter()
+    normaliser = normaliser or name_normaliser
+    scorer = scorer or default_scorer()
+    stop_words = compile_stop_words(other_stop_words)
+    key = _hash(chunk, _settings_key(model_key, stop_words, segmenter, normaliser, scorer))
+    path = os.path.join(cache_dir, key + '.json')
+    if os.path.exists(path):
+        with open(path) as f:
+            return key, json.load(f), True
+    sentences = segmenter.sentences(clean_text(chunk))
+    entities = Counter()
+    for i in sentences:
+        entities.update(name_entity_recognition(nlp_func, i, other_stop_words=stop_words, normaliser=normaliser))
+    result = {'sentences': sentences, 'entities': dict(entities),
+              'sentiment': sentiment_scores(sentences, scorer).tolist()}
+    _atomic_write_json(path, result)
+    return key, result, False
+
+
+def _matrix_file(key, name_list):
+    return key + '-' + _hash(*name_list) + '.npz'
+
+
+def _chunk_matrix(key, result, name_list, cache_dir):
+    # raw (symmetric, diagonal included) co-occurrence and sentiment sums of one chunk; key already covers
+    # the settings, so only the names are added
+    path = os.path.join(cache_dir, _matrix_file(key, name_list))
+    if os.path.exists(path):
+        data = np.load(path)
+        return data['cooccurrence'], data['sentiment']
+    occurrence = occurrence_matrix(name_list, result['sentences']).toarray()
+    cooccurrence = np.dot(occurrence.T, occurrence)
+    sentiment = np.dot(occurrence.T, (occurrence.T * result['sentiment']).T)
+    tmp_path = path + '.tmp.npz'
+    np.savez(tmp_path, cooccurrence=cooccurrence, sentiment=sentiment)
+    os.replace(tmp_path, path)
+    return cooccurrence, sentiment
+
+
+def _manifest_path(cache_dir, novel_path):
+    return os.path.join(cache_dir, _hash(os.path.realpath(novel_path)) + '.manifest.json')
+
+
+def _manifest_files(path):
+    if not os.path.exists(path):
+        return []
+    with open(path) as f:
+        return json.load(f)['files']
+
+
+def prune_cache(cache_dir, dropped):
+    '''
+    Function to delete the cache files a novel stopped using, i.e. the results of its chunks that were edited
+    since, of older settings or of older name lists. Files another novel's manifest references are kept.
+    :param cache_dir: the folder of the chunk cache.
+    :param dropped: the file names in the novel's previous manifest but not in its new one.
+    :return: the number of files deleted.
+    '''
+    dropped = set(dropped)
+    for name in os.listdir(cache_dir):
+        if dropped and name.endswith('.manifest.json'):
+            dropped -= set(_manifest_files(os.path.join(cache_dir, name)))
+    deleted = 0
+    for name in dropped:
+        if os.path.exists(os.path.join(cache_dir, name)):
+            os.remove(os.path.join(cache_dir, name))
+            deleted += 1
+    return deleted
+
+
+def analyse_novel_incremental(nlp_func, novel_folder, novel_name, cache_dir, model_key, threshold_rate=0.0005,
+                              top_num=20, segmenter=None, normaliser=None, scorer=None, prune=True):
+    '''
+    Function to run read_text -> sent_tokenize -> iterative_NER -> top_names -> calculate_align_rate ->
+    calculate_matrix with per-chunk caching. Only chunks whose text changed since the last run go through
+    NER and sentiment scoring again; the novel-level results are merged from the chunk results.
+    :param nlp_func: the spaCy Language used for NER.
+    :param novel_folder: the folder of the novel.
+    :param novel_name: the file name of the novel.
+    :param cache_dir: the folder of the chunk cache (created if missing).
+    :param model_key: a name for nlp_func, see analyse_chunk.
+    :param threshold_rate: the per sentence frequency threshold, as in iterative_NER.
+    :param top_num: the number of names to keep, as in top_names.
+    :param segmenter: the segmenter, see analyse_chunk.
+    :param normaliser: the name normaliser, see analyse_chunk.
+    :param scorer: the sentiment scorer, see analyse_chunk.
+    :param prune: whether the cache files this novel stopped using are deleted at the end, see prune_cache.
+    :return: a dictionary with name_list, name_frequency, cooccurrence_matrix, sentiment_matrix,
+    align_rate, and the number of chunks reused and recomputed.
+    '''
+    os.makedirs(cache_dir, exist_ok=True)
+    with open(f"{novel_folder}/{novel_name}", 'r') as f:
+        raw_text = f.read()
+
+    chunk_results, entities, sentiment, reused = [], Counter(), [], 0
+    for chunk in split_chunks(raw_text):
+        key, result, cached = analyse_chunk(nlp_func, chunk, cache_dir, model_key, segmenter=segmenter,
+                                            normaliser=normaliser, scorer=scorer)
+        chunk_results.append((key, result))
+        entities.update(result['entities'])
+        sentiment.extend(result['sentiment'])
+        reused += cached
+    n_sentences = len(sentiment)
+    preliminary_name_list = [x for x in entities if entities[x] >= threshold_rate * n_sentences]
+    name_frequency, name_list = top_names(preliminary_name_list, clean_text(raw_text), top_num)
+    align_rate = np.sum(sentiment) / len(np.nonzero(sentiment)[0]) * -2
+
+    shape = len(name_list)
+    cooccurrence_matrix = np.zeros((shape, shape), dtype=np.int64)
+    sentiment_matrix = np.zeros((shape, shape))
+    for key, result in chunk_results:
+        cooccurrence, chunk_sentiment = _chunk_matrix(key, result, name_list, cache_dir)
+        cooccurrence_matrix += cooccurrence
+        sentiment_matrix += chunk_sentiment
+    # same alignment, lower triangle and zero diagonal as calculate_matrix
+    sentiment_matrix += align_rate * cooccurrence_matrix
+    cooccurrence_matrix = np.tril(cooccurrence_matrix, -1)
+    sentiment_matrix = np.tril(sentiment_matrix, -1)
+
+    used = [key + '.json' for key, _ in chunk_results] + [_matrix_file(key, name_list) for key, _ in chunk_results]
+    novel_path = f"{novel_folder}/{novel_name}"
+    manifest_path = _manifest_path(cache_dir, novel_path)
+    previous = _manifest_files(manifest_path)
+    _atomic_write_json(manifest_path, {'novel': os.path.realpath(novel_path), 'files': used})
+    if prune:
+        prune_cache(cache_dir, set(previous) - set(used))
+
+    return {'name_list': name_list, 'name_frequency': name_frequency, 'cooccurrence_matrix': cooccurrence_matrix,
+            'sentiment_matrix': sentiment_matrix, 'align_rate': align_rate,
+            'chunks_reused': reused, 'chunks_computed': len(chunk_results) - reused}
@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+"""
+Lightweight per-stage instrumentation.
+
+The stage functions of character_network_iterative.py and characters.py (reading, NER over a book,
+top_names, the matrices, plotting) are wrapped with @instrumented, which times each call as a stage;
+per-sentence helpers such as name_entity_recognition are not timed, they only bump counters (sentences
+processed, entities kept and dropped, edges emitted). characters.py imports this module by its bare name,
+as the character_network modules do, so both pipelines record into the same counters. Nothing is printed: the numbers are collected in memory and
+returned by report() as a JSON-serialisable dictionary. cProfile and tracemalloc capture per stage are
+off by default and switched on with configure().
+
+    configure(profile=True, trace_memory=True)
+    ... run the pipeline ...
+    report('output/run_report.json')
+"""
+import cProfile
+import functools
+import io
+import json
+import pstats
+import time
+import tracemalloc
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+
+_settings = {'enabled': True, 'profile': False, 'trace_memory': False, 'profile_lines': 25}
+_stages = defaultdict(lambda: {'calls': 0, 'seconds': 0.0, 'peak_bytes': 0})
+_counters = Counter()
+_profiles = {}
+_active = []
+# the highest traced peak wiped by reset_peak since the outermost traced stage started
+_wiped_peak = [0]
+
+
+def configure(enabled=True, profile=False, trace_memory=False, profile_lines=25):
+    '''
+    Function to switch the instrumentation features.
+    :param enabled: whether stages are timed and counters kept at all.
+    :param profile: whether each outermost stage is run under cProfile.
+    :param trace_memory: whether the peak traced memory of each outermost stage is recorded (slows the run
+    down).
+    :param profile_lines: the number of functions kept in each stage's profile summary.
+    '''
+    _settings.update(enabled=enabled, profile=profile, trace_memory=trace_memory, profile_lines=profile_lines)
+
+
+def reset():
+    '''Function to drop everything recorded so far.'''
+    _stages.clear()
+    _counters.clear()
+    _profiles.clear()
+
+
+def reset_peak():
+    '''
+    Function to reset the peak of tracemalloc, to measure a section on its own (as memory_budget does),
+    without losing the peak of the traced stage around it: the wiped peak still counts for that stage.
+    '''
+    if tracemalloc.is_tracing():
+        _wiped_peak[0] = max(_wiped_peak[0], tracemalloc.get_traced_memory()[1])
+        tracemalloc.reset_peak()
+
+
+@contextmanager
+def stage(name):
+    '''
+    Context manager timing a block of code as the stage 'name'. Nested stages are timed on their own
+    as well as inside their parent.
+    :param name: the name of the stage in the report.
+    '''
+    if not _settings['enabled']:
+        yield
+        return
+    outermost = not _active
+    profiler = cProfile.Profile() if _settings['profile'] and outermost else None
+    trace = _settings['trace_memory'] and outermost
+    # tracing may already be on (e.g. in memory_budget); then it is left on
+    started = trace and not tracemalloc.is_tracing()
+    if started:
+        tracemalloc.start()
+    if trace:
+        _wiped_peak[0] = 0
+    _active.append(name)
+    if profiler:
+        profiler.enable()
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        if profiler:
+            profiler.disable()
+            # the profiles of every call of the stage are added up
+            if name in _profiles:
+                _profiles[name].add(profiler)
+            else:
+                _profiles[name] = pstats.Stats(profiler)
+        _active.pop()
+        record = _stages[name]
+        record['calls'] += 1
+        record['seconds'] += elapsed
+        if trace:
+            record['peak_bytes'] = max(record['peak_bytes'], _wiped_peak[0], tracemalloc.get_traced_memory()[1])
+        if started:
+            tracemalloc.stop()
+
+
+def _profile_summary(stats):
+    out = io.StringIO()
+    stats.stream = out
+    stats.sort_stats('cumulative').print_stats(_settings['profile_lines'])
+    return out.getvalue()
+
+
+def count(name, n=1):
+    '''
+    :param name: the name of the counter in the report.
+    :param n: the amount to add.
+    '''
+    if _settings['enabled']:
+        _counters[name] += n
+
+
+def instrumented(func):
+    '''
+    Decorator timing every call of func as a stage named after the function.
+    '''
+    name = func.__name__
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if not _settings['enabled']:
+            return func(*args, **kwargs)
+        with stage(name):
+            return func(*args, **kwargs)
+    return wrapper
+
+
+def report(path=None):
+    '''
+    Function to build the structured report of everything recorded since the last reset.
+    :param path: if given, the report is also written there as JSON.
+    :return: dictionary with 'stages' ({name: calls, seconds, peak_bytes}), 'counters' and 'profiles'.
+    '''
+    result = {'stages': {name: dict(record) for name, record in _stages.items()},
+              'counters': dict(_counters),
+              'profiles': {name: _profile_summary(stats) for name, stats in _profiles.items()}}
+    if path is not None:
+        with open(path, 'w') as f:
+            json.dump(result, f, indent=2)
+    return result
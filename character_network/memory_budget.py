@@ -0,0 +1,347 @@
+# -*- coding: utf-8 -*-
+"""
+Memory budget mode.
+
+The peak memory of the pipeline grows with the book: read_text and top_names hold several full copies
+of the text, calculate_matrix builds a dense (sentences x names) array, and the NLTK path of
+characters.py keeps the token list, the tagged list and the ne_chunk tree of the whole book. This module
+estimates the peak of every stage from the size of the text, the number of sentences and the number of
+names, picks for each stage the fastest strategy whose estimate fits in the budget, and runs the spaCy
+pipeline with those strategies:
+
+    text     'in_memory' (read_text)         or 'memory_mapped' (a CorpusStore, sentences decoded lazily)
+    matrix   'dense' (calculate_matrix)       'packed' (sparse products)  or 'chunked' (dense, in chunks)
+    nltk     'whole_book' (characters.py)     or 'per_sentence' (tagging and chunking one sentence at a time)
+
+    summary = run_with_budget(nlp_func, novel_folder, novel_name, budget_mb=512, model_mb=60)
+    summary['estimated_peak'], summary['actual_peak']
+
+The estimates are rough per-object costs of CPython and NumPy, meant to choose a strategy, not to
+predict the peak to the byte; the run summary reports the actual peak of the estimated stages next to
+them, and the actual bytes of every stage.
+"""
+import os
+import resource
+import threading
+import tracemalloc
+from collections import Counter
+
+import numpy as np
+from sklearn.feature_extraction.text import CountVectorizer
+
+from character_network_iterative import (calculate_align_rate, calculate_matrix, iterative_NER_v2, read_text,
+                                         top_names)
+from instrumentation import reset_peak
+
+MB = 2 ** 20
+# resident size of the spaCy models once loaded, in MB
+MODEL_MB = {'en_core_web_sm': 60, 'en_core_web_md': 130, 'en_core_web_lg': 800}
+# strategies of each stage, fastest first
+STRATEGIES = {'text': ('in_memory', 'memory_mapped'),
+              'matrix': ('dense', 'packed', 'chunked'),
+              'nltk': ('whole_book', 'per_sentence')}
+
+# average sizes measured on the bundled books
+_chars_per_sentence = 80
+_chars_per_token = 5
+_mentions_per_sentence = 0.5
+# CPython object sizes: a short str with its list slot, a (word, tag) tuple, a float, an ne_chunk tree node
+_token_bytes = 62
+_tagged_bytes = 72
+_float_bytes = 32
+_tree_bytes = 150
+
+
+def estimate_stages(text_chars, n_sentences=None, n_names=20, char_width=1, chunk_size=2000):
+    '''
+    Function to estimate the peak memory of every strategy of every stage.
+    :param text_chars: the length of the text in characters.
+    :param n_sentences: the number of sentences, estimated from the length if None.
+    :param n_names: the number of names of the matrices (names and places).
+    :param char_width: the bytes per character of the text in memory (1 for ASCII, 2 or 4 otherwise).
+    :param chunk_size: the number of sentences per chunk of the 'chunked' matrix strategy.
+    :return: dictionary {stage: {strategy: estimated bytes}}.
+    '''
+    n_sentences = n_sentences or max(text_chars // _chars_per_sentence, 1)
+    text = text_chars * char_width
+    sentences = text + n_sentences * (49 + 8)
+    tokens = text_chars // _chars_per_token
+    mentions = int(n_sentences * _mentions_per_sentence)
+    scores = n_sentences * _float_bytes
+    longest_sentence = 50 * _chars_per_sentence
+    return {
+        # read_text keeps the raw text and two intermediate copies, then the sentences; top_names lowercases
+        # the whole text once more and tokenises it
+        'text': {'in_memory': max(3 * text + sentences, 2 * text + sentences + tokens * _token_bytes),
+                 'memory_mapped': 2 * longest_sentence * char_width + n_sentences * 16},
+        # the occurrence array and the sentiment-weighted copy, or the sparse products
+        'matrix': {'dense': 2 * n_sentences * n_names * 8 + 4 * n_names ** 2 * 8 + scores,
+                   'packed': 3 * mentions * 16 + 2 * n_sentences * 8 + 2 * n_names ** 2 * 8 + scores,
+                   'chunked': 2 * min(chunk_size, n_sentences) * n_names * 8 + mentions * 16
+                   + 3 * n_names ** 2 * 8 + scores},
+        'nltk': {'whole_book': 3 * text + tokens * (_token_bytes + _tagged_bytes + _tree_bytes),
+                 'per_sentence': text + longest_sentence // _chars_per_token
+                 * (_token_bytes + _tagged_bytes + _tree_bytes)},
+    }
+
+
+def estimate_pack(text_chars, char_width=1):
+    '''
+    :return: the estimated peak of corpus_store.pack_corpus on a text, in bytes: the raw and cleaned text
+    and about 36 bytes per character for the UTF-32 copy and the byte offset arrays.
+    '''
+    return 3 * text_chars * char_width + 36 * text_chars
+
+
+def choose_strategies(estimates, budget_bytes, baseline_bytes=0):
+    '''
+    Function to pick the fastest strategy of every stage that fits in the budget.
+    :param estimates: the estimates of estimate_stages.
+    :param budget_bytes: the memory budget.
+    :param baseline_bytes: memory used during every stage (e.g. the loaded spaCy model).
+    :return: dictionary {stage: strategy}, and the list of stages where no strategy fits (they get the
+    smallest one).
+    '''
+    strategies, over_budget = {}, []
+    for stage, options in estimates.items():
+        fitting = [s for s in STRATEGIES[stage] if baseline_bytes + options[s] <= budget_bytes]
+        if fitting:
+            strategies[stage] = fitting[0]
+        else:
+            strategies[stage] = min(options, key=options.get)
+            over_budget.append(stage)
+    return strategies, over_budget
+
+
+def _rss():
+    # the current resident size of the process
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * resource.getpagesize()
+    except OSError:
+        return _rss_peak()
+
+
+class _PeakMeter(object):
+    # peak of each measured stage, relative to the memory in use when the stage starts: traced by measure,
+    # resident by measure_rss
+
+    def __init__(self):
+        self.peaks = {}
+
+    def measure_rss(self, stage, func, *args, **kwargs):
+        # sampled resident size instead of tracemalloc, which slows down long stages such as NER several times
+        base = _rss()
+        peak = [base]
+        done = threading.Event()
+
+        def sample():
+            while not done.wait(0.01):
+                peak[0] = max(peak[0], _rss())
+
+        sampler = threading.Thread(target=sample, daemon=True)
+        sampler.start()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            done.set()
+            sampler.join()
+            peak[0] = max(peak[0], _rss())
+            self.peaks[stage] = max(self.peaks.get(stage, 0), peak[0] - base)
+
+    def measure(self, stage, func, *args, **kwargs):
+        started = tracemalloc.is_tracing()
+        if not started:
+            tracemalloc.start()
+        # the peak of an instrumentation stage traced around this one is kept
+        reset_peak()
+        base = tracemalloc.get_traced_memory()[0]
+        try:
+            return func(*args, **kwargs)
+        finally:
+            self.peaks[stage] = max(self.peaks.get(stage, 0), tracemalloc.get_traced_memory()[1] - base)
+            if not started:
+                tracemalloc.stop()
+
+
+def _top_names_streaming(name_list, sentence_list, top_num):
+    # top_names counted sentence by sentence instead of on a lowercased copy of the whole text
+    vect = CountVectorizer(vocabulary=name_list, stop_words='english')
+    counts = np.zeros(len(name_list), dtype=np.int64)
+    for start in range(0, len(sentence_list), 5000):
+        counts += np.asarray(vect.transform(sentence_list[start:start + 5000]).sum(axis=0)).ravel()
+    order = np.argsort(-counts, kind='stable')[:top_num]
+    return [int(counts[i]) for i in order], [name_list[i] for i in order]
+
+
+def nltk_names_per_sentence(sentence_list, top_num=20):
+    '''
+    The NLTK path of characters.py (find_proper_nouns_v2 and get_person) run one sentence at a time, so the
+    token list, the tagged list and the ne_chunk tree never hold more than one sentence.
+    :param sentence_list: the list of sentences of the novel.
+    :param top_num: the number of names returned by each method.
+    :return: the top proper nouns and the top persons, as lists of (name, count).
+    '''
+    from nltk import chunk
+    from nlp_harry_potter import characters
+
+    characters.download_nltk_data()
+    proper_nouns, persons = Counter(), Counter()
+    for sentence in sentence_list:
+        tagged = characters.tagging(characters.text_tokenize(sentence))
+        # find_proper_nouns_v2 looks one token ahead; the sentinel keeps it within the sentence
+        proper_nouns.update(pn[0] for pn in characters.find_proper_nouns_v2(tagged + [('.', '.')]))
+        persons.update(pn[0] for pn in characters.get_person(chunk.ne_chunk(tagged)))
+    return proper_nouns.most_common(top_num), persons.most_common(top_num)
+
+
+def _text_size(path):
+    # the length in characters and the width in memory of a text, read in blocks
+    chars, widest = 0, 0
+    with open(path, 'r') as f:
+        for block in iter(lambda: f.read(MB), ''):
+            chars += len(block)
+            widest = max(widest, max(map(ord, block)))
+    return chars, 1 if widest < 0x100 else 2 if widest < 0x10000 else 4
+
+
+def plan_budget(novel_path, budget_mb, model_mb=0, top_num=20, chunk_size=2000, packed=True):
+    '''
+    Function to estimate the stages of a book and choose their strategies before running anything.
+    :param novel_path: the path of the novel.
+    :param budget_mb: the memory budget in MB.
+    :param model_mb: the resident size of the spaCy model in MB.
+    :param top_num: the number of names of the matrices.
+    :param chunk_size: see estimate_stages.
+    :param packed: whether the corpus store of the 'memory_mapped' strategy exists; if not, packing it is
+    part of the cost of that strategy.
+    :return: dictionary with the estimates, the strategies and the stages where no strategy fits.
+    '''
+    text_chars, char_width = _text_size(novel_path)
+    estimates = estimate_stages(text_chars, n_names=top_num, char_width=char_width, chunk_size=chunk_size)
+    if not packed:
+        estimates['text']['memory_mapped'] = max(estimates['text']['memory_mapped'],
+                                                 estimate_pack(text_chars, char_width))
+    strategies, over_budget = choose_strategies(estimates, budget_mb * MB, model_mb * MB)
+    return {'text_chars': text_chars, 'char_width': char_width, 'estimates': estimates,
+            'strategies': strategies, 'over_budget': over_budget}
+
+
+def _rss_peak():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    return peak if os.uname().sysname == 'Darwin' else peak * 1024
+
+
+def run_with_budget(nlp_func, novel_folder, novel_name, budget_mb, model_mb=None, model='en_core_web_sm',
+                    threshold_rate=0.0005, top_num=20, store_path=None, chunk_size=2000):
+    '''
+    Function to run read_text -> calculate_align_rate -> iterative_NER_v2 -> top_names -> calculate_matrix
+    within a memory budget. The text strategy is chosen from the size of the book, the matrix strategy
+    again once the number of sentences and names is known.
+    :param nlp_func: the spaCy Language used for NER.
+    :param novel_folder: the folder of the novels.
+    :param novel_name: the file name of the novel.
+    :param budget_mb: the memory budget in MB.
+    :param model_mb: the resident size of nlp_func in MB, looked up in MODEL_MB by model if None.
+    :param model: the name of the spaCy model, see model_mb.
+    :param threshold_rate: the per sentence frequency threshold, as in iterative_NER.
+    :param top_num: the number of names, as in top_names.
+    :param store_path: the folder of the corpus store of the 'memory_mapped' strategy, output/.store/<book>
+    by default (ignored by git). A missing store is
+    packed during the run, and the cost of packing counts against that strategy; pack it ahead of time with
+    corpus_store.pack_corpus to keep the cost out of the budget.
+    :param chunk_size: the number of sentences per chunk of the 'chunked' matrix strategy.
+    :return: dictionary with the results (name_list, name_frequency, align_rate, cooccurrence_matrix,
+    sentiment_matrix), the strategies, the stages where no strategy fits, the estimated and actual bytes of
+    every stage (traced, except NER which is measured as resident size, as tracemalloc slows it down), the
+    estimated and actual peak of the estimated stages (text, pack and matrix; the other stages are only in
+    actual_bytes), and the peak resident size of the process.
+    '''
+    budget = budget_mb * MB
+    model_mb = model_mb if model_mb is not None else MODEL_MB.get(model, 0)
+    baseline = model_mb * MB
+    store_path = store_path or os.path.join('output', '.store', os.path.splitext(novel_name)[0])
+    packed = os.path.exists(os.path.join(store_path, 'index.json'))
+    plan = plan_budget(os.path.join(novel_folder, novel_name), budget_mb, model_mb, top_num, chunk_size, packed)
+    text_chars, char_width, estimates = plan['text_chars'], plan['char_width'], plan['estimates']
+    strategies, over_budget = choose_strategies({'text': estimates['text']}, budget, baseline)
+    meter = _PeakMeter()
+    estimated_pack = None
+
+    if strategies['text'] == 'in_memory':
+        novel = meter.measure('text', read_text, novel_folder, novel_name)
+        from segmenter import default_segmenter
+        sentence_list = meter.measure('text', default_segmenter().sentences, novel)
+    else:
+        from corpus_store import CorpusStore, pack_corpus
+        if not packed:
+            estimated_pack = estimate_pack(text_chars, char_width)
+            meter.measure('pack', pack_corpus, novel_folder, [novel_name], store_path)
+        novel, sentence_list = None, CorpusStore(store_path).sentences(novel_name)
+
+    align_rate = meter.measure('sentiment', calculate_align_rate, sentence_list)
+    preliminary_name_list = meter.measure_rss('ner', iterative_NER_v2, nlp_func, sentence_list, threshold_rate)
+    if novel is not None:
+        name_frequency, name_list = meter.measure('top_names', top_names, preliminary_name_list, novel, top_num)
+    else:
+        name_frequency, name_list = meter.measure('top_names', _top_names_streaming, preliminary_name_list,
+                                                  sentence_list, top_num)
+
+    # the matrix strategy is chosen with the actual number of sentences and names
+    matrix_estimates = estimate_stages(text_chars, len(sentence_list), len(name_list), char_width,
+                                       chunk_size)['matrix']
+    resident = meter.peaks.get('text', 0) if novel is not None else 0
+    matrix_strategy, matrix_over = choose_strategies({'matrix': matrix_estimates}, budget, baseline + resident)
+    strategies.update(matrix_strategy)
+    over_budget += matrix_over
+    options = {'dense': {}, 'packed': {'packed': True}, 'chunked': {'chunk_size': chunk_size}}
+    cooccurrence_matrix, sentiment_matrix = meter.measure('matrix', calculate_matrix, name_list, sentence_list,
+                                                          align_rate, **options[strategies['matrix']])
+
+    estimated = {'text': estimates['text'][strategies['text']], 'matrix': matrix_estimates[strategies['matrix']]}
+    if estimated_pack is not None:
+        estimated['pack'] = estimated_pack
+    return {'name_list': name_list, 'name_frequency': name_frequency, 'align_rate': align_rate,
+            'cooccurrence_matrix': cooccurrence_matrix, 'sentiment_matrix': sentiment_matrix,
+            'strategies': strategies, 'over_budget': over_budget, 'budget_bytes': budget,
+            'model_bytes': baseline, 'estimated_bytes': estimated, 'actual_bytes': dict(meter.peaks),
+            'estimated_peak': baseline + max(estimated.values()),
+            'actual_peak': baseline + max(meter.peaks[stage] for stage in estimated),
+            'rss_peak': _rss_peak()}
+
+
+def run_nltk_with_budget(novel_folder, novel_name, budget_mb, top_num=20):
+    '''
+    Function to run the NLTK path of characters.py (find_proper_nouns_v2 and get_person) within a memory
+    budget: on the whole book when it fits, else one sentence at a time.
+    :param novel_folder: the folder of the novels.
+    :param novel_name: the file name of the novel.
+    :param budget_mb: the memory budget in MB.
+    :param top_num: the number of names returned by each method.
+    :return: dictionary with the top proper nouns and persons (lists of (name, count)), the strategy, whether
+    it fits, the estimated and actual (traced) bytes, and the peak resident size of the process.
+    '''
+    from nltk import chunk
+    from nlp_harry_potter import characters
+
+    characters.download_nltk_data()
+    plan = plan_budget(os.path.join(novel_folder, novel_name), budget_mb, 0, top_num)
+    strategy = plan['strategies']['nltk']
+    meter = _PeakMeter()
+
+    def whole_book():
+        tagged = characters.tagging(characters.text_tokenize(read_text(novel_folder, novel_name)))
+        proper_nouns = characters.summarize_text(characters.find_proper_nouns_v2(tagged), top_num)
+        persons = Counter(pn[0] for pn in characters.get_person(chunk.ne_chunk(tagged)))
+        return (sorted(((k, v[0]) for k, v in proper_nouns.items()), key=lambda item: item[1], reverse=True)[:top_num],
+                persons.most_common(top_num))
+
+    def per_sentence():
+        from segmenter import default_segmenter
+        return nltk_names_per_sentence(default_segmenter().sentences(read_text(novel_folder, novel_name)), top_num)
+
+    proper_nouns, persons = meter.measure('nltk', whole_book if strategy == 'whole_book' else per_sentence)
+    return {'proper_nouns': proper_nouns, 'persons': persons, 'strategy': strategy,
+            'over_budget': 'nltk' in plan['over_budget'], 'estimated_bytes': plan['estimates']['nltk'][strategy],
+            'actual_bytes': meter.peaks['nltk'], 'rss_peak': _rss_peak()}
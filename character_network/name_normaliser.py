@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+"""
+Shared normalisation of character names.
+
+name_entity_recognition (spaCy path) and characters.find_proper_nouns_v2 (NLTK path) normalise the same
+surface strings ('Harry', "Harry's", 'HARRY') thousands of times per novel. NameNormaliser applies a
+configurable set of rules and memoises the result per raw string in a bounded LRU cache, so each
+distinct span is normalised once.
+"""
+from functools import lru_cache
+
+# typographic quotes found in the scanned books, folded to their ASCII form
+QUOTES = str.maketrans({'‘': "'", '’': "'", '‚': "'", '′': "'",
+                        '“': '"', '”': '"', '„': '"', '″': '"'})
+
+HONORIFICS = ('professor', 'uncle', 'aunt', 'mr', 'mr.', 'mrs', 'mrs.', 'miss', 'madam', 'madame', 'sir',
+              'lord', 'lady', 'dr', 'dr.', 'headmaster')
+
+
+class NameNormaliser(object):
+    '''
+    Memoised name normalisation.
+    :param lowercase: whether names are lowercased.
+    :param strip_possessive: whether "'s" is removed ("Harry's" -> "harry").
+    :param honorifics: leading words removed from multi-word names ('Professor McGonagall' -> 'mcgonagall');
+    HONORIFICS holds the usual ones. Compared after lowercasing.
+    :param fold_quotes: whether typographic quotes are replaced by ASCII quotes first. Off by default, so
+    read_text returns the text of the book as it is.
+    :param cache_size: the number of distinct raw strings kept in the cache.
+    '''
+
+    def __init__(self, lowercase=True, strip_possessive=True, honorifics=(), fold_quotes=False, cache_size=2 ** 16):
+        self.lowercase = lowercase
+        self.strip_possessive = strip_possessive
+        self.honorifics = frozenset(h.lower() for h in honorifics)
+        self.fold_quotes = fold_quotes
+        self._normalise = lru_cache(maxsize=cache_size)(self._apply_rules)
+
+    def _apply_rules(self, text):
+        if self.fold_quotes:
+            text = text.translate(QUOTES)
+        if self.lowercase:
+            text = text.lower()
+        if self.strip_possessive:
+            text = text.replace("'s", "")
+        if self.honorifics:
+            words = text.split(' ')
+            while len(words) > 1 and words[0].lower() in self.honorifics:
+                words = words[1:]
+            text = ' '.join(words)
+        return text
+
+    def __call__(self, text):
+        '''
+        :param text: the raw span or token text.
+        :return: the normalised name.
+        '''
+        return self._normalise(text)
+
+    def config(self):
+        '''
+        :return: the rules of the normaliser, as a JSON-serialisable dictionary (for cache keys).
+        '''
+        return {'lowercase': self.lowercase, 'strip_possessive': self.strip_possessive,
+                'honorifics': sorted(self.honorifics), 'fold_quotes': self.fold_quotes}
+
+    def normalise_text(self, text):
+        '''
+        Function to apply the whole-text rules used by read_text: lines are joined into one block and,
+        if fold_quotes is set, typographic quotes are folded.
+        :param text: the raw text of a novel.
+        :return: the normalised text.
+        '''
+        text = text.replace('\r', ' ').replace('\n', ' ')
+        if self.fold_quotes:
+            text = text.translate(QUOTES)
+        return text
+
+    def stats(self):
+        '''
+        :return: dictionary with the cache hits, misses, size and hit rate.
+        '''
+        info = self._normalise.cache_info()
+        calls = info.hits + info.misses
+        return {'hits': info.hits, 'misses': info.misses, 'size': info.currsize, 'max_size': info.maxsize,
+                'hit_rate': info.hits / calls if calls else 0.0}
+
+    def clear(self):
+        self._normalise.cache_clear()
+
+
+# the spaCy path: whole entity spans, with the possessive removed
+name_normaliser = NameNormaliser()
+# the NLTK path: joined proper-noun spans, which keep their possessive ("harry's wand")
+token_normaliser = NameNormaliser(strip_possessive=False)
@@ -0,0 +1,177 @@
+# -*- coding: utf-8 -*-
+"""
+Packed lower-triangle storage for co-occurrence and sentiment matrices.
+
+calculate_matrix returns square matrices whose diagonal and upper triangle are zero. PackedTriangle
+keeps only the n(n-1)/2 strictly-lower entries in one vector (int32 counts, float32 sentiment), and
+computes edge weights and colours on that vector. np.asarray(packed) still gives the square matrix, and
+the arithmetic of the dense matrices works on it too: adding or subtracting PackedTriangles of the same
+size, scaling by a scalar, negating and abs stay packed (sentiment += align_rate * cooccurrence), while any
+other NumPy operation (np.max, comparisons, adding a dense matrix, ...) runs on the square matrix.
+"""
+import numpy as np
+import scipy.sparse as sp
+
+# the elementwise operations that keep the diagonal and upper triangle at zero, by number of operands
+_PACKED_UFUNCS = {1: (np.negative, np.positive, np.absolute), 2: (np.add, np.subtract, np.multiply, np.true_divide)}
+
+
+class PackedTriangle(np.lib.mixins.NDArrayOperatorsMixin):
+    '''
+    Strict lower triangle of a symmetric matrix, stored row by row: entry (i, j) with j < i is at
+    i * (i - 1) / 2 + j, the order of np.tril_indices(n, -1).
+    :param data: the packed vector of n * (n - 1) / 2 values.
+    :param n: the size of the square matrix.
+    '''
+
+    def __init__(self, data, n):
+        if len(data) != n * (n - 1) // 2:
+            raise ValueError(f"a packed triangle of size {n} needs {n * (n - 1) // 2} values, got {len(data)}")
+        self.data = data
+        self.n = n
+
+    @classmethod
+    def from_dense(cls, matrix, dtype=None):
+        '''
+        :param matrix: a square matrix; only its strict lower triangle is kept.
+        :param dtype: the dtype of the packed vector, the matrix's dtype by default.
+        '''
+        matrix = np.asarray(matrix)
+        n = matrix.shape[0]
+        return cls(matrix[np.tril_indices(n, -1)].astype(dtype or matrix.dtype), n)
+
+    @classmethod
+    def from_sparse(cls, matrix, dtype):
+        '''
+        :param matrix: a square scipy sparse matrix; only its strict lower triangle is kept.
+        :param dtype: the dtype of the packed vector.
+        '''
+        n = matrix.shape[0]
+        lower = sp.tril(matrix, -1).tocoo()
+        data = np.zeros(n * (n - 1) // 2, dtype=dtype)
+        rows = lower.row.astype(np.int64)
+        np.add.at(data, rows * (rows - 1) // 2 + lower.col, lower.data.astype(dtype))
+        return cls(data, n)
+
+    @property
+    def shape(self):
+        return self.n, self.n
+
+    @property
+    def dtype(self):
+        return self.data.dtype
+
+    @property
+    def nbytes(self):
+        return self.data.nbytes
+
+    def _packed_operands(self, ufunc, inputs):
+        # the packed vectors or scalars the ufunc can run on, or None when the result is not a triangle
+        if ufunc not in _PACKED_UFUNCS.get(len(inputs), ()):
+            return None
+        packed = [isinstance(x, PackedTriangle) for x in inputs]
+        if any(p and x.n != self.n for p, x in zip(packed, inputs)):
+            return None
+        if not all(p or np.ndim(x) == 0 for p, x in zip(packed, inputs)):
+            return None
+        # a scalar added to the zeros, or anything divided by them, is not zero any more
+        if ufunc in (np.add, np.subtract) and not all(packed):
+            return None
+        if ufunc is np.true_divide and not (packed[0] and not packed[1]):
+            return None
+        return [x.data if p else x for p, x in zip(packed, inputs)]
+
+    def __array_ufunc__(self, ufunc, method, *inputs, **kwargs):
+        out = kwargs.pop('out', None)
+        operands = self._packed_operands(ufunc, inputs) if method == '__call__' and not kwargs else None
+        if operands is not None and (out is None or isinstance(out[0], PackedTriangle)):
+            data = ufunc(*operands)
+            if out is None:
+                return PackedTriangle(data, self.n)
+            # in place, e.g. sentiment_matrix += align_rate * cooccurrence_matrix
+            np.copyto(out[0].data, data, casting='same_kind')
+            return out[0]
+        inputs = [np.asarray(x) if isinstance(x, PackedTriangle) else x for x in inputs]
+        if out is not None:
+            if any(isinstance(x, PackedTriangle) for x in out):
+                raise TypeError("the result of this operation is not a packed triangle")
+            kwargs['out'] = out
+        return getattr(ufunc, method)(*inputs, **kwargs)
+
+    def _position(self, i, j):
+        if i < j:
+            i, j = j, i
+        return i * (i - 1) // 2 + j
+
+    def __getitem__(self, index):
+        i, j = index
+        if i == j:
+            return self.data.dtype.type(0)
+        return self.data[self._position(i, j)]
+
+    def nonzero(self):
+        '''
+        Function to find the nonzero entries without the n(n-1)/2 index arrays of np.tril_indices: the
+        packed position k of entry (i, j) is inverted with i = floor((1 + sqrt(1 + 8k)) / 2).
+        :return: the int32 rows and columns of the nonzero entries (row > column), in packed order.
+        '''
+        k = np.flatnonzero(self.data)
+        i = np.floor((1 + np.sqrt(1 + 8 * k.astype(np.float64))) / 2).astype(np.int64)
+        # the square root can be off by one ulp for large k
+        i -= i * (i - 1) // 2 > k
+        i += (i + 1) * i // 2 <= k
+        return i.astype(np.int32), (k - i * (i - 1) // 2).astype(np.int32)
+
+    def toarray(self):
+        '''
+        :return: the square matrix in the layout of calculate_matrix (lower triangle, zero diagonal).
+        '''
+        matrix = np.zeros((self.n, self.n), dtype=self.data.dtype)
+        matrix[np.tril_indices(self.n, -1)] = self.data
+        return matrix
+
+    def __array__(self, dtype=None, copy=None):
+        matrix = self.toarray()
+        return matrix if dtype is None else matrix.astype(dtype)
+
+    def tosparse(self):
+        '''
+        :return: the symmetric matrix as a scipy CSR matrix, without building the dense square.
+        '''
+        rows, cols = self.nonzero()
+        values = self.data[self.data != 0]
+        return sp.csr_matrix((np.concatenate([values, values]), (np.concatenate([rows, cols]),
+                                                                  np.concatenate([cols, rows]))),
+                             shape=self.shape)
+
+    def weights(self, mode):
+        '''
+        Function to compute the edge weight and colour of every pair on the packed vector, with the
+        formulas of matrix_to_edge_list.
+        :param mode: 'co-occurrence' or 'sentiment'
+        :return: the packed float32 weight and color vectors.
+        '''
+        normalized = self.data.astype(np.float32)
+        normalized /= np.max(np.abs(normalized))
+        if mode == 'co-occurrence':
+            color = np.log1p(2000 * normalized)
+            weight = color * np.float32(0.7)
+        elif mode == 'sentiment':
+            weight = np.log1p(np.abs(1000 * normalized)) * np.float32(0.7)
+            color = 2000 * normalized
+        else:
+            raise ValueError("mode should be either 'co-occurrence' or 'sentiment'")
+        return weight, color
+
+    def edge_list(self, mode, name_list):
+        '''
+        :param mode: 'co-occurrence' or 'sentiment'
+        :param name_list: the list of names of the matrix.
+        :return: the edge list with weight and color param, as matrix_to_edge_list returns it, without the
+        pairs whose value is zero (their edges have zero width).
+        '''
+        weight, color = self.weights(mode)
+        nonzero = self.data != 0
+        rows, cols = self.nonzero()
+        return [(name_list[i], name_list[j], {'weight': w, 'color': c})
+                for i, j, w, c in zip(rows, cols, weight[nonzero], color[nonzero])]
@@ -0,0 +1,238 @@
+# -*- coding: utf-8 -*-
+"""
+Sampling-based preview of iterative_NER -> top_names -> calculate_matrix.
+
+PreviewEstimator runs NER and sentiment scoring on a stratified random sample of the sentences (the
+strata are chapters, or fixed-size blocks of sentences), a few sentences per stratum at a time. Name
+frequencies and co-occurrence and sentiment weights are estimated for the whole novel with the stratified
+estimator, together with normal-approximation confidence intervals that narrow as more rounds are
+processed. Once every sentence has been sampled the estimates are the exact values.
+
+    for snapshot in progressive_preview(nlp_func, sentence_list, top_num=20, time_budget=10):
+        plot_graph(snapshot['names'], snapshot['name_frequency'], snapshot['cooccurrence_matrix'], ...)
+"""
+import time
+from collections import Counter
+from statistics import NormalDist
+
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+from sklearn.feature_extraction.text import CountVectorizer
+
+from character_network_iterative import name_entity_recognition, occurrence_matrix, sentiment_scores
+
+
+def _stratified_estimate(values, strata, population, sampled, z):
+    '''
+    Stratified estimate of column totals.
+    :param values: (samples x k) array or sparse matrix of the sampled values.
+    :param strata: the stratum of each sample.
+    :param population: the number of sentences of each stratum.
+    :param sampled: the number of samples of each stratum.
+    :param z: the normal quantile of the confidence level.
+    :return: the estimated totals and the half-widths of their confidence intervals.
+    '''
+    n_strata = len(population)
+    indicator = sp.csr_matrix((np.ones(len(strata)), (strata, np.arange(len(strata)))),
+                              shape=(n_strata, len(strata)))
+    values = sp.csr_matrix(values, dtype=np.float64)
+    sums = np.asarray((indicator @ values).todense())
+    squares = np.asarray((indicator @ values.multiply(values)).todense())
+    n = np.maximum(sampled, 1)[:, None].astype(np.float64)
+    N = population[:, None].astype(np.float64)
+    mean = sums / n
+    variance = np.where(n > 1, (squares - n * mean ** 2) / np.maximum(n - 1, 1), 0.0)
+    # strata with a single sample borrow the variance of the whole sample
+    if len(strata) > 1:
+        total_n = len(strata)
+        pooled = (squares.sum(axis=0) - sums.sum(axis=0) ** 2 / total_n) / (total_n - 1)
+        variance = np.where(n > 1, variance, pooled[None, :])
+    variance = np.maximum(variance, 0.0)
+    active = sampled[:, None] > 0
+    estimate = np.where(active, N * mean, 0.0).sum(axis=0)
+    finite_correction = 1 - sampled[:, None] / np.maximum(N, 1)
+    error = np.where(active, N ** 2 * finite_correction * variance / n, 0.0).sum(axis=0)
+    return estimate, z * np.sqrt(error)
+
+
+class PreviewEstimator(object):
+    '''
+    Progressive stratified-sample estimator of the name frequencies and character matrices of a novel.
+    :param nlp_func: the spaCy Language used for NER.
+    :param sentence_list: the list of sentences of the novel.
+    :param chapter_starts: the first sentence of every chapter (e.g. from CorpusStore.chapter_starts); if None,
+    the strata are blocks of stratum_size sentences.
+    :param stratum_size: the size of the strata when no chapters are given.
+    :param threshold_rate: the per sentence frequency threshold, as in iterative_NER.
+    :param confidence: the confidence level of the intervals.
+    :param seed: the seed of the sampling.
+    '''
+
+    def __init__(self, nlp_func, sentence_list, chapter_starts=None, stratum_size=200, threshold_rate=0.0005,
+                 confidence=0.95, seed=0):
+        self.nlp_func = nlp_func
+        self.sentence_list = sentence_list
+        self.threshold_rate = threshold_rate
+        self.z = NormalDist().inv_cdf(0.5 + confidence / 2)
+        if chapter_starts is None:
+            chapter_starts = range(0, len(sentence_list), stratum_size)
+        bounds = sorted(set(int(x) for x in chapter_starts if 0 <= x < len(sentence_list)) | {0})
+        bounds.append(len(sentence_list))
+        rng = np.random.default_rng(seed)
+        # a random order of the sentences of each stratum; round r samples the next ones of every stratum
+        self.orders = [rng.permutation(np.arange(a, b)) for a, b in zip(bounds[:-1], bounds[1:]) if b > a]
+        self.population = np.array([len(order) for order in self.orders], dtype=np.int64)
+        self.sampled = np.zeros(len(self.orders), dtype=np.int64)
+        self.samples, self.strata, self.entities, self.scores = [], [], [], []
+
+    @property
+    def done(self):
+        return bool(np.all(self.sampled >= self.population))
+
+    @property
+    def sample_rate(self):
+        return len(self.samples) / len(self.sentence_list) if len(self.sentence_list) else 1.0
+
+    def refine(self, per_chapter=2):
+        '''
+        Function to sample and process the next sentences of every stratum.
+        :param per_chapter: the number of new sentences taken from each stratum.
+        :return: the number of sentences processed.
+        '''
+        new = []
+        for h, order in enumerate(self.orders):
+            taken = order[self.sampled[h]:self.sampled[h] + per_chapter]
+            self.sampled[h] += len(taken)
+            new.extend((h, i) for i in taken)
+        sentences = [self.sentence_list[i] for _, i in new]
+        self.scores.extend(sentiment_scores(sentences))
+        for (h, i), sentence in zip(new, sentences):
+            self.samples.append(i)
+            self.strata.append(h)
+            self.entities.append(name_entity_recognition(self.nlp_func, sentence))
+        return len(new)
+
+    def _estimate(self, values):
+        return _stratified_estimate(values, np.asarray(self.strata, dtype=np.int64), self.population,
+                                    self.sampled, self.z)
+
+    def _sample_sentences(self):
+        return [self.sentence_list[i] for i in self.samples]
+
+    def _weights(self):
+        # the number of sentences of the novel each sample stands for
+        strata = np.asarray(self.strata, dtype=np.int64)
+        return self.population[strata] / np.maximum(self.sampled[strata], 1)
+
+    def name_list(self):
+        '''
+        :return: the names whose estimated NER count passes the threshold of iterative_NER.
+        '''
+        vocabulary = sorted(set(name for names in self.entities for name in names))
+        if not vocabulary:
+            return []
+        column = {name: j for j, name in enumerate(vocabulary)}
+        rows, cols, values = [], [], []
+        for r, names in enumerate(self.entities):
+            for name, n in Counter(names).items():
+                rows.append(r)
+                cols.append(column[name])
+                values.append(n)
+        counts = sp.csr_matrix((values, (rows, cols)), shape=(len(self.samples), len(vocabulary)))
+        estimate, _ = self._estimate(counts)
+        threshold = self.threshold_rate * len(self.sentence_list)
+        return [name for name, e in zip(vocabulary, estimate) if e >= threshold]
+
+    def frequency_table(self, name_list=None):
+        '''
+        Function to estimate the frequency of names in the novel, as top_names counts them.
+        :param name_list: the names, name_list() by default.
+        :return: DataFrame indexed by name with the estimate and the lower and upper confidence bounds,
+        by decreasing estimate.
+        '''
+        name_list = self.name_list() if name_list is None else name_list
+        if not name_list or not self.samples:
+            return pd.DataFrame(columns=['estimate', 'lower', 'upper'])
+        vect = CountVectorizer(vocabulary=name_list, stop_words='english')
+        estimate, half_width = self._estimate(vect.fit_transform(self._sample_sentences()))
+        table = pd.DataFrame({'estimate': estimate, 'lower': np.maximum(estimate - half_width, 0),
+                              'upper': estimate + half_width}, index=name_list)
+        return table.sort_values(by='estimate', ascending=False, kind='stable')
+
+    def top_names(self, top_num=20):
+        '''
+        :param top_num: the number of names returned.
+        :return: the list of estimated frequencies and the list of top names, as top_names returns them.
+        '''
+        table = self.frequency_table()[:top_num]
+        return list(table.estimate), list(table.index)
+
+    def align_rate(self):
+        '''
+        :return: the estimated align rate of the novel (see calculate_align_rate).
+        '''
+        weights, scores = self._weights(), np.asarray(self.scores, dtype=np.float64)
+        nonzero = np.sum(weights * (scores != 0))
+        return np.sum(weights * scores) / nonzero * -2 if nonzero else 0.0
+
+    def calculate_matrix(self, name_list, align_rate=None):
+        '''
+        Function to estimate the matrices of calculate_matrix from the sample.
+        :param name_list: the list of names of the top characters.
+        :param align_rate: the align rate of the novel, estimated from the sample if None.
+        :return: the estimated co-occurrence and sentiment matrices (lower triangle, zero diagonal) and a
+        dictionary with the half-widths of their confidence intervals, in the same layout.
+        '''
+        align_rate = self.align_rate() if align_rate is None else align_rate
+        n = len(name_list)
+        if not n or not self.samples:
+            return np.zeros((n, n)), np.zeros((n, n)), {'cooccurrence': np.zeros((n, n)),
+                                                        'sentiment': np.zeros((n, n))}
+        occurrence = occurrence_matrix(name_list, self._sample_sentences()).toarray().astype(np.float64)
+        rows, cols = np.tril_indices(n, -1)
+        pairs = occurrence[:, rows] * occurrence[:, cols]
+        scores = np.asarray(self.scores, dtype=np.float64)[:, None]
+        matrices = []
+        for values in [pairs, pairs * (scores + align_rate)]:
+            estimate, half_width = self._estimate(values)
+            matrix, interval = np.zeros((n, n)), np.zeros((n, n))
+            matrix[rows, cols], interval[rows, cols] = estimate, half_width
+            matrices.append((matrix, interval))
+        (cooccurrence_matrix, cooccurrence_interval), (sentiment_matrix, sentiment_interval) = matrices
+        return cooccurrence_matrix, sentiment_matrix, {'cooccurrence': cooccurrence_interval,
+                                                       'sentiment': sentiment_interval}
+
+
+def progressive_preview(nlp_func, sentence_list, top_num=20, per_chapter=2, max_rounds=None, time_budget=None,
+                        **kwargs):
+    '''
+    Generator refining a preview round by round, until every sentence is processed, max_rounds rounds are
+    done or time_budget seconds have passed.
+    :param nlp_func: the spaCy Language used for NER.
+    :param sentence_list: the list of sentences of the novel.
+    :param top_num: the number of top names.
+    :param per_chapter: the number of sentences sampled from each stratum per round.
+    :param max_rounds: the maximal number of rounds.
+    :param time_budget: the time in seconds after which no new round is started.
+    :param kwargs: passed to PreviewEstimator (chapter_starts, threshold_rate, confidence, seed, ...).
+    :return: yields a dictionary per round with the sample rate, the top names and their estimated
+    frequency, the frequency table, the estimated matrices and their intervals, and the align rate.
+    '''
+    estimator = PreviewEstimator(nlp_func, sentence_list, **kwargs)
+    start, rounds = time.perf_counter(), 0
+    while not estimator.done:
+        if max_rounds is not None and rounds >= max_rounds:
+            break
+        if time_budget is not None and rounds and time.perf_counter() - start >= time_budget:
+            break
+        estimator.refine(per_chapter)
+        rounds += 1
+        table = estimator.frequency_table()[:top_num]
+        names = list(table.index)
+        align_rate = estimator.align_rate()
+        cooccurrence_matrix, sentiment_matrix, intervals = estimator.calculate_matrix(names, align_rate)
+        yield {'round': rounds, 'sample_rate': estimator.sample_rate, 'seconds': time.perf_counter() - start,
+               'names': names, 'name_frequency': list(table.estimate), 'frequency_table': table,
+               'align_rate': align_rate, 'cooccurrence_matrix': cooccurrence_matrix,
+               'sentiment_matrix': sentiment_matrix, 'intervals': intervals}
@@ -0,0 +1,275 @@
+# -*- coding: utf-8 -*-
+"""
+Query engine over the character co-occurrence of a corpus.
+
+CooccurrenceIndex is built once from a CorpusStore: a mention index (for every character or place, the
+sorted numbers of the sentences mentioning it) and one sparse co-occurrence block per chapter, plus a
+running sum every few chapters, so the co-occurrence of any range of chapters or books is the difference
+of two running sums topped up with a few blocks.
+Queries such as "who appears with Snape in books 3-5" or "top places for Hagrid" are then answered
+without rerunning calculate_matrix, and their results are kept in an LRU cache.
+
+    index = CooccurrenceIndex.build(store, name_list, place_list)
+    index.top_partners('snape', k=10, books=(2, 4))
+    index.top_partners('hagrid', kind='place')
+"""
+import bisect
+import json
+import os
+from functools import lru_cache
+
+import numpy as np
+import scipy.sparse as sp
+from sklearn.feature_extraction.text import CountVectorizer
+
+import character_network_iterative as cni
+
+# the alias lists of character_network_iterative.py, each merged into one character
+CHARACTER_ALIASES = {'harry': cni.harry, 'ron': cni.ron, 'hermione': cni.Hermione, 'snape': cni.snape,
+                     'dumbledore': cni.dumbledore, 'hagrid': cni.hagrid, 'malfoy': cni.malfoy,
+                     'mcgonagall': cni.mcgonagall, 'neville': cni.neville}
+
+
+def _entity_occurrence(sentence_list, entity_aliases):
+    # (sentences x entities) binary matrix: a sentence mentions an entity when it contains one of its aliases
+    vocabulary = sorted({alias.lower() for aliases in entity_aliases for alias in aliases})
+    column = {alias: i for i, alias in enumerate(vocabulary)}
+    longest = max((len(alias.split()) for alias in vocabulary), default=1)
+    vect = CountVectorizer(vocabulary=vocabulary, binary=True, ngram_range=(1, longest))
+    occurrence = vect.fit_transform(sentence_list)
+    rows = [column[alias.lower()] for aliases in entity_aliases for alias in aliases]
+    cols = [j for j, aliases in enumerate(entity_aliases) for _ in aliases]
+    merge = sp.csr_matrix((np.ones(len(rows)), (rows, cols)), shape=(len(vocabulary), len(entity_aliases)))
+    occurrence = (occurrence @ merge).tocsr()
+    occurrence.data[:] = 1
+    return occurrence.astype(np.int32)
+
+
+class CooccurrenceIndex(object):
+    '''
+    Mention index and per-segment co-occurrence blocks of a corpus. The segments are the preamble and the
+    chapters of every book, with the chapters of the CorpusStore, so (book, chapters) selects the same
+    sentences as CorpusStore.sentences.
+    :param entities: the names of the characters and places.
+    :param kinds: 'character' or 'place' for each entity.
+    :param occurrence: the binary (sentences x entities) occurrence matrix of the whole corpus.
+    :param books: the names of the books, in corpus order.
+    :param book_sentences: for each book, its [start, end) range of corpus sentences.
+    :param book_chapters: for each book, its chapters as in CorpusStore.books: [number, first sentence].
+    :param cache_size: the number of query results kept in the LRU cache.
+    :param prefix_every: the number of segments between two stored running sums; a range sums at most
+    2 * (prefix_every - 1) segment blocks on top of two running sums.
+    '''
+
+    def __init__(self, entities, kinds, occurrence, books, book_sentences, book_chapters, cache_size=1024,
+                 prefix_every=16):
+        self.entities = list(entities)
+        self.kinds = list(kinds)
+        self.entity_index = {name: i for i, name in enumerate(self.entities)}
+        self.books = list(books)
+        self.book_sentences = [tuple(sentences) for sentences in book_sentences]
+        self.book_chapters = [[tuple(chapter) for chapter in chapters] for chapters in book_chapters]
+        self.prefix_every = prefix_every
+        starts = set()
+        for (start, end), chapters in zip(self.book_sentences, self.book_chapters):
+            starts.update([start] + [sentence for _, sentence in chapters])
+        # the first sentence of every segment, followed by the number of sentences
+        self.segment_starts = np.array(sorted(starts) + [occurrence.shape[0]], dtype=np.int64)
+        self.occurrence = sp.csr_matrix(occurrence, dtype=np.int32)
+        # mention index: the sentences of entity j are mentions.indices[mentions.indptr[j]:mentions.indptr[j + 1]]
+        self.mentions_index = self.occurrence.tocsc()
+        self.mentions_index.sort_indices()
+        self._blocks, self._prefixes = self._segment_blocks()
+        self._row = lru_cache(maxsize=cache_size)(self._range_row)
+
+    @classmethod
+    def build(cls, store, name_list, place_list=(), aliases=None, cache_size=1024, prefix_every=16):
+        '''
+        Function to build the index of a corpus.
+        :param store: a corpus_store.CorpusStore holding the books.
+        :param name_list: the character names to index (e.g. from iterative_NER on every book).
+        :param place_list: the place names to index.
+        :param aliases: dictionary {character: [aliases]} of names merged into one character, CHARACTER_ALIASES by
+        default; names of name_list that are an alias of a character are merged into it.
+        :param cache_size: the number of query results kept in the LRU cache.
+        :param prefix_every: see CooccurrenceIndex.
+        :return: the CooccurrenceIndex.
+        '''
+        aliases = CHARACTER_ALIASES if aliases is None else aliases
+        alias_of = {alias.lower(): name for name, names in aliases.items() for alias in names}
+        entity_aliases, kinds = {}, {}
+        for name in list(aliases) + list(name_list):
+            entity = alias_of.get(name.lower(), name.lower())
+            entity_aliases.setdefault(entity, set()).update(aliases.get(entity, [entity]))
+            kinds[entity] = 'character'
+        for place in place_list:
+            entity_aliases.setdefault(place.lower(), {place.lower()})
+            kinds.setdefault(place.lower(), 'place')
+        entities = list(entity_aliases)
+        occurrence = _entity_occurrence(store.sentences(), [sorted(entity_aliases[e]) for e in entities])
+        books = list(store.books.values())
+        return cls(entities, [kinds[e] for e in entities], occurrence, list(store.books),
+                   [book['sentences'] for book in books], [book['chapters'] for book in books], cache_size,
+                   prefix_every)
+
+    def _segment_blocks(self):
+        # blocks[s] is the co-occurrence of segment s and prefixes[p] that of segments [0, p * prefix_every),
+        # so memory grows with the segments / prefix_every running sums instead of one per segment
+        n = len(self.entities)
+        blocks, prefixes = [], [sp.csr_matrix((n, n), dtype=np.int32)]
+        total = prefixes[0]
+        for start, end in zip(self.segment_starts[:-1], self.segment_starts[1:]):
+            block = self.occurrence[start:end]
+            block = (block.T @ block).tocsr()
+            block.setdiag(0)
+            block.eliminate_zeros()
+            blocks.append(block)
+            total = total + block
+            if len(blocks) % self.prefix_every == 0:
+                prefixes.append(total.tocsr())
+        return blocks, prefixes
+
+    def _prefix(self, segment, i=None):
+        # the co-occurrence of segments [0, segment), or its row i
+        p = segment // self.prefix_every
+        parts = [self._prefixes[p]] + self._blocks[p * self.prefix_every:segment]
+        if i is not None:
+            parts = [part.getrow(i) for part in parts]
+        return sum(parts[1:], parts[0]).tocsr()
+
+    def save(self, path):
+        '''
+        Function to persist the index; the segment blocks are rebuilt from the occurrence matrix on load.
+        :param path: the folder to write to (created if missing).
+        '''
+        os.makedirs(path, exist_ok=True)
+        sp.save_npz(os.path.join(path, 'occurrence.npz'), self.occurrence)
+        tmp_path = os.path.join(path, 'index.json.tmp')
+        with open(tmp_path, 'w') as f:
+            json.dump({'entities': self.entities, 'kinds': self.kinds, 'books': self.books,
+                       'book_sentences': self.book_sentences, 'book_chapters': self.book_chapters,
+                       'prefix_every': self.prefix_every}, f)
+        os.replace(tmp_path, os.path.join(path, 'index.json'))
+        return path
+
+    @classmethod
+    def load(cls, path, cache_size=1024):
+        '''
+        :param path: the folder written by save.
+        :param cache_size: the number of query results kept in the LRU cache.
+        :return: the CooccurrenceIndex.
+        '''
+        with open(os.path.join(path, 'index.json')) as f:
+            meta = json.load(f)
+        return cls(meta['entities'], meta['kinds'], sp.load_npz(os.path.join(path, 'occurrence.npz')),
+                   meta['books'], meta['book_sentences'], meta['book_chapters'], cache_size, meta['prefix_every'])
+
+    def chapter_range(self, books=None, chapters=None):
+        '''
+        Function to turn a book and chapter selection into a range of segments.
+        :param books: None for the whole corpus, a book (name or 0-based number) or an inclusive
+        (first, last) range of books, e.g. (2, 4) for books 3 to 5.
+        :param chapters: an inclusive (first, last) range of chapter numbers as printed in the headings, only
+        with a single book; see CorpusStore.chapter_bounds. In a book whose chapters are unavailable (no
+        headings were found, see chapters_available) the selection is empty, so queries return no partners.
+        :return: the (first, end) range of segments.
+        '''
+        if books is None or isinstance(books, (tuple, list)):
+            if chapters is not None:
+                raise ValueError("chapters can only be given with a single book")
+            first, last = (0, len(self.books) - 1) if books is None else (self._book_number(b) for b in books)
+            start, end = self.book_sentences[first][0], self.book_sentences[last][1]
+        else:
+            book = self._book_number(books)
+            start, end = self.book_sentences[book]
+            if chapters is not None:
+                book_chapters = self.book_chapters[book]
+                if not book_chapters:
+                    first = int(np.searchsorted(self.segment_starts, start))
+                    return first, first
+                numbers = [number for number, _ in book_chapters]
+                bounds = [sentence for _, sentence in book_chapters] + [end]
+                start = bounds[bisect.bisect_left(numbers, chapters[0])]
+                end = max(start, bounds[bisect.bisect_right(numbers, chapters[1])])
+        first, end = np.searchsorted(self.segment_starts, [start, end])
+        return int(first), int(end)
+
+    def chapters_available(self, book):
+        '''
+        :param book: a book (name or 0-based number).
+        :return: whether chapter headings were found in the book, i.e. whether chapter selections are meaningful.
+        '''
+        return bool(self.book_chapters[self._book_number(book)])
+
+    def _book_number(self, book):
+        return self.books.index(book) if isinstance(book, str) else book
+
+    def _entity(self, name):
+        try:
+            return self.entity_index[name.lower()]
+        except KeyError:
+            raise KeyError(f"'{name}' is not in the index") from None
+
+    def _range_row(self, i, first, end):
+        row = (self._prefix(end, i) - self._prefix(first, i)).tocoo()
+        order = np.lexsort((row.col, -row.data))
+        return tuple((self.entities[row.col[j]], int(row.data[j])) for j in order if row.data[j] > 0)
+
+    def mention_sentences(self, name, books=None, chapters=None):
+        '''
+        :param name: the character or place.
+        :param books: the books, as in chapter_range.
+        :param chapters: the chapters, as in chapter_range.
+        :return: the sorted corpus numbers of the sentences mentioning name (see CorpusStore.sentence).
+        '''
+        j = self._entity(name)
+        first, end = self.chapter_range(books, chapters)
+        sentences = self.mentions_index.indices[self.mentions_index.indptr[j]:self.mentions_index.indptr[j + 1]]
+        lo, hi = np.searchsorted(sentences, [self.segment_starts[first], self.segment_starts[end]])
+        return sentences[lo:hi]
+
+    def mentions(self, name, books=None, chapters=None):
+        '''
+        :return: the number of sentences mentioning name in the selection (see mention_sentences).
+        '''
+        return len(self.mention_sentences(name, books, chapters))
+
+    def neighbours(self, name, books=None, chapters=None, kind=None):
+        '''
+        Function to return everything that co-occurs with a character or place.
+        :param name: the character or place.
+        :param books: the books, as in chapter_range.
+        :param chapters: the chapters, as in chapter_range.
+        :param kind: 'character' or 'place' to keep only one kind of partner.
+        :return: dictionary {partner: number of sentences shared with name}, by decreasing weight.
+        '''
+        partners = self._row(self._entity(name), *self.chapter_range(books, chapters))
+        return {p: w for p, w in partners if kind is None or self.kinds[self.entity_index[p]] == kind}
+
+    def top_partners(self, name, k=10, books=None, chapters=None, kind=None):
+        '''
+        :return: the k strongest (partner, weight) pairs of name in the selection (see neighbours).
+        '''
+        return list(self.neighbours(name, books, chapters, kind).items())[:k]
+
+    def weight(self, name, other, books=None, chapters=None):
+        '''
+        :return: the number of sentences of the selection mentioning both name and other.
+        '''
+        first, end = self.chapter_range(books, chapters)
+        i, j = self._entity(name), self._entity(other)
+        return int(self._prefix(end, i)[0, j] - self._prefix(first, i)[0, j])
+
+    def matrix(self, books=None, chapters=None):
+        '''
+        :return: the symmetric co-occurrence matrix of the selection as a scipy CSR matrix, indexed like
+        self.entities.
+        '''
+        first, end = self.chapter_range(books, chapters)
+        return self._prefix(end) - self._prefix(first)
+
+    def cache_info(self):
+        return self._row.cache_info()
+
+    def clear_cache(self):
+        self._row.cache_clear()
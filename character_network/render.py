@@ -0,0 +1,178 @@
+# -*- coding: utf-8 -*-
+"""
+Batched rendering of the graph images.
+
+render_runs takes runs persisted with artefacts.save_run (e.g. by checkpoint.run_corpus) and renders the
+co-occurrence and sentiment graphs of every run, plus the character-place graphs of runs that hold
+places, in a process pool using the headless Agg backend. Every graph can be written as PNG, SVG and PDF
+with a downscaled PNG thumbnail. A manifest in the output folder records the hash of the data and style of
+every graph, so graphs whose matrix, names and style are unchanged are not drawn again.
+
+    python render.py output/runs output --formats png svg --thumbnail 256 --workers 4
+"""
+import argparse
+import hashlib
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+
+import artefacts
+
+MODES = ('co-occurrence', 'sentiment')
+FORMATS = ('png', 'svg', 'pdf')
+# bump when draw_graph or draw_graph_v2 change, so every graph is rendered again
+STYLE_VERSION = 1
+# the figures of draw_graph are 20 inches wide
+FIGURE_INCHES = 20
+MANIFEST = 'render_manifest.json'
+
+
+def _init_worker():
+    import matplotlib
+    matplotlib.use('Agg')
+
+
+def _graph_data(run, kind, mode):
+    # the names, frequencies and matrix of one graph of a run
+    name_list = list(run['name_list'])
+    name_frequency = [int(x) for x in run['name_frequency']]
+    names = run.get('names', len(name_list))
+    key = 'cooccurrence_matrix' if mode == 'co-occurrence' else 'sentiment_matrix'
+    matrix = run[key]
+    if kind == 'characters':
+        return name_list[:names], name_frequency[:names], [], [], np.asarray(matrix[:names, :names])
+    return name_list[:names], name_frequency[:names], name_list[names:], name_frequency[names:], np.asarray(matrix)
+
+
+def graph_hash(name_list, name_frequency, place_list, place_frequency, matrix, kind, mode, dpi, thumbnail):
+    '''
+    :return: the hex digest identifying the data and style of a graph.
+    '''
+    h = hashlib.blake2b(digest_size=16)
+    h.update(json.dumps([STYLE_VERSION, kind, mode, dpi, thumbnail, name_list, name_frequency, place_list,
+                         place_frequency, str(matrix.dtype), list(matrix.shape)]).encode('utf-8'))
+    h.update(np.ascontiguousarray(matrix).tobytes())
+    return h.hexdigest()
+
+
+def render_graph(job):
+    '''
+    Function to draw one graph and write it in every requested format, in a worker process.
+    :param job: dictionary with the run path, the kind ('characters' or 'places'), the mode, the output
+    stem, the formats, the dpi and the thumbnail width in pixels (0 for none).
+    :return: the list of files written.
+    '''
+    import matplotlib.pyplot as plt
+    from character_network_iterative import draw_graph, draw_graph_v2
+
+    run = artefacts.load_run(job['run_path'])
+    name_list, name_frequency, place_list, place_frequency, matrix = _graph_data(run, job['kind'], job['mode'])
+    if job['kind'] == 'characters':
+        figure = draw_graph(name_list, name_frequency, matrix, job['mode'])
+    else:
+        figure = draw_graph_v2(name_list, name_frequency, place_list, place_frequency, matrix, job['mode'])
+    files = []
+    try:
+        for file_format in job['formats']:
+            files.append(f"{job['stem']}.{file_format}")
+            figure.savefig(files[-1], format=file_format, dpi=job['dpi'])
+        if job['thumbnail']:
+            files.append(f"{job['stem']}.thumbnail.png")
+            figure.savefig(files[-1], format='png', dpi=job['thumbnail'] / FIGURE_INCHES)
+    finally:
+        plt.close(figure)
+    return files
+
+
+def _jobs(runs, output_dir, modes, formats, dpi, thumbnail):
+    for run_name, run in runs.items():
+        kinds = ['characters'] + (['places'] if run.get('places') else [])
+        for kind in kinds:
+            for mode in modes:
+                suffix = 'place ' if kind == 'places' else ''
+                stem = os.path.join(output_dir, f"{run_name} {suffix}{mode} graph")
+                data = _graph_data(run, kind, mode)
+                yield {'run_path': run['path'], 'kind': kind, 'mode': mode, 'stem': stem, 'formats': list(formats),
+                       'dpi': dpi, 'thumbnail': thumbnail, 'hash': graph_hash(*data, kind, mode, dpi, thumbnail)}
+
+
+def render_runs(run_dir, output_dir, modes=MODES, formats=('png',), dpi=100, thumbnail=0, workers=None,
+                force=False):
+    '''
+    Function to render the graphs of every run saved under run_dir.
+    :param run_dir: the folder holding one run per sub-folder, see artefacts.load_runs.
+    :param output_dir: the folder of the images (created if missing).
+    :param modes: the modes to render, 'co-occurrence' and/or 'sentiment'.
+    :param formats: the formats of the images, among FORMATS.
+    :param dpi: the resolution of the raster images.
+    :param thumbnail: the width in pixels of the PNG thumbnails, 0 for none.
+    :param workers: the number of rendering processes, the number of CPUs by default.
+    :param force: whether graphs are rendered even when unchanged.
+    :return: dictionary with the lists of the graphs rendered and skipped. If a graph fails, the others are
+    still rendered and recorded in the manifest, then the first error is raised.
+    '''
+    for file_format in formats:
+        if file_format not in FORMATS:
+            raise ValueError(f"format should be one of {FORMATS}")
+    os.makedirs(output_dir, exist_ok=True)
+    runs = artefacts.load_runs(run_dir)
+    for run_name, run in runs.items():
+        run['path'] = os.path.join(run_dir, run_name)
+    manifest_path = os.path.join(output_dir, MANIFEST)
+    manifest = {}
+    if os.path.exists(manifest_path):
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+
+    todo, skipped = [], []
+    for job in _jobs(runs, output_dir, modes, formats, dpi, thumbnail):
+        name = os.path.basename(job['stem'])
+        outputs = [f"{job['stem']}.{x}" for x in formats] + ([f"{job['stem']}.thumbnail.png"] if thumbnail else [])
+        if not force and manifest.get(name) == job['hash'] and all(os.path.exists(x) for x in outputs):
+            skipped.append(name)
+        else:
+            todo.append(job)
+
+    rendered, error = [], None
+    if todo:
+        try:
+            with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as executor:
+                futures = {executor.submit(render_graph, job): job for job in todo}
+                for future in as_completed(futures):
+                    job = futures[future]
+                    try:
+                        future.result()
+                    except Exception as e:
+                        # the other graphs are still rendered and recorded; the first error is raised at the end
+                        error = error or e
+                        continue
+                    manifest[os.path.basename(job['stem'])] = job['hash']
+                    rendered.append(os.path.basename(job['stem']))
+        finally:
+            # written even when rendering fails or is interrupted, so finished graphs are not rendered again
+            tmp_path = manifest_path + '.tmp'
+            with open(tmp_path, 'w') as f:
+                json.dump(manifest, f, indent=2, sort_keys=True)
+            os.replace(tmp_path, manifest_path)
+    if error is not None:
+        raise error
+    return {'rendered': rendered, 'skipped': skipped}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Render the graphs of persisted runs.')
+    parser.add_argument('run_dir')
+    parser.add_argument('output_dir', nargs='?', default='output')
+    parser.add_argument('--modes', nargs='*', default=list(MODES), choices=MODES)
+    parser.add_argument('--formats', nargs='*', default=['png'], choices=FORMATS)
+    parser.add_argument('--dpi', type=int, default=100)
+    parser.add_argument('--thumbnail', type=int, default=0, help='thumbnail width in pixels, 0 for none')
+    parser.add_argument('--workers', type=int)
+    parser.add_argument('--force', action='store_true')
+    args = parser.parse_args()
+
+    result = render_runs(args.run_dir, args.output_dir, args.modes, args.formats, args.dpi, args.thumbnail,
+                         args.workers, args.force)
+    print(f"rendered {len(result['rendered'])} graphs, skipped {len(result['skipped'])} unchanged")
@@ -0,0 +1,215 @@
+# -*- coding: utf-8 -*-
+"""
+Sentence segmentation of the novels.
+
+nltk.sent_tokenize looks the Punkt model up on every call and runs its boundary detection in pure
+Python over the whole novel. Segmenter loads the Punkt parameters once (or trains them on a corpus and
+persists them), offers a faster regex mode with an abbreviation table for the novel texts, cuts large
+books into chunks at safe boundaries and segments them in a process pool. It returns the (start, end)
+character offsets of the sentences, so later stages can slice the text lazily.
+
+    segmenter = Segmenter(mode='regex', workers=4)
+    spans = segmenter.spans(novel)
+    sentence_list = segmenter.sentences(novel)
+"""
+import pickle
+import re
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+
+import numpy as np
+
+# lowercase abbreviations (without the final period) that do not end a sentence in the novels
+ABBREVIATIONS = frozenset(['mr', 'mrs', 'ms', 'dr', 'st', 'prof', 'sr', 'jr', 'mt', 'vs', 'etc', 'e.g', 'i.e',
+                           'no', 'gen', 'col', 'lt', 'capt', 'cmdr', 'sgt', 'adm', 'gov', 'sen', 'rep', 'rev',
+                           'u.s', 'u.k', 'a.m', 'p.m', 'jan', 'feb', 'mar', 'apr', 'jun', 'jul', 'aug', 'sep',
+                           'sept', 'oct', 'nov', 'dec', 'inc', 'ltd', 'co', 'corp'])
+
+# a run of terminal punctuation and closing quotes/brackets, followed by whitespace and the start of the
+# next sentence (an optional opening quote or bracket, then a capital letter or a digit)
+_boundary = re.compile(r'''[.!?]+['"’”)\]]*(?=\s+['"‘“(\[]*[A-Z0-9])''')
+_last_word = re.compile(r'''([\w.\-]+)$''')
+_whitespace = re.compile(r'\s+')
+
+
+@lru_cache(maxsize=None)
+def load_punkt(language='english'):
+    '''
+    Function to load the pretrained Punkt model of NLTK, once per process.
+    :param language: the language of the model.
+    :return: the PunktSentenceTokenizer.
+    '''
+    try:
+        from nltk.tokenize.punkt import PunktTokenizer
+        return PunktTokenizer(language)
+    except (ImportError, LookupError):
+        import nltk
+        return nltk.data.load(f'tokenizers/punkt/{language}.pickle')
+
+
+def train_punkt(texts, abbreviations=ABBREVIATIONS):
+    '''
+    Function to train the Punkt parameters on a corpus, e.g. the seven books.
+    :param texts: an iterable of texts.
+    :param abbreviations: abbreviations added to the ones learnt from the texts.
+    :return: the trained PunktSentenceTokenizer.
+    '''
+    from nltk.tokenize.punkt import PunktSentenceTokenizer, PunktTrainer
+
+    trainer = PunktTrainer()
+    for text in texts:
+        trainer.train(text, finalize=False)
+    trainer.finalize_training()
+    params = trainer.get_params()
+    params.abbrev_types.update(abbreviations)
+    return PunktSentenceTokenizer(params)
+
+
+def save_punkt(tokenizer, path):
+    '''
+    :param tokenizer: a PunktSentenceTokenizer, e.g. from train_punkt.
+    :param path: the file to write its parameters to.
+    '''
+    with open(path, 'wb') as f:
+        pickle.dump(tokenizer._params, f)
+
+
+@lru_cache(maxsize=None)
+def load_punkt_file(path):
+    '''
+    Function to load Punkt parameters written by save_punkt, once per process.
+    :param path: the parameter file.
+    :return: the PunktSentenceTokenizer.
+    '''
+    from nltk.tokenize.punkt import PunktSentenceTokenizer
+
+    with open(path, 'rb') as f:
+        return PunktSentenceTokenizer(pickle.load(f))
+
+
+def _ends_sentence(text, m, start, abbreviations):
+    if m.group() != '.':
+        return True
+    word = _last_word.search(text, max(start, m.start() - 64), m.start())
+    if word is None:
+        return True
+    word = word.group(1).lower()
+    # 'Mr.', 'Prof.', 'U.S.' or an initial such as 'J.'
+    return word not in abbreviations and not (len(word) == 1 and word.isalpha())
+
+
+def regex_spans(text, abbreviations=ABBREVIATIONS):
+    '''
+    Function to segment a text with the boundary regex: a sentence ends at terminal punctuation followed by
+    whitespace and a capitalised word, unless the word before the period is an abbreviation or an initial.
+    :param text: the text to segment.
+    :param abbreviations: the lowercase abbreviations, without their final period.
+    :return: the list of (start, end) character offsets of the sentences, without surrounding whitespace.
+    '''
+    spans, start = [], 0
+    for m in _boundary.finditer(text):
+        if not _ends_sentence(text, m, start, abbreviations):
+            continue
+        spans.append((start, m.end()))
+        start = _whitespace.match(text, m.end()).end()
+    if text[start:].strip():
+        spans.append((start, len(text.rstrip())))
+    return spans
+
+
+def _punkt_spans(text, params_path=None, language='english'):
+    tokenizer = load_punkt_file(params_path) if params_path else load_punkt(language)
+    return list(tokenizer.span_tokenize(text))
+
+
+def _segment_chunk(mode, params_path, language, abbreviations, text, offset):
+    if mode == 'regex':
+        spans = regex_spans(text, abbreviations)
+    else:
+        spans = _punkt_spans(text, params_path, language)
+    return [(start + offset, end + offset) for start, end in spans]
+
+
+class Segmenter(object):
+    '''
+    Callable sentence segmenter returning sentence offsets; it can be passed as the segmenter of
+    corpus_store.pack_corpus.
+    :param mode: 'punkt' (the NLTK model, as sent_tokenize) or 'regex' (the abbreviation-table regex).
+    :param params_path: optional Punkt parameters written by save_punkt, used instead of the pretrained
+    model in 'punkt' mode.
+    :param language: the language of the pretrained Punkt model.
+    :param abbreviations: the abbreviation table of 'regex' mode.
+    :param workers: the number of processes used on texts longer than chunk_size; 1 segments in process.
+    :param chunk_size: the approximate size in characters of the chunks segmented in parallel.
+    '''
+
+    def __init__(self, mode='punkt', params_path=None, language='english', abbreviations=ABBREVIATIONS,
+                 workers=1, chunk_size=200000):
+        if mode not in ('punkt', 'regex'):
+            raise ValueError("mode should be either 'punkt' or 'regex'")
+        self.mode = mode
+        self.params_path = params_path
+        self.language = language
+        self.abbreviations = frozenset(abbreviations)
+        self.workers = workers
+        self.chunk_size = chunk_size
+
+    def config(self):
+        '''
+        :return: the settings the sentences depend on, as a JSON-serialisable dictionary (for cache keys).
+        '''
+        config = {'mode': self.mode, 'params_path': self.params_path, 'language': self.language}
+        if self.mode == 'regex':
+            config['abbreviations'] = sorted(self.abbreviations)
+        if self.workers > 1:
+            # the texts are then segmented in chunks
+            config['chunk_size'] = self.chunk_size
+        return config
+
+    def _chunk_starts(self, text):
+        # chunks are cut after a regex sentence boundary, so no sentence straddles two chunks
+        starts, position = [0], self.chunk_size
+        while position < len(text):
+            m = _boundary.search(text, position)
+            while m is not None and not _ends_sentence(text, m, position, self.abbreviations):
+                m = _boundary.search(text, m.end())
+            if m is None:
+                break
+            starts.append(_whitespace.match(text, m.end()).end())
+            position = starts[-1] + self.chunk_size
+        return starts
+
+    def spans(self, text):
+        '''
+        :param text: the text to segment (e.g. a novel after read_text).
+        :return: int64 array of shape (n_sentences, 2) with the [start, end) offsets of the sentences.
+        '''
+        args = (self.mode, self.params_path, self.language, self.abbreviations)
+        if self.workers == 1 or len(text) <= self.chunk_size:
+            spans = _segment_chunk(*args, text, 0)
+        else:
+            starts = self._chunk_starts(text)
+            chunks = [text[a:b] for a, b in zip(starts, starts[1:] + [len(text)])]
+            with ProcessPoolExecutor(max_workers=self.workers) as executor:
+                parts = executor.map(_segment_chunk, *zip(*[args + (chunk, start)
+                                                             for chunk, start in zip(chunks, starts)]))
+                spans = [span for part in parts for span in part]
+        return np.array(spans, dtype=np.int64).reshape(-1, 2)
+
+    def __call__(self, text):
+        return self.spans(text)
+
+    def sentences(self, text):
+        '''
+        :param text: the text to segment.
+        :return: the list of sentences, as sent_tokenize returns it.
+        '''
+        return [text[start:end] for start, end in self.spans(text)]
+
+
+@lru_cache(maxsize=None)
+def default_segmenter():
+    '''
+    :return: the shared Punkt Segmenter, equivalent to sent_tokenize.
+    '''
+    return Segmenter()
@@ -0,0 +1,193 @@
+# -*- coding: utf-8 -*-
+"""
+Pluggable batch sentiment scorers.
+
+A scorer takes a batch of sentences and returns their scores as a float32 array. AfinnScorer tokenises a
+whole batch at once, looks every word up in the lexicon and sums the values per sentence with
+np.bincount; the few multi-word entries ('no fun', "can't stand", 'self-confident') are matched by a
+separate small regex first, so the scores are those of Afinn().score. VaderScorer returns the compound
+score of NLTK's VADER. Every scorer memoises its results by a hash of the sentence, since dialogue such as
+"Yes." or "What?" repeats heavily across the books, and scores the sentences it has not seen in a thread
+or process pool when asked to; the lookup holds the GIL, so only a process pool runs batches in parallel,
+which pays off once the batches outweigh pickling them.
+
+    scorer = AfinnScorer()
+    scores = scorer(sentence_list, workers=4, processes=True)
+    cooccurrence_matrix, sentiment_matrix = calculate_matrix(name_list, sentence_list, align_rate, scorer=scorer,
+                                                             workers=4, processes=True)
+"""
+import hashlib
+import itertools
+import re
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import lru_cache
+
+import numpy as np
+
+_whitespace = re.compile(r'\s+')
+_word = re.compile(r'\w+')
+# joins the sentences of a batch; it is not a word character, so no lexicon entry matches across it
+_separator = '\x00'
+
+
+def _key(sentence):
+    return hashlib.blake2b(sentence.encode('utf-8', 'surrogatepass'), digest_size=16).digest()
+
+
+def _score_batch(scorer, sentences):
+    return scorer.score_batch(sentences)
+
+
+class SentimentScorer(object):
+    '''
+    Base class of the scorers: subclasses implement score_batch, and calling the scorer adds memoisation
+    and the pool.
+    :param cache_size: the number of sentence scores kept, least recently used first out.
+    '''
+
+    def __init__(self, cache_size=2 ** 20):
+        self.cache_size = cache_size
+        self._memo = OrderedDict()
+        self.hits = self.misses = 0
+
+    def __getstate__(self):
+        # the memo stays in the parent process
+        state = dict(self.__dict__)
+        state['_memo'] = OrderedDict()
+        return state
+
+    def score_batch(self, sentences):
+        '''
+        :param sentences: a list of sentences.
+        :return: the float32 array of their scores.
+        '''
+        raise NotImplementedError
+
+    def config(self):
+        '''
+        :return: the settings the scores depend on, as a JSON-serialisable dictionary (for cache keys).
+        '''
+        return {'scorer': type(self).__name__}
+
+    def __call__(self, sentence_list, workers=1, processes=False, batch_size=5000):
+        '''
+        Function to score sentences, scoring each distinct unseen sentence once.
+        :param sentence_list: the sentences.
+        :param workers: the number of threads or processes scoring the unseen sentences.
+        :param processes: whether a process pool is used instead of a thread pool.
+        :param batch_size: the number of sentences per batch.
+        :return: the float32 array of the scores, one per sentence.
+        '''
+        keys = [_key(x) for x in sentence_list]
+        scores = np.empty(len(keys), dtype=np.float32)
+        unseen = OrderedDict()
+        for i, key in enumerate(keys):
+            if key in self._memo:
+                self._memo.move_to_end(key)
+                scores[i] = self._memo[key]
+                self.hits += 1
+            elif key in unseen:
+                self.hits += 1
+            else:
+                unseen[key] = sentence_list[i]
+        self.misses += len(unseen)
+
+        sentences = list(unseen.values())
+        batches = [sentences[i:i + batch_size] for i in range(0, len(sentences), batch_size)]
+        if workers > 1 and len(batches) > 1:
+            pool = ProcessPoolExecutor if processes else ThreadPoolExecutor
+            with pool(max_workers=workers) as executor:
+                results = list(executor.map(_score_batch, [self] * len(batches), batches))
+        else:
+            results = [self.score_batch(batch) for batch in batches]
+        new = dict(zip(unseen, np.concatenate(results) if results else []))
+
+        for i, key in enumerate(keys):
+            if key in new:
+                scores[i] = new[key]
+        self._memo.update(new)
+        while len(self._memo) > self.cache_size:
+            self._memo.popitem(last=False)
+        return scores
+
+    def stats(self):
+        '''
+        :return: dictionary with the memo hits, misses, size and hit rate.
+        '''
+        calls = self.hits + self.misses
+        return {'hits': self.hits, 'misses': self.misses, 'size': len(self._memo),
+                'hit_rate': self.hits / calls if calls else 0.0}
+
+    def clear(self):
+        self._memo.clear()
+        self.hits = self.misses = 0
+
+
+class AfinnScorer(SentimentScorer):
+    '''
+    The Afinn score of calculate_matrix (Afinn().score), computed for a whole batch at once.
+    :param language: the language of the Afinn lexicon.
+    :param cache_size: see SentimentScorer.
+    '''
+
+    def __init__(self, language='en', cache_size=2 ** 20):
+        from afinn import Afinn
+
+        super(AfinnScorer, self).__init__(cache_size)
+        self.language = language
+        self._lexicon = Afinn(language=language)._dict
+        # Afinn's regex tries the entries longest first and every entry starts and ends with a word character,
+        # so an entry of several words always wins over the single word it starts with
+        phrases = sorted((x for x in self._lexicon if not _word.fullmatch(x)), key=lambda x: (-len(x), x))
+        self._phrases = re.compile(r'\b(?:%s)\b' % '|'.join(map(re.escape, phrases))) if phrases else None
+
+    def config(self):
+        return dict(super(AfinnScorer, self).config(), language=self.language)
+
+    def score_batch(self, sentences):
+        scores = np.zeros(len(sentences), dtype=np.float32)
+        if not sentences:
+            return scores
+        # the same whitespace folding and lowercasing as Afinn.find_all, on the whole batch
+        text = _whitespace.sub(' ', _separator.join(x.replace(_separator, ' ') for x in sentences)).lower()
+        if self._phrases is not None:
+            # multi-word entries are scored first and blanked out, so their words are not counted again
+            ends = np.array([m.start() for m in re.finditer(_separator, text)] + [len(text)], dtype=np.int64)
+            matches = list(self._phrases.finditer(text))
+            if matches:
+                np.add.at(scores, np.searchsorted(ends, [m.start() for m in matches]),
+                          np.array([self._lexicon[m.group()] for m in matches], dtype=np.float32))
+                text = self._phrases.sub(' ', text)
+        words = [_word.findall(x) for x in text.split(_separator)]
+        counts = np.fromiter(map(len, words), dtype=np.int64, count=len(words))
+        flat = list(itertools.chain.from_iterable(words))
+        values = np.fromiter(map(self._lexicon.get, flat, itertools.repeat(0)), dtype=np.float64, count=len(flat))
+        scores += np.bincount(np.repeat(np.arange(len(words)), counts), weights=values,
+                              minlength=len(words)).astype(np.float32)
+        return scores
+
+
+class VaderScorer(SentimentScorer):
+    '''
+    The compound score (between -1 and 1) of NLTK's VADER; needs nltk.download('vader_lexicon').
+    :param cache_size: see SentimentScorer.
+    '''
+
+    def __init__(self, cache_size=2 ** 20):
+        super(VaderScorer, self).__init__(cache_size)
+        self._analyzer = None
+
+    def score_batch(self, sentences):
+        if self._analyzer is None:
+            from nltk.sentiment.vader import SentimentIntensityAnalyzer
+            self._analyzer = SentimentIntensityAnalyzer()
+        return np.array([self._analyzer.polarity_scores(x)['compound'] for x in sentences], dtype=np.float32)
+
+
+@lru_cache(maxsize=None)
+def default_scorer():
+    '''
+    :return: the shared AfinnScorer, whose memo is reused across books.
+    '''
+    return AfinnScorer()
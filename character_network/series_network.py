@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+"""
+Series-level character network.
+
+The notebooks compute calculate_matrix separately for every book with book 1's name list. The
+SeriesAggregator keeps one global character vocabulary instead, and adds each book's sparse co-occurrence
+and sentiment contributions to running totals, so adding a book costs O(book) and never recomputes the
+books already seen.
+"""
+import numpy as np
+import scipy.sparse as sp
+
+from character_network_iterative import occurrence_matrix, sentiment_scores
+import artefacts
+
+
+class SeriesAggregator(object):
+    '''
+    Running co-occurrence and sentiment totals over the books of a series.
+    '''
+
+    def __init__(self):
+        self.name_list = []
+        self.name_index = {}
+        self.name_frequency = []
+        self.books = []
+        # per-book sparse contributions as (rows, cols, values) in global indices, summed lazily by _compact
+        self._cooccurrence_parts, self._sentiment_parts = [], []
+
+    def _global_index(self, name_list):
+        for name in name_list:
+            if name not in self.name_index:
+                self.name_index[name] = len(self.name_list)
+                self.name_list.append(name)
+                self.name_frequency.append(0)
+        return np.array([self.name_index[name] for name in name_list], dtype=np.int64)
+
+    def add_book(self, book_name, name_list, sentence_list, align_rate, name_frequency=None, sentiment_score=None):
+        '''
+        Function to add one book to the series totals.
+        :param book_name: the name of the book.
+        :param name_list: the names to count in this book (new names extend the global vocabulary).
+        :param sentence_list: the list of sentences of the book.
+        :param align_rate: the align rate of the book (see calculate_align_rate).
+        :param name_frequency: the frequencies of name_list in the book, as returned by top_names.
+        :param sentiment_score: the sentiment score of each sentence, computed if not given.
+        '''
+        if sentiment_score is None:
+            sentiment_score = sentiment_scores(sentence_list)
+        occurrence = occurrence_matrix(name_list, sentence_list).tocsc().astype(np.float64)
+        cooccurrence = (occurrence.T @ occurrence).tocoo()
+        sentiment = (occurrence.T @ sp.diags(np.asarray(sentiment_score, dtype=np.float64)) @ occurrence).tocoo()
+
+        index = self._global_index(name_list)
+        self._cooccurrence_parts.append(_off_diagonal(index, cooccurrence.row, cooccurrence.col, cooccurrence.data))
+        self._sentiment_parts.append(_off_diagonal(index, sentiment.row, sentiment.col, sentiment.data))
+        # every co-occurrence shifts the sentiment by one unit of align_rate
+        self._sentiment_parts.append(_off_diagonal(index, cooccurrence.row, cooccurrence.col,
+                                                   align_rate * cooccurrence.data))
+        if name_frequency is not None:
+            for i, frequency in zip(index, name_frequency):
+                self.name_frequency[i] += frequency
+        self.books.append(book_name)
+
+    def _compact(self):
+        n = len(self.name_list)
+        cooccurrence = _sum_parts(self._cooccurrence_parts, n)
+        sentiment = _sum_parts(self._sentiment_parts, n)
+        # keep a single summed part so later reads only add the books added since
+        self._cooccurrence_parts = [_to_part(cooccurrence)]
+        self._sentiment_parts = [_to_part(sentiment)]
+        return cooccurrence, sentiment
+
+    def sparse_matrices(self):
+        '''
+        :return: the symmetric series co-occurrence and sentiment matrices as scipy CSR matrices,
+        indexed like self.name_list.
+        '''
+        return self._compact()
+
+    def matrices(self, name_list=None):
+        '''
+        Function to return the series matrices in the layout of calculate_matrix (dense, lower triangle,
+        zero diagonal), so they can be passed to plot_graph.
+        :param name_list: the names to keep, in the wanted order; all names seen so far if None.
+        :return: the co-occurrence matrix and sentiment matrix.
+        '''
+        cooccurrence, sentiment = self._compact()
+        if name_list is not None:
+            index = [self.name_index[name] for name in name_list]
+            cooccurrence, sentiment = cooccurrence[index][:, index], sentiment[index][:, index]
+        return np.tril(cooccurrence.toarray(), -1), np.tril(sentiment.toarray(), -1)
+
+    def top_names(self, top_num=20):
+        '''
+        :param top_num: the number of names to return.
+        :return: the list of top names' series frequency and the list of top names, like top_names.
+        '''
+        order = np.argsort(self.name_frequency, kind='stable')[::-1][:top_num]
+        return [self.name_frequency[i] for i in order], [self.name_list[i] for i in order]
+
+    def save(self, path, align_rate=0.0):
+        '''
+        Function to persist the series totals with artefacts.save_run.
+        :param path: the folder to write to.
+        :param align_rate: the align rate recorded with the run (the per-book rates are already applied).
+        '''
+        cooccurrence, sentiment = self.matrices()
+        return artefacts.save_run(path, self.name_list, self.name_frequency, cooccurrence, sentiment, align_rate,
+                                  books=self.books)
+
+
+def _off_diagonal(index, rows, cols, values):
+    rows, cols = index[rows], index[cols]
+    keep = rows != cols
+    return rows[keep], cols[keep], values[keep]
+
+
+def _sum_parts(parts, n):
+    if not parts:
+        return sp.csr_matrix((n, n))
+    rows, cols, values = (np.concatenate(x) for x in zip(*parts))
+    matrix = sp.csr_matrix((values, (rows, cols)), shape=(n, n))
+    matrix.sum_duplicates()
+    return matrix
+
+
+def _to_part(matrix):
+    coo = matrix.tocoo()
+    return coo.row.astype(np.int64), coo.col.astype(np.int64), coo.data
@@ -0,0 +1,215 @@
+# -*- coding: utf-8 -*-
+"""
+Local HTTP service exposing the character network pipeline.
+
+    python service.py --port 8080 --workers 2 --model en_core_web_sm
+
+POST /analyse?top_num=20&threshold_rate=0.0005 with the novel as UTF-8 body returns the top names and the
+co-occurrence and sentiment edge lists as JSON. GET /metrics returns request counts and latencies.
+The CPU-bound stages run in a process pool (each worker loads the spaCy model once), concurrent requests
+for the same text share one computation, and requests beyond the pending limit are rejected with 503.
+The service only needs asyncio from the standard library; AnalysisService.handle can be called
+directly to exercise it without sockets.
+"""
+import argparse
+import asyncio
+import collections
+import hashlib
+import json
+import math
+import time
+from concurrent.futures import ProcessPoolExecutor
+from urllib.parse import parse_qs, urlsplit
+
+_nlp_func = None
+
+
+def _init_worker(model):
+    global _nlp_func
+    import spacy
+    _nlp_func = spacy.load(model)
+
+
+def analyse_text(text, top_num=20, threshold_rate=0.0005):
+    '''
+    Function to run the pipeline of the notebooks on one text, in a worker process.
+    :param text: the raw text of the novel.
+    :param top_num: the number of top names to keep.
+    :param threshold_rate: the per sentence frequency threshold of iterative_NER.
+    :return: a JSON-serialisable dictionary with the names, their frequency, the align rate and edge lists.
+    '''
+    from character_network_iterative import (clean_text, calculate_align_rate, iterative_NER_v2, top_names,
+                                             calculate_matrix, matrix_to_edge_list)
+    from segmenter import default_segmenter
+
+    novel = clean_text(text)
+    sentence_list = default_segmenter().sentences(novel)
+    align_rate = calculate_align_rate(sentence_list)
+    preliminary_name_list = iterative_NER_v2(_nlp_func, sentence_list, threshold_rate)
+    name_frequency, name_list = top_names(preliminary_name_list, novel, top_num)
+    cooccurrence_matrix, sentiment_matrix = calculate_matrix(name_list, sentence_list, align_rate)
+    edges = {}
+    for mode, matrix in [('co-occurrence', cooccurrence_matrix), ('sentiment', sentiment_matrix)]:
+        edges[mode] = [{'source': u, 'target': v, 'weight': float(attr['weight']), 'color': float(attr['color'])}
+                       for u, v, attr in matrix_to_edge_list(matrix, mode, name_list)]
+    return {'names': name_list, 'frequency': [int(x) for x in name_frequency], 'align_rate': float(align_rate),
+            'sentences': len(sentence_list), 'edges': edges}
+
+
+def _finite(value):
+    if isinstance(value, float):
+        return value if math.isfinite(value) else None
+    if isinstance(value, dict):
+        return {k: _finite(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_finite(x) for x in value]
+    return value
+
+
+class AnalysisService(object):
+    '''
+    Request handling, deduplication, backpressure and metrics of the service.
+    :param model: the spaCy model loaded by every worker.
+    :param workers: the number of worker processes.
+    :param max_pending: the number of distinct analyses queued or running before new ones get a 503.
+    :param max_body: the maximal request body size in bytes.
+    '''
+
+    def __init__(self, model='en_core_web_sm', workers=2, max_pending=8, max_body=20 * 2 ** 20):
+        self.executor = ProcessPoolExecutor(workers, initializer=_init_worker, initargs=(model,))
+        self.max_pending = max_pending
+        self.max_body = max_body
+        self.in_flight = {}
+        self.counters = collections.Counter()
+        self.latencies = collections.defaultdict(lambda: collections.deque(maxlen=1000))
+
+    async def analyse(self, text, top_num, threshold_rate):
+        key = hashlib.sha256(f"{top_num}\0{threshold_rate}\0".encode('utf-8') + text.encode('utf-8')).hexdigest()
+        future = self.in_flight.get(key)
+        if future is not None:
+            self.counters['deduplicated'] += 1
+        else:
+            if len(self.in_flight) >= self.max_pending:
+                self.counters['rejected'] += 1
+                return 503, {'error': 'too many pending analyses, retry later'}
+            loop = asyncio.get_running_loop()
+            future = loop.run_in_executor(self.executor, analyse_text, text, top_num, threshold_rate)
+            self.in_flight[key] = future
+            future.add_done_callback(lambda _: self.in_flight.pop(key, None))
+        return 200, await asyncio.shield(future)
+
+    def metrics(self):
+        latency = {}
+        for route, values in self.latencies.items():
+            ordered = sorted(values)
+            latency[route] = {q: ordered[min(len(ordered) - 1, int(p * len(ordered)))]
+                              for q, p in [('p50', 0.5), ('p95', 0.95), ('p99', 0.99)]}
+            latency[route]['count'] = len(ordered)
+        return {'counters': dict(self.counters), 'in_flight': len(self.in_flight), 'latency_seconds': latency}
+
+    async def handle(self, method, target, body):
+        '''
+        :param method: the HTTP method.
+        :param target: the request target (path and query string).
+        :param body: the request body as bytes.
+        :return: (status code, JSON-serialisable response)
+        '''
+        url = urlsplit(target)
+        query = {k: v[-1] for k, v in parse_qs(url.query).items()}
+        route = f"{method} {url.path}"
+        start = time.perf_counter()
+        self.counters[route] += 1
+        try:
+            if route == 'POST /analyse':
+                # only the request itself is parsed here, so a ValueError of the analysis is a 500
+                try:
+                    text = body.decode('utf-8')
+                    top_num = int(query.get('top_num', 20))
+                    threshold_rate = float(query.get('threshold_rate', 0.0005))
+                    if top_num < 1:
+                        raise ValueError(f"top_num should be at least 1, not {top_num}")
+                    if not 0 <= threshold_rate < math.inf:
+                        raise ValueError(f"threshold_rate should be a non-negative number, not {threshold_rate}")
+                except (ValueError, UnicodeDecodeError) as e:
+                    status, response = 400, {'error': str(e)}
+                else:
+                    status, response = await self.analyse(text, top_num, threshold_rate)
+            elif route == 'GET /metrics':
+                status, response = 200, self.metrics()
+            elif route == 'GET /health':
+                status, response = 200, {'status': 'ok'}
+            else:
+                status, response = 404, {'error': f"unknown route {route}"}
+        except Exception as e:
+            self.counters['errors'] += 1
+            status, response = 500, {'error': repr(e)}
+        self.latencies[route].append(time.perf_counter() - start)
+        return status, response
+
+    async def serve_connection(self, reader, writer):
+        try:
+            request_line = (await reader.readline()).decode('latin-1').split()
+            if len(request_line) < 2:
+                return
+            headers = {}
+            while True:
+                line = (await reader.readline()).decode('latin-1').strip()
+                if not line:
+                    break
+                name, _, value = line.partition(':')
+                headers[name.strip().lower()] = value.strip()
+            length = headers.get('content-length', '0')
+            if not (length.isascii() and length.isdigit()):
+                status, response = 400, {'error': f"invalid content-length {length!r}"}
+            elif int(length) > self.max_body:
+                status, response = 413, {'error': f"body larger than {self.max_body} bytes"}
+            else:
+                length = int(length)
+                try:
+                    body = await reader.readexactly(length) if length else b''
+                except asyncio.IncompleteReadError as e:
+                    status, response = 400, {'error': f"body truncated after {len(e.partial)} of {length} bytes"}
+                else:
+                    status, response = await self.handle(request_line[0], request_line[1], body)
+            try:
+                payload = json.dumps(response, allow_nan=False).encode('utf-8')
+            except ValueError:
+                # NaN or infinite floats (e.g. the align rate of a text without names) are sent as null
+                payload = json.dumps(_finite(response), allow_nan=False).encode('utf-8')
+            reason = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 413: 'Payload Too Large',
+                      500: 'Internal Server Error', 503: 'Service Unavailable'}[status]
+            head = f"HTTP/1.1 {status} {reason}\r\nContent-Type: application/json\r\n" \
+                   f"Content-Length: {len(payload)}\r\nConnection: close\r\n"
+            if status == 503:
+                head += "Retry-After: 5\r\n"
+            writer.write(head.encode('latin-1') + b"\r\n" + payload)
+            await writer.drain()
+        except ConnectionError:
+            # the client went away before the response was sent
+            self.counters['disconnected'] += 1
+        finally:
+            writer.close()
+
+    def close(self):
+        self.executor.shutdown(cancel_futures=True)
+
+
+async def serve(host='127.0.0.1', port=8080, **kwargs):
+    service = AnalysisService(**kwargs)
+    server = await asyncio.start_server(service.serve_connection, host, port)
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        service.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--max-pending', type=int, default=8)
+    parser.add_argument('--model', default='en_core_web_sm')
+    args = parser.parse_args()
+    asyncio.run(serve(args.host, args.port, model=args.model, workers=args.workers, max_pending=args.max_pending))
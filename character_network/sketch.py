@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+"""
+Count-min sketch used by iterative_NER_bounded to count entity strings in fixed memory.
+"""
+import numpy as np
+
+
+class CountMinSketch(object):
+    '''
+    Approximate counter with a fixed (depth x width) table. Estimates never undercount; with the
+    default size an estimate exceeds the true count by more than 2/width of the total count with a
+    probability of at most 0.5 ** depth.
+    :param width: the number of counters per row.
+    :param depth: the number of rows (independent hash functions).
+    '''
+
+    def __init__(self, width=2 ** 16, depth=4):
+        self.width = width
+        self.depth = depth
+        self.table = np.zeros((depth, width), dtype=np.int32)
+        self.total = 0
+        self._rows = np.arange(depth)
+
+    def _columns(self, item):
+        # double hashing: depth hash functions from two halves of one 64 bit hash
+        h = hash(item) & 0xFFFFFFFFFFFFFFFF
+        h1, h2 = h & 0xFFFFFFFF, (h >> 32) | 1
+        return (h1 + self._rows * h2) % self.width
+
+    def add(self, item, count=1):
+        '''
+        :param item: the item to count.
+        :param count: the number of occurrences to add.
+        :return: the updated estimate of the item's count.
+        '''
+        columns = self._columns(item)
+        self.table[self._rows, columns] += count
+        self.total += count
+        return int(self.table[self._rows, columns].min())
+
+    def estimate(self, item):
+        return int(self.table[self._rows, self._columns(item)].min())
+
+    def __getitem__(self, item):
+        return self.estimate(item)
@@ -2,22 +2,43 @@
 
 # The Natural Language Processing Toolkit (NLTK) is a Python library with a lot
 # of really powerful tools for textual analysis.
-from nltk import pos_tag, word_tokenize, download, chunk, Tree
+from nltk import pos_tag, word_tokenize, download, chunk, data, Tree
 # collections is a Python library with the super-awesome Counter, which takes a
 # list and returns a dictionary that tallies up how many times each value appears.
 # For example, ['red', 'red', 'rose'] would become [('red',  2), ('rose': 1)}.
 from collections import Counter
 # PrettyPrinter will make our final output easier to read in the console.
 import pprint
+import os
+import sys
 
 from nlp_harry_potter import utilities
+# the modules of character_network import each other by their bare names; importing them the same way keeps
+# one instrumentation module, so report() sees the counters of both pipelines
+_character_network = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'character_network')
+if _character_network not in sys.path:
+    sys.path.append(_character_network)
+from instrumentation import instrumented, count
+from name_normaliser import token_normaliser
 
-download('punkt')
-download('averaged_perceptron_tagger')
-download('maxent_ne_chunker')
-download('words')
+# the NLTK data used below, by package name and path in nltk_data
+NLTK_DATA = {'punkt': 'tokenizers/punkt', 'averaged_perceptron_tagger': 'taggers/averaged_perceptron_tagger',
+             'maxent_ne_chunker': 'chunkers/maxent_ne_chunker', 'words': 'corpora/words'}
 
 
+def download_nltk_data():
+    '''
+    This function downloads the NLTK data used by this demo, skipping what is already installed, so it
+    only needs the network the first time (importing this module never downloads anything).
+    '''
+    for package, path in NLTK_DATA.items():
+        try:
+            data.find(path)
+        except LookupError:
+            download(package)
+
+
+@instrumented
 def read_text(book_name):
     '''
     This function reads the text into python from a text file.
@@ -28,6 +49,7 @@ def read_text(book_name):
         book = f.read()
     return book
 
+@instrumented
 def text_tokenize(book):
     '''
     This function splits words and puctuation in the block of text created in
@@ -37,8 +59,10 @@ def text_tokenize(book):
     'with', 'Harry', 'and', 'Hermione', '.']
     '''
     tokenize = word_tokenize(book)
+    count('tokens', len(tokenize))
     return tokenize
 
+@instrumented
 def tagging(tokenize):
     '''
     This function takes the tokenized text created
@@ -56,6 +80,7 @@ def tagging(tokenize):
     return tagged_text
 
 
+@instrumented
 def find_proper_nouns(tagged_text):
     '''
     This function takes in the tagged text from the tagging function and Returns
@@ -100,6 +125,7 @@ def find_proper_nouns(tagged_text):
     return proper_nouns
 
 
+@instrumented
 def summarize_text(proper_nouns, top_num):
     '''
     This function takes the proper_nouns from the list created by the
@@ -129,7 +155,8 @@ def is_dt(curr_tagged_text):
     return curr_tagged_text[1] == 'DT'
 
 
-def find_proper_nouns_v2(tagged_text):
+@instrumented
+def find_proper_nouns_v2(tagged_text, normaliser=None):
     '''
     This function takes in the tagged text from the tagging function and Returns
     a list of words that were tagged as proper nouns.  It does this by looking
@@ -145,43 +172,52 @@ def find_proper_nouns_v2(tagged_text):
     word to the proper_nouns list.
     As we add nouns to the list, we put them all in lower case - otherwise, our
     program won't know that 'HARRY' is the same thing for our purposes as 'Harry'.
+    :param tagged_text: the (word, tag) pairs returned by tagging.
+    :param normaliser: the NameNormaliser applied to each joined name, token_normaliser by default; pass
+    NameNormaliser(strip_possessive=False, honorifics=HONORIFICS) to turn 'Professor Quirrell' into 'quirrell'.
+    :return: a list of [name, tags] pairs.
     '''
+    if normaliser is None:
+        normaliser = token_normaliser
     proper_nouns = []
     i = 0
     while i < len(tagged_text):
         tag = []
         name = ""
         if is_nnp(tagged_text[i]):
-            name += tagged_text[i][0].lower() + " "
+            name += tagged_text[i][0] + " "
             tag.append(tagged_text[i][1])
             j = i + 1
             while j < len(tagged_text):
                 if is_nnp(tagged_text[j]):
-                    name += tagged_text[j][0].lower()
+                    name += tagged_text[j][0]
                     tag.append(tagged_text[j][1])
                     j += 1
                     continue
                 if is_pos(tagged_text[j]) and is_nnp(tagged_text[j+1]):
-                    name = name.strip() + tagged_text[j][0].lower() + " " + tagged_text[j+1][0].lower() + " "
+                    name = name.strip() + tagged_text[j][0] + " " + tagged_text[j+1][0] + " "
                     tag.append(tagged_text[j][1])
                     tag.append(tagged_text[j+1][1])
                     j += 2
                     continue
                 if is_cc(tagged_text[j]) and is_nnp(tagged_text[j+1]):
-                    name += tagged_text[j][0].lower() + " " + tagged_text[j+1][0].lower() + " "
+                    name += tagged_text[j][0] + " " + tagged_text[j+1][0] + " "
                     tag.append(tagged_text[j][1])
                     tag.append(tagged_text[j+1][1])
                     j += 2
                     continue
                 break
+            # the whole span is normalised at once, so rules over several words (honorifics) apply
+            name = normaliser(name.strip())
             if i >= 1 and is_dt(tagged_text[i - 1]):
-                name = tagged_text[i - 1][0].lower() + " " + name + " "
+                name = normaliser(tagged_text[i - 1][0]) + " " + name + " "
                 tag = [tagged_text[j - 1][1]] + tag
 
             if '-' not in name:
                 proper_nouns.append([name.strip(), tag])
             i = j
         i += 1  # increment the i counter
+    count('proper nouns', len(proper_nouns))
     return proper_nouns
 
 # if nnp then can follow by nnp/pos/cc
@@ -193,50 +229,6 @@ def find_proper_nouns_v2(tagged_text):
 # nnp pos nnp
 # nnp cc nnp nnp
 
-# This is where we call all of our functions and pass what they return to the
-# next function
-book1 = "Harry Potter 1 - Sorcerer's Stone.txt"
-book2 = "Harry Potter 2 - Chamber of Secrets.txt"
-book3 = "Harry Potter 3 - The Prisoner Of Azkaban.txt"
-book4 = "Harry Potter 4 - The Goblet Of Fire.txt"
-book5 = "Harry Potter 5 - Order of the Phoenix.txt"
-book6 = "Harry Potter 6 - The Half Blood Prince.txt"
-book7 = "Harry Potter 7 - Deathly Hollows.txt"
-
-path = "/Users/ohad.e/Projects/study/nlp_final/nlp_harry_potter/books/"
-bookx = "Clancy Tom - Patriot Games.txt"
-
-book = read_text(path + bookx)
-b = text_tokenize(book)
-tagged = tagging(b)
-d = find_proper_nouns_v2(tagged)
-e = summarize_text(d, 100)
-
-# top_10 = []
-limit = 20
-for idx, (k,v) in enumerate(sorted(e.items(), key=lambda item: item[1], reverse=True), start=1):
-    if idx == limit + 1:
-        break
-    print(f"{idx}. {k}, {v}")
-    # if len(top_10) < 10:
-    #     top_10.append(k)
-    # else:
-    #     for t in top_10:
-    #         t_split = t.split()
-    #         k_split = k.split()
-    #
-    #         for tt in t_split:
-    #             if
-
-#
-# print(tagged)
-entities = chunk.ne_chunk(tagged)
-# print(type(entities))
-# for k, v in entities.items():
-#     print(k, v)
-# print(entities)
-
-
 ROOT = 'ROOT'
 
 def get_node(parent, tag, res_list):
@@ -258,9 +250,12 @@ def get_node(parent, tag, res_list):
     return res_list
 
 
+@instrumented
 def get_person(parent):
     persons = []
-    return get_node(parent, "PERSON", persons)
+    get_node(parent, "PERSON", persons)
+    count('persons', len(persons))
+    return persons
 
 # didn't work
 # def get_location(parent):
@@ -268,57 +263,94 @@ def get_person(parent):
 #     return get_node(parent, "LOCATION", locations)
 
 
-persons = get_person(entities)
-# locations = get_location(entities)
-
-persons_only = [pn[0] for pn in persons]
-pn_to_tuple = {pn[0]: pn for pn in persons}
-counts = dict(Counter(persons_only))
-res = {k: [v, pn_to_tuple[k][1]] for k, v in sorted(counts.items(), key=lambda item: item[1])}
-print("----------------------------")
-
-for idx, (k,v) in enumerate(sorted(res.items(), key=lambda item: item[1], reverse=True), start=1):
-    if idx == limit + 1:
-        break
-    print(f"{idx}. {k}, {v}")
+if __name__ == '__main__':
+    download_nltk_data()
+    # This is where we call all of our functions and pass what they return to the
+    # next function
+    book1 = "Harry Potter 1 - Sorcerer's Stone.txt"
+    book2 = "Harry Potter 2 - Chamber of Secrets.txt"
+    book3 = "Harry Potter 3 - The Prisoner Of Azkaban.txt"
+    book4 = "Harry Potter 4 - The Goblet Of Fire.txt"
+    book5 = "Harry Potter 5 - Order of the Phoenix.txt"
+    book6 = "Harry Potter 6 - The Half Blood Prince.txt"
+    book7 = "Harry Potter 7 - Deathly Hollows.txt"
+
+    path = "/Users/ohad.e/Projects/study/nlp_final/nlp_harry_potter/books/"
+    bookx = "Clancy Tom - Patriot Games.txt"
+
+    book = read_text(path + bookx)
+    b = text_tokenize(book)
+    tagged = tagging(b)
+    d = find_proper_nouns_v2(tagged)
+    e = summarize_text(d, 100)
+
+    # top_10 = []
+    limit = 20
+    for idx, (k,v) in enumerate(sorted(e.items(), key=lambda item: item[1], reverse=True), start=1):
+        if idx == limit + 1:
+            break
+        print(f"{idx}. {k}, {v}")
+        # if len(top_10) < 10:
+        #     top_10.append(k)
+        # else:
+        #     for t in top_10:
+        #         t_split = t.split()
+        #         k_split = k.split()
+        #
+        #         for tt in t_split:
+        #             if
 
-# locations_only = [ln[0] for ln in locations]
-# ln_to_tuple = {ln[0]: ln for ln in locations}
-# counts_location = dict(Counter(locations_only))
-# res_location = {k: [v, ln_to_tuple[k][1]] for k, v in sorted(counts_location.items(), key=lambda item: item[1])}
-# print("----------------------------")
-#
-# for idx, (k, v) in enumerate(sorted(res_location.items(), key=lambda item: item[1], reverse=True), start=1):
-#     if idx == limit + 1:
-#         break
-#     print(f"{idx}. {k}, {v}")
-#
-import spacy
-cts = utilities.country_list_maker()
-cts.update(utilities.other_vectors())
-skip_list = utilities.make_skip_list(cts)
-
-# Need to run 'python3 -m spacy download en_core_web_lg'
-nlp_location = spacy.load('en_core_web_lg', disable=['parser', 'tagger'])
-doc = nlp_location(book)
-ents = []
-for ent in doc.ents:
-    if not ent.text.strip():
-        continue
-    if ent.label_ not in ["GPE", "LOC", "FAC"]:
-        continue
-    # don't include country names (make a parameter)
-    if ent.text.strip() in skip_list:
-        continue
-    ents.append(ent)
-if not ents:
-    print("empty")
-
-print(f"Found {len(set([ent.text.strip() for ent in ents]))} locations")
-
-for e in set([ent.text.strip() for ent in ents]):
-    print(e)
-# print(set(ents))
+    #
+    # print(tagged)
+    entities = chunk.ne_chunk(tagged)
+    # print(type(entities))
+    # for k, v in entities.items():
+    #     print(k, v)
+    # print(entities)
+
+
+    persons = get_person(entities)
+    # locations = get_location(entities)
+
+    persons_only = [pn[0] for pn in persons]
+    pn_to_tuple = {pn[0]: pn for pn in persons}
+    counts = dict(Counter(persons_only))
+    res = {k: [v, pn_to_tuple[k][1]] for k, v in sorted(counts.items(), key=lambda item: item[1])}
+    print("----------------------------")
+
+    for idx, (k,v) in enumerate(sorted(res.items(), key=lambda item: item[1], reverse=True), start=1):
+        if idx == limit + 1:
+            break
+        print(f"{idx}. {k}, {v}")
+
+    # locations_only = [ln[0] for ln in locations]
+    # ln_to_tuple = {ln[0]: ln for ln in locations}
+    # counts_location = dict(Counter(locations_only))
+    # res_location = {k: [v, ln_to_tuple[k][1]] for k, v in sorted(counts_location.items(), key=lambda item: item[1])}
+    # print("----------------------------")
+    #
+    # for idx, (k, v) in enumerate(sorted(res_location.items(), key=lambda item: item[1], reverse=True), start=1):
+    #     if idx == limit + 1:
+    #         break
+    #     print(f"{idx}. {k}, {v}")
+    #
+    import spacy
+    from nlp_harry_potter import gazetteer
+
+    # Need to run 'python3 -m spacy download en_core_web_lg'
+    nlp_location = spacy.load('en_core_web_lg', disable=['parser', 'tagger'])
+    # the gazetteer stages drop skip-list places and attach ISO codes in the same pass as NER
+    gazetteer.add_gazetteer_pipes(nlp_location)
+    doc = nlp_location(book)
+    ents = doc._.places
+    if not ents:
+        print("empty")
+
+    print(f"Found {len(set([ent.text.strip() for ent in ents]))} locations")
+
+    for e in set([ent.text.strip() for ent in ents]):
+        print(e)
+    # print(set(ents))
     # Location
 #
 # harry [1212, ['NNP']]
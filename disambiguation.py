@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+"""
+Vector-based country picking for place mentions.
+
+The {place: iso} tables of utilities.country_list_maker and utilities.other_vectors are used as labelled
+anchors: each anchor name is embedded with the word vectors of the loaded spaCy model, and all anchor
+vectors are stored as one L2-normalised float32 matrix. Place mentions are embedded from the mention and
+its surrounding context, and all mentions of a book are resolved with a single matrix multiply.
+"""
+from __future__ import unicode_literals
+import numpy as np
+
+from nlp_harry_potter import utilities
+
+
+class CountryAnchors(object):
+    '''
+    Normalised anchor matrix of {place name: iso} pairs.
+    :param names: the anchor place names.
+    :param codes: the ISO code of each anchor name.
+    :param vectors: float32 matrix with one L2-normalised row per anchor.
+    '''
+
+    def __init__(self, names, codes, vectors):
+        # keep anchors sorted by code so the per-country maximum is a single reduceat
+        order = np.argsort(np.asarray(codes), kind='stable')
+        self.names = [names[i] for i in order]
+        self.anchor_codes = np.asarray(codes)[order]
+        self.vectors = np.ascontiguousarray(vectors[order], dtype=np.float32)
+        self.codes, self.code_starts = np.unique(self.anchor_codes, return_index=True)
+
+    @classmethod
+    def from_nlp(cls, nlp_func, cts=None):
+        '''
+        Embed the anchor names with the vectors of a spaCy model (e.g. en_core_web_lg). Only the
+        tokenizer is run; names without any known vector are left out.
+        :param nlp_func: the loaded spaCy Language.
+        :param cts: {place name: iso} anchors, by default country_list_maker() updated with other_vectors().
+        :return: a CountryAnchors instance.
+        '''
+        if not nlp_func.vocab.vectors.size:
+            raise ValueError(f"the model {nlp_func.meta.get('name')!r} has no word vectors; use one that has, "
+                             "e.g. en_core_web_lg, or the plain gazetteer")
+        if cts is None:
+            cts = utilities.country_list_maker()
+            cts.update(utilities.other_vectors())
+        names, codes, vectors = [], [], []
+        for name, code in cts.items():
+            doc = nlp_func.make_doc(name)
+            if not doc.has_vector or not doc.vector_norm:
+                continue
+            names.append(name)
+            codes.append(code)
+            vectors.append(doc.vector)
+        if not names:
+            raise ValueError("none of the anchor names has a vector in the model")
+        return cls(names, codes, _normalise_rows(np.array(vectors, dtype=np.float32)))
+
+    def save(self, path):
+        np.savez(path, names=np.array(self.names), codes=self.anchor_codes, vectors=self.vectors)
+
+    @classmethod
+    def load(cls, path):
+        data = np.load(path)
+        return cls(list(data['names']), list(data['codes']), data['vectors'])
+
+
+def _normalise_rows(matrix):
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1
+    return (matrix / norms).astype(np.float32)
+
+
+def mention_vectors(ents, window=10, context_weight=0.5):
+    '''
+    Embed each place mention as a mix of its own vector and the vector of the tokens around it.
+    :param ents: the place entity spans (from any number of docs).
+    :param window: the number of tokens taken on each side of the mention as context.
+    :param context_weight: the share of the context vector in the mention embedding.
+    :return: float32 matrix with one L2-normalised row per mention.
+    '''
+    if not ents:
+        return np.zeros((0, 0), dtype=np.float32)
+    vectors = np.empty((len(ents), ents[0].vector.shape[0]), dtype=np.float32)
+    for i, ent in enumerate(ents):
+        doc = ent.doc
+        context = doc[max(0, ent.start - window):min(len(doc), ent.end + window)]
+        vectors[i] = (1 - context_weight) * ent.vector + context_weight * context.vector
+    return _normalise_rows(vectors)
+
+
+def disambiguate_places(ents, anchors, min_similarity=0.35, window=10, context_weight=0.5):
+    '''
+    Resolve place mentions to ISO country codes with one batched similarity computation.
+    Mentions whose best country similarity is below min_similarity are left unresolved.
+    :param ents: the place entity spans, e.g. doc._.places from the gazetteer stage.
+    :param anchors: a CountryAnchors instance.
+    :param min_similarity: the cosine similarity needed to accept a country.
+    :param window: see mention_vectors.
+    :param context_weight: see mention_vectors.
+    :return: list of (mention text, iso or None, similarity) in the order of ents.
+    '''
+    if not ents:
+        return []
+    similarity = mention_vectors(ents, window, context_weight) @ anchors.vectors.T
+    # best anchor per country, then best country per mention
+    per_country = np.maximum.reduceat(similarity, anchors.code_starts, axis=1)
+    best = per_country.argmax(axis=1)
+    best_score = per_country[np.arange(len(ents)), best]
+    resolved = []
+    for ent, code, score in zip(ents, anchors.codes[best], best_score):
+        resolved.append((ent.text.strip(), str(code) if score >= min_similarity else None, float(score)))
+    return resolved
@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+"""
+Compiled gazetteer index over the place tables in utilities.py.
+
+The dicts and sets returned by utilities.country_list_maker, other_vectors and make_skip_list are
+built from literals on every call and compared against raw entity text. This module builds them once
+into a frozen index keyed by a normalised (case- and diacritic-folded) form of each name, and exposes
+the index as a spaCy pipeline stage so ISO resolution and skip filtering happen in the same pass as NER.
+"""
+from __future__ import unicode_literals
+import re
+import unicodedata
+from functools import lru_cache
+from types import MappingProxyType
+
+from spacy.language import Language
+from spacy.tokens import Doc, Span
+
+from nlp_harry_potter import utilities
+
+PLACE_LABELS = ("GPE", "LOC", "FAC")
+
+_whitespace = re.compile(r"\s+")
+_punctuation = re.compile(r"[^\w\s]")
+
+
+def normalise_place(text):
+    '''
+    Fold a place name to the form used as key in the gazetteer index.
+    Case and diacritics are folded, punctuation is dropped, whitespace is collapsed and a leading
+    article is removed, so 'the  Black Sea', 'Curaçao' and 'U.S.' become 'black sea', 'curacao' and 'us'.
+    :param text: the raw place name or entity text.
+    :return: the normalised key.
+    '''
+    text = unicodedata.normalize("NFKD", text)
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    text = _punctuation.sub("", text.casefold())
+    text = _whitespace.sub(" ", text).strip()
+    if text.startswith("the "):
+        text = text[4:]
+    return text
+
+
+class Gazetteer(object):
+    '''
+    Frozen, normalised view of the country, extra place and skip tables.
+    :param countries: {"place name": "ISO"} mapping, e.g. the output of utilities.country_list_maker.
+    :param skip_list: iterable of place names that should not be geolocated.
+    '''
+
+    def __init__(self, countries, skip_list):
+        iso = {}
+        for name, code in countries.items():
+            iso.setdefault(normalise_place(name), code)
+        self.iso = MappingProxyType(iso)
+        self.skip = frozenset(normalise_place(name) for name in skip_list)
+        self.names = tuple(sorted(set(countries) | set(skip_list)))
+
+    def __contains__(self, text):
+        key = normalise_place(text)
+        return key in self.iso or key in self.skip
+
+    def resolve(self, text):
+        '''
+        :param text: a place name as it appears in the text.
+        :return: the ISO code of the place, or None if it is unknown or in the skip list.
+        '''
+        key = normalise_place(text)
+        if key in self.skip:
+            return None
+        return self.iso.get(key)
+
+    def is_skipped(self, text):
+        return normalise_place(text) in self.skip
+
+    def patterns(self):
+        '''
+        Build case-sensitive EntityRuler patterns for every resolvable name in the index. Skip-list
+        names get no pattern, so 'us' or 'north' are never tagged. Each name is added with its whitespace
+        collapsed, in its original and diacritic-folded spelling.
+        :return: a list of EntityRuler pattern dicts, with the ISO code as pattern id.
+        '''
+        patterns = []
+        for name in self.names:
+            key = normalise_place(name)
+            if key in self.skip or key not in self.iso:
+                continue
+            name = _whitespace.sub(" ", name).strip()
+            folded = unicodedata.normalize("NFKD", name)
+            folded = "".join(c for c in folded if not unicodedata.combining(c))
+            for spelling in {name, folded}:
+                patterns.append({"label": "GPE", "pattern": spelling, "id": self.iso[key]})
+        return patterns
+
+
+@lru_cache(maxsize=1)
+def default_gazetteer():
+    '''
+    Build the gazetteer from the tables in utilities.py. The result is cached, so the literal tables
+    are only materialised once per process.
+    :return: the shared Gazetteer instance.
+    '''
+    cts = utilities.country_list_maker()
+    cts.update(utilities.other_vectors())
+    return Gazetteer(cts, utilities.make_skip_list(cts))
+
+
+if not Span.has_extension("iso"):
+    Span.set_extension("iso", default=None)
+if not Doc.has_extension("places"):
+    Doc.set_extension("places", default=None)
+
+
+@Language.component("gazetteer_filter")
+def gazetteer_filter(doc):
+    '''
+    Pipeline stage that resolves place entities against the default gazetteer. Place entities in the
+    skip list are dropped from doc._.places, the rest are kept with their ISO code (or None for places
+    not in the gazetteer) on span._.iso.
+    '''
+    gazetteer = default_gazetteer()
+    places = []
+    for ent in doc.ents:
+        if ent.label_ not in PLACE_LABELS or not ent.text.strip():
+            continue
+        key = normalise_place(ent.text)
+        if not key or key in gazetteer.skip:
+            continue
+        ent._.iso = gazetteer.iso.get(key)
+        places.append(ent)
+    doc._.places = places
+    return doc
+
+
+def add_gazetteer_pipes(nlp):
+    '''
+    Add the gazetteer EntityRuler and filter stages to a spaCy pipeline. The ruler runs after the
+    statistical NER (when there is one) and only adds the places it missed: it never overwrites its
+    entities, so Lee Jordan stays a PERSON. Matching is case-sensitive, so the food 'turkey' is not Turkey.
+    :param nlp: a loaded spaCy Language, e.g. spacy.load('en_core_web_lg').
+    :return: the same Language, with the stages added.
+    '''
+    if "gazetteer_ruler" not in nlp.pipe_names:
+        ruler_position = {"after": "ner"} if "ner" in nlp.pipe_names else {}
+        ruler = nlp.add_pipe("entity_ruler", name="gazetteer_ruler",
+                             config={"phrase_matcher_attr": "ORTH", "overwrite_ents": False}, **ruler_position)
+        ruler.add_patterns(default_gazetteer().patterns())
+    if "gazetteer_filter" not in nlp.pipe_names:
+        nlp.add_pipe("gazetteer_filter", last=True)
+    return nlp
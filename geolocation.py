@@ -0,0 +1,185 @@
+# -*- coding: utf-8 -*-
+"""
+Offline geolocation of extracted place entities.
+
+utilities.py keeps the old Elasticsearch helpers (structure_results, read_in_admin1) commented out; this
+module replaces the live search service with a local SQLite store built once from a geonames dump
+(allCountries.txt, cities15000.txt, ... from https://download.geonames.org/export/dump/).
+Names are indexed by their gazetteer key (see gazetteer.normalise_place) for exact lookups, with an
+FTS5 table as a token-level fallback, and hot lookups are kept in an LRU cache.
+"""
+from __future__ import unicode_literals
+import csv
+import os
+import sqlite3
+import sys
+import threading
+from functools import lru_cache
+
+from nlp_harry_potter.gazetteer import normalise_place
+
+# column order of the geonames dump files
+GEONAMES_COLUMNS = ['geonameid', 'name', 'asciiname', 'alternativenames', 'latitude', 'longitude',
+                    'feature_class', 'feature_code', 'country_code2', 'cc2', 'admin1_code', 'admin2_code',
+                    'admin3_code', 'admin4_code', 'population', 'elevation', 'dem', 'timezone',
+                    'modification_date']
+
+RESULT_KEYS = ['admin1_code', 'admin2_code', 'admin3_code', 'admin4_code', 'alternativenames', 'asciiname',
+               'coordinates', 'country_code2', 'country_code3', 'feature_class', 'feature_code', 'geonameid',
+               'modification_date', 'name', 'population']
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS geonames (
+    geonameid INTEGER PRIMARY KEY, name TEXT, asciiname TEXT, alternativenames TEXT,
+    latitude REAL, longitude REAL, feature_class TEXT, feature_code TEXT, country_code2 TEXT,
+    admin1_code TEXT, admin2_code TEXT, admin3_code TEXT, admin4_code TEXT,
+    population INTEGER, modification_date TEXT);
+CREATE TABLE IF NOT EXISTS names (key TEXT, geonameid INTEGER, population INTEGER);
+CREATE TABLE IF NOT EXISTS country_codes (iso2 TEXT PRIMARY KEY, iso3 TEXT);
+CREATE VIRTUAL TABLE IF NOT EXISTS names_fts USING fts5(key, geonameid UNINDEXED);
+'''
+
+
+def read_country_info(filepath):
+    '''
+    Read the geonames countryInfo.txt file into an ISO2 -> ISO3 mapping.
+    :param filepath: path to countryInfo.txt.
+    :return: dictionary, e.g. {"GB": "GBR"}
+    '''
+    codes = {}
+    with open(filepath, encoding='utf-8') as f:
+        for line in f:
+            if line.startswith('#'):
+                continue
+            fields = line.rstrip('\n').split('\t')
+            if len(fields) > 1:
+                codes[fields[0]] = fields[1]
+    return codes
+
+
+def build_geonames_store(dump_path, db_path, country_info_path=None, batch_size=50000):
+    '''
+    Build the local SQLite store from a geonames dump. Every name and alternative name of a record is
+    indexed under its normalised key; this only needs to be done once per dump. The store is built in
+    <db_path>.tmp and renamed over db_path when complete, so an interrupted build leaves any previous store
+    intact, and a rebuild replaces it instead of adding to it.
+    :param dump_path: path to a geonames dump (tab separated, GEONAMES_COLUMNS order).
+    :param db_path: path of the SQLite file to create or replace.
+    :param country_info_path: optional path to countryInfo.txt, used to fill in ISO3 country codes.
+    :param batch_size: the number of rows inserted per executemany call.
+    :return: the path of the store.
+    '''
+    csv.field_size_limit(sys.maxsize)
+    tmp_path = db_path + '.tmp'
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    # no journal: an interrupted build only ever leaves a broken temporary file
+    con = sqlite3.connect(tmp_path)
+    con.execute('PRAGMA journal_mode=OFF')
+    con.execute('PRAGMA synchronous=OFF')
+    con.executescript(_SCHEMA)
+    if country_info_path:
+        con.executemany('INSERT OR REPLACE INTO country_codes VALUES (?, ?)',
+                        read_country_info(country_info_path).items())
+
+    records, names = [], []
+    with open(dump_path, encoding='utf-8', newline='') as f:
+        for row in csv.reader(f, delimiter='\t', quoting=csv.QUOTE_NONE):
+            rec = dict(zip(GEONAMES_COLUMNS, row))
+            population = int(rec['population'] or 0)
+            records.append((int(rec['geonameid']), rec['name'], rec['asciiname'], rec['alternativenames'],
+                            float(rec['latitude']), float(rec['longitude']), rec['feature_class'],
+                            rec['feature_code'], rec['country_code2'], rec['admin1_code'], rec['admin2_code'],
+                            rec['admin3_code'], rec['admin4_code'], population, rec['modification_date']))
+            keys = {normalise_place(n) for n in [rec['name'], rec['asciiname']] + rec['alternativenames'].split(',')}
+            names.extend((key, int(rec['geonameid']), population) for key in keys if key)
+            if len(records) >= batch_size:
+                _insert_batch(con, records, names)
+                records, names = [], []
+    _insert_batch(con, records, names)
+    con.execute('CREATE INDEX IF NOT EXISTS names_key ON names (key, population DESC)')
+    con.commit()
+    con.close()
+    os.replace(tmp_path, db_path)
+    return db_path
+
+
+def _insert_batch(con, records, names):
+    con.executemany('INSERT OR REPLACE INTO geonames VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)', records)
+    con.executemany('INSERT INTO names VALUES (?, ?, ?)', names)
+    con.executemany('INSERT INTO names_fts VALUES (?, ?)', [(key, gid) for key, gid, _ in names])
+
+
+class GeonamesStore(object):
+    '''
+    Read-only handle on a store built by build_geonames_store, safe to share between threads.
+    :param db_path: path to the SQLite store.
+    :param cache_size: the number of distinct place strings whose resolution is kept in memory.
+    :param fuzzy: whether to fall back to a full-text match when the exact key is not found.
+    '''
+
+    def __init__(self, db_path, cache_size=100000, fuzzy=True):
+        self.con = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True, check_same_thread=False)
+        self.con.row_factory = sqlite3.Row
+        # one connection serves every thread, one query at a time
+        self._lock = threading.Lock()
+        self.fuzzy = fuzzy
+        self.country_codes = dict(self.con.execute('SELECT iso2, iso3 FROM country_codes').fetchall())
+        self._lookup = lru_cache(maxsize=cache_size)(self._query)
+
+    def _query(self, key, limit):
+        with self._lock:
+            rows = self.con.execute(
+                'SELECT g.* FROM names n JOIN geonames g ON g.geonameid = n.geonameid '
+                'WHERE n.key = ? ORDER BY n.population DESC LIMIT ?', (key, limit)).fetchall()
+            if not rows and self.fuzzy:
+                query = ' '.join(f'"{token}"' for token in key.split())
+                rows = self.con.execute(
+                    'SELECT g.* FROM names_fts f JOIN geonames g ON g.geonameid = f.geonameid '
+                    'WHERE names_fts MATCH ? ORDER BY g.population DESC LIMIT ?', (query, limit)).fetchall()
+        return tuple(self.structure_row(row) for row in rows)
+
+    def structure_row(self, row):
+        '''Format a geonames row as a dictionary with the keys of the old Elasticsearch results.'''
+        out = {k: row[k] for k in row.keys() if k in RESULT_KEYS}
+        out['alternativenames'] = row['alternativenames'].split(',') if row['alternativenames'] else []
+        out['coordinates'] = f"{row['latitude']},{row['longitude']}"
+        out['country_code3'] = self.country_codes.get(row['country_code2'], '')
+        return out
+
+    def search(self, place, limit=5):
+        '''
+        :param place: the place name as extracted from the text.
+        :param limit: the maximal number of candidates to return.
+        :return: a tuple of candidate records, most populous first. The records are copies, so callers may
+        change them without touching the cached ones.
+        '''
+        key = normalise_place(place)
+        if not key:
+            return ()
+        return tuple(dict(hit, alternativenames=list(hit['alternativenames'])) for hit in self._lookup(key, limit))
+
+    def resolve(self, place):
+        '''
+        :param place: the place name as extracted from the text.
+        :return: the most populous matching record, or None.
+        '''
+        hits = self.search(place, limit=1)
+        return hits[0] if hits else None
+
+    def cache_info(self):
+        return self._lookup.cache_info()
+
+    def close(self):
+        with self._lock:
+            self.con.close()
+
+
+def resolve_places(place_list, store):
+    '''
+    Resolve the place list produced by iterative_NER_v2(..., extract_places=True).
+    :param place_list: the list of place names.
+    :param store: a GeonamesStore.
+    :return: dictionary of {place name: record or None}
+    '''
+    return {place: store.resolve(place) for place in place_list}